@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from bench_utils import latency_summary, write_json
+
+# The chain config the generator bakes into the Hyperion image
+CHAIN_CONFIG = f"hyperion/Deployment/{os.getenv('HYPERION_ENVIRONMENT', 'testnet')}/chains/wax.config.json"
+
+# Share of each query type in a synthetic corpus
+DEFAULT_MIX = "get_actions=60,get_deltas=30,get_transaction=10"
+
+def api_get(url, timeout=30):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.load(response)
+
+def query_limits(path):
+    """Per-endpoint result limits from the chain config's api.limits."""
+    try:
+        with open(path) as f:
+            return json.load(f)["api"]["limits"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+def build_corpus(args):
+    """
+    Sample recent actions and deltas from the running API and turn them into
+    a mix of realistic v2 history queries, with page sizes up to the limits
+    configured in the chain config.
+    """
+    base = args.url.rstrip("/")
+    limits = query_limits(args.chain_config)
+    if not limits:
+        print(f"No api.limits in {args.chain_config}, capping page sizes at 1000")
+    actions = api_get(f"{base}/v2/history/get_actions?limit={args.sample}").get("actions", [])
+    deltas = api_get(f"{base}/v2/history/get_deltas?limit={args.sample}").get("deltas", [])
+    if not actions:
+        raise SystemExit("The API returned no actions to sample; index some blocks first")
+
+    accounts = sorted({auth["actor"] for action in actions for auth in action["act"].get("authorization", [])}
+                      | {action["act"]["account"] for action in actions})
+    contract_actions = sorted({f"{action['act']['account']}:{action['act']['name']}" for action in actions})
+    transactions = sorted({action["trx_id"] for action in actions})
+    tables = sorted({(delta["code"], delta["scope"], delta["table"]) for delta in deltas})
+    times = sorted(action["@timestamp"] for action in actions)
+
+    def page_size(endpoint):
+        return random.choice([10, 100, limits.get(endpoint, 1000)])
+
+    def get_actions():
+        params = {"account": random.choice(accounts), "limit": page_size("get_actions")}
+        variant = random.random()
+        if variant < 0.3:
+            params["filter"] = random.choice(contract_actions)
+        elif variant < 0.5:
+            params["after"], params["before"] = times[0], times[-1]
+        elif variant < 0.6:
+            params["skip"] = random.choice([100, 1000])
+        if random.random() < 0.2:
+            params["sort"] = "asc"
+        return "/v2/history/get_actions", params
+
+    def get_deltas():
+        if not tables:
+            return get_actions()
+        code, scope, table = random.choice(tables)
+        return "/v2/history/get_deltas", {"code": code, "scope": scope, "table": table, "limit": page_size("get_deltas")}
+
+    def get_transaction():
+        return "/v2/history/get_transaction", {"id": random.choice(transactions)}
+
+    generators = {"get_actions": get_actions, "get_deltas": get_deltas, "get_transaction": get_transaction}
+    mix = parse_mix(args.mix)
+    unknown = set(mix) - set(generators)
+    if unknown:
+        raise SystemExit(f"Unknown query types in --mix: {', '.join(sorted(unknown))}")
+    names = list(mix)
+    corpus = []
+    for _ in range(args.size):
+        path, params = generators[random.choices(names, weights=[mix[name] for name in names])[0]]()
+        corpus.append(f"{path}?{urllib.parse.urlencode(params)}")
+    return corpus
+
+def load_corpus(path):
+    """
+    Query paths to replay, one per line: either a bare path such as
+    /v2/history/get_actions?account=eosio (e.g. cut from an access log) or
+    a JSON object with a "path" key.
+    """
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            corpus.append(json.loads(line)["path"] if line.startswith("{") else line)
+    if not corpus:
+        raise SystemExit(f"{path} contains no queries")
+    return corpus
+
+def endpoint_name(path):
+    return urllib.parse.urlsplit(path).path.rstrip("/").rsplit("/", 1)[-1]
+
+def new_stats():
+    return {"latency": [], "query_time": [], "errors": 0, "cached": 0, "bytes": 0}
+
+def run_worker(args, corpus, offset, deadline, limiter, stats, lock):
+    base = args.url.rstrip("/")
+    position = offset
+    while time.monotonic() < deadline:
+        if limiter is not None:
+            limiter()
+        path = corpus[position % len(corpus)]
+        position += 1
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base + path, timeout=args.timeout) as response:
+                body = response.read()
+            elapsed = time.perf_counter() - started
+            result = json.loads(body)
+            error = False
+        except (urllib.error.URLError, OSError, ValueError):
+            elapsed = time.perf_counter() - started
+            result, body, error = {}, b"", True
+
+        with lock:
+            endpoint = stats.setdefault(endpoint_name(path), new_stats())
+            if error:
+                endpoint["errors"] += 1
+                continue
+            endpoint["latency"].append(elapsed)
+            endpoint["bytes"] += len(body)
+            if result.get("cached"):
+                endpoint["cached"] += 1
+            elif "query_time_ms" in result:
+                # Time Hyperion spent waiting on Elasticsearch, without HTTP and serialisation
+                endpoint["query_time"].append(result["query_time_ms"] / 1000)
+
+def rate_limiter(rate):
+    """Spread `rate` requests per second evenly across all workers."""
+    lock = threading.Lock()
+    interval = 1.0 / rate
+    state = {"next": time.monotonic()}
+
+    def wait():
+        with lock:
+            slot = max(state["next"], time.monotonic())
+            state["next"] = slot + interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    return wait
+
+def run_benchmark(args):
+    corpus = load_corpus(args.corpus)
+    limiter = rate_limiter(args.rate) if args.rate else None
+    lock = threading.Lock()
+
+    if args.warmup:
+        print(f"Warming up for {args.warmup:g}s...")
+        warmup_deadline = time.monotonic() + args.warmup
+        threads = [threading.Thread(target=run_worker, args=(args, corpus, i * 7919, warmup_deadline, limiter, {}, lock))
+                   for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    print(f"Replaying {len(corpus)} queries against {args.url} with {args.concurrency} workers for {args.duration:g}s...")
+    stats = {}
+    started = time.monotonic()
+    deadline = started + args.duration
+    # Workers start at different corpus offsets so they do not send the same query in lockstep
+    threads = [threading.Thread(target=run_worker, args=(args, corpus, i * len(corpus) // args.concurrency, deadline, limiter, stats, lock))
+               for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    endpoints = {}
+    for name, endpoint in sorted(stats.items()):
+        requests = len(endpoint["latency"])
+        endpoints[name] = {
+            "requests": requests,
+            "errors": endpoint["errors"],
+            "throughput": round(requests / elapsed, 2),
+            "cached_ratio": round(endpoint["cached"] / requests, 4) if requests else 0,
+            "mean_response_bytes": endpoint["bytes"] // requests if requests else 0,
+            "latency_ms": latency_summary(endpoint["latency"]),
+            "query_time_ms": latency_summary(endpoint["query_time"]),
+        }
+    return {
+        "label": args.label,
+        "url": args.url,
+        "corpus": args.corpus,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "duration": round(elapsed, 3),
+        "requests": sum(endpoint["requests"] for endpoint in endpoints.values()),
+        "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+        "throughput": round(sum(endpoint["requests"] for endpoint in endpoints.values()) / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+def print_benchmark_results(results):
+    print("=" * 78)
+    print(f"{results['requests']} requests, {results['errors']} errors, {results['throughput']} req/sec")
+    print(f"{'endpoint':<18}{'req/s':>9}{'errors':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'ES p99':>10}")
+    for name, endpoint in results["endpoints"].items():
+        latency = endpoint["latency_ms"] or {}
+        query_time = endpoint["query_time_ms"] or {}
+        print(f"{name:<18}{endpoint['throughput']:>9}{endpoint['errors']:>8}"
+              f"{latency.get('p50', '-'):>10}{latency.get('p90', '-'):>10}{latency.get('p99', '-'):>10}"
+              f"{latency.get('max', '-'):>10}{query_time.get('p99', '-'):>10}")
+        if endpoint["cached_ratio"] > 0.1:
+            print(f"  ! {endpoint['cached_ratio']:.0%} of {name} responses came from Hyperion's cache; "
+                  f"set api.enable_caching to false to measure Elasticsearch")
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return "-"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+def compare_results(before, after):
+    """Per-endpoint throughput and latency of `after` relative to `before`."""
+    print(f"Before: {before.get('label') or 'before'} ({before['concurrency']} workers, {before['duration']:g}s)")
+    print(f"After:  {after.get('label') or 'after'} ({after['concurrency']} workers, {after['duration']:g}s)")
+    print(f"{'endpoint':<18}{'metric':<12}{'before':>12}{'after':>12}{'change':>10}")
+    for name in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        old = before["endpoints"].get(name)
+        new = after["endpoints"].get(name)
+        if old is None or new is None:
+            print(f"{name:<18}only in {'after' if old is None else 'before'}")
+            continue
+        rows = [("req/s", old["throughput"], new["throughput"])]
+        for key in ("p50", "p90", "p99"):
+            rows.append((f"{key} ms", (old["latency_ms"] or {}).get(key), (new["latency_ms"] or {}).get(key)))
+        rows.append(("ES p99 ms", (old["query_time_ms"] or {}).get("p99"), (new["query_time_ms"] or {}).get("p99")))
+        rows.append(("errors", old["errors"], new["errors"]))
+        for metric, old_value, new_value in rows:
+            print(f"{name:<18}{metric:<12}{str(old_value if old_value is not None else '-'):>12}"
+                  f"{str(new_value if new_value is not None else '-'):>12}{change(old_value, new_value):>10}")
+            name = ""
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay Hyperion v2 history queries and measure Elasticsearch-backed latency")
+    parser.add_argument("--url", default="http://localhost:7000", help="Hyperion API base URL")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    corpus = subparsers.add_parser("corpus", help="Build a synthetic query corpus from data sampled from the API")
+    corpus.add_argument("--output", default="hyperion-queries.jsonl")
+    corpus.add_argument("--size", type=int, default=1000, help="Number of queries")
+    corpus.add_argument("--sample", type=int, default=500, help="Recent actions and deltas sampled for accounts, contracts and tables")
+    corpus.add_argument("--mix", default=DEFAULT_MIX, help=f"Weights per query type (default: {DEFAULT_MIX})")
+    corpus.add_argument("--chain-config", default=CHAIN_CONFIG,
+                        help=f"Chain config whose api.limits bound the page sizes (default: {CHAIN_CONFIG})")
+    corpus.add_argument("--seed", type=int, help="Random seed, for a reproducible corpus")
+
+    run = subparsers.add_parser("run", help="Replay a corpus and report throughput and latency per endpoint")
+    run.add_argument("--corpus", default="hyperion-queries.jsonl", help="Corpus file: query paths or {\"path\": ...} JSON, one per line")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--duration", type=float, default=60, help="Measured seconds")
+    run.add_argument("--warmup", type=float, default=10, help="Unmeasured seconds first, to warm Elasticsearch caches")
+    run.add_argument("--rate", type=float, default=0, help="Total requests/sec, 0 for closed-loop (as fast as the workers go)")
+    run.add_argument("--timeout", type=float, default=30)
+    run.add_argument("--label", default="", help="Name for this run in comparisons, e.g. the config change under test")
+    run.add_argument("--json", metavar="PATH", help="Write results as JSON to PATH, or - for stdout")
+
+    compare = subparsers.add_parser("compare", help="Compare two run results")
+    compare.add_argument("before")
+    compare.add_argument("after")
+
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "corpus":
+        random.seed(args.seed)
+        queries = build_corpus(args)
+        with open(args.output, "w") as f:
+            for query in queries:
+                f.write(json.dumps({"path": query}) + "\n")
+        print(f"Wrote {len(queries)} queries to {args.output}")
+    elif args.command == "run":
+        results = run_benchmark(args)
+        print_benchmark_results(results)
+        write_json(results, args.json)
+        sys.exit(1 if results["requests"] == 0 else 0)
+    elif args.command == "compare":
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        compare_results(before, after)
@@ -0,0 +1,32 @@
+"""Result helpers shared by the benchmark scripts (test_loadbalancer.py, bench_hyperion_queries.py)."""
+import json
+import math
+
+def latency_summary(samples):
+    """Summarise latency samples (seconds) as milliseconds using nearest-rank percentiles."""
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def percentile(p):
+        index = min(len(samples) - 1, max(0, math.ceil(p / 100.0 * len(samples)) - 1))
+        return round(samples[index] * 1000, 3)
+
+    return {
+        "count": len(samples),
+        "mean": round(sum(samples) / len(samples) * 1000, 3),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "p999": percentile(99.9),
+        "max": round(samples[-1] * 1000, 3),
+    }
+
+def write_json(results, path):
+    """Write results as JSON to `path`, or to stdout when it is "-"."""
+    if path == "-":
+        print(json.dumps(results, indent=2))
+    elif path:
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {path}")
@@ -1,95 +1,703 @@
-from prometheus_client import start_http_server, Gauge
-import requests
+from prometheus_client import start_http_server, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, Metric
+from collections import OrderedDict, deque
+import aiohttp
+import asyncio
+import json
+import os
+import threading
 import time
 from datetime import datetime
+from ship_reader import stream_blocks, ShipDecodeError
+
+# Exporter configuration
+# NODEOS_ENDPOINTS is a comma separated list of "label=url" entries, optionally
+# suffixed with "|timeout" (seconds), e.g.
+#   NODEOS_ENDPOINTS="node=http://node:8888,backup=http://node2:8888|2"
+nodeos_endpoints = os.getenv("NODEOS_ENDPOINTS", "node=http://node:8888")
+nodeos_timeout = float(os.getenv("NODEOS_TIMEOUT", "5"))
+poll_interval = float(os.getenv("POLL_INTERVAL", "1"))
+exporter_port = int(os.getenv("EXPORTER_PORT", "8000"))
+history_size = int(os.getenv("HISTORY_SIZE", "120"))
+# EXPORTER_MODE is "poll" (get_info over HTTP), "ship" (state-history block stream)
+# or "scrape" (get_info fetched on demand when Prometheus scrapes)
+exporter_mode = os.getenv("EXPORTER_MODE", "poll")
+nodeos_ship_urls = os.getenv("NODEOS_SHIP_URL", "node=ws://node:9876")
+ship_max_in_flight = int(os.getenv("SHIP_MAX_IN_FLIGHT", "16"))
+producer_table_size = max(2, int(os.getenv("PRODUCER_TABLE_SIZE", "64")))
+schedule_refresh_interval = float(os.getenv("SCHEDULE_REFRESH_INTERVAL", "60"))
+cache_ttl = float(os.getenv("CACHE_TTL", "1"))
+# RPC probe suite run against NODEOS_ENDPOINTS; empty disables it
+nodeos_probes = os.getenv("NODEOS_PROBES", "get_info,get_block,get_account,get_table_rows")
+probe_interval = float(os.getenv("PROBE_INTERVAL", "5"))
+probe_account = os.getenv("PROBE_ACCOUNT", "eosio")
 
 # Define Prometheus metrics
-head_block_number = Gauge("nodeos_head_block_number", "Head block number")
-head_block_time = Gauge("nodeos_head_block_time", "Head block time as Unix timestamp")
-head_block_producer = Gauge("nodeos_head_block_producer", "Head block producer", ["producer"])
-last_irreversible_block_number = Gauge("nodeos_last_irreversible_block_number", "Last irreversible block number")
-last_irreversible_block_time = Gauge("nodeos_last_irreversible_block_time", "Last irreversible block time as Unix timestamp")
-producer_rounds = Gauge("nodeos_producer_rounds", "Number of rounds completed by each producer", ["producer"])
+head_block_number = Gauge("nodeos_head_block_number", "Head block number", ["endpoint"])
+head_block_time = Gauge("nodeos_head_block_time", "Head block time as Unix timestamp", ["endpoint"])
+head_block_producer = Gauge("nodeos_head_block_producer", "Head block producer", ["endpoint", "producer"])
+last_irreversible_block_number = Gauge("nodeos_last_irreversible_block_number", "Last irreversible block number", ["endpoint"])
+last_irreversible_block_time = Gauge("nodeos_last_irreversible_block_time", "Last irreversible block time as Unix timestamp", ["endpoint"])
+producer_rounds = Gauge("nodeos_producer_rounds", "Number of rounds completed by each producer", ["endpoint", "producer"])
+endpoint_up = Gauge("nodeos_up", "Whether the last get_info call to the endpoint succeeded", ["endpoint"])
+
+# Metrics derived from the recent get_info history
+blocks_per_second = Gauge("nodeos_blocks_per_second", "Head block production rate over the sample history window", ["endpoint"])
+head_block_lag = Gauge("nodeos_head_block_lag_seconds", "Wall clock time minus head block time", ["endpoint"])
+head_lib_distance = Histogram(
+    "nodeos_head_lib_distance_blocks",
+    "Distance between head and last irreversible block per sample",
+    ["endpoint"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 200, 300, 350, 400, 500, 1000, 5000, 10000),
+)
+head_rollbacks = Counter("nodeos_head_rollbacks_total", "Head block rollbacks (micro-forks) detected between samples", ["endpoint"])
+head_rollback_depth = Gauge("nodeos_head_rollback_depth_blocks", "Depth of the most recent head block rollback", ["endpoint"])
+
+# Per-block metrics, only populated in ship mode
+blocks_produced = Counter("nodeos_blocks_produced_total", "Blocks received from state history per producer", ["endpoint", "producer"])
+block_transactions = Histogram(
+    "nodeos_block_transactions",
+    "Transactions per block",
+    ["endpoint"],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+block_cpu_usage = Histogram(
+    "nodeos_block_cpu_usage_microseconds",
+    "Billed CPU per block",
+    ["endpoint"],
+    buckets=(0, 100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 200000),
+)
+block_net_usage = Histogram(
+    "nodeos_block_net_usage_bytes",
+    "Billed NET per block",
+    ["endpoint"],
+    buckets=(0, 128, 512, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+ship_reconnects = Counter("nodeos_ship_reconnects_total", "State history connections re-established after an error", ["endpoint"])
+
+# RPC probe metrics. Buckets follow the native histogram exponential schema 1
+# (growth factor sqrt(2)) so they can be compared with native histograms.
+rpc_duration = Histogram(
+    "nodeos_rpc_duration_seconds",
+    "Latency of probed chain API calls, including reading the response body",
+    ["endpoint", "rpc"],
+    buckets=[round(0.001 * 2 ** (i / 2), 6) for i in range(29)],
+)
+rpc_response_size = Histogram(
+    "nodeos_rpc_response_size_bytes",
+    "Body size of probed chain API responses",
+    ["endpoint", "rpc"],
+    buckets=[256 * 4 ** i for i in range(9)],
+)
+rpc_requests = Counter("nodeos_rpc_requests_total", "Probed chain API calls", ["endpoint", "rpc"])
+rpc_errors = Counter("nodeos_rpc_errors_total", "Failed probed chain API calls", ["endpoint", "rpc", "reason"])
+
+# Exporter self-metrics
+producer_labels = Gauge("nodeos_exporter_producer_labels", "Producers currently tracked with a producer label", ["endpoint"])
+producer_evictions = Counter("nodeos_exporter_producer_evictions_total", "Producers evicted from the label table together with their series", ["endpoint"])
+fetch_duration = Histogram(
+    "nodeos_exporter_fetch_duration_seconds",
+    "Duration of the exporter's get_info polls",
+    ["endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+fetch_errors = Counter("nodeos_exporter_fetch_errors_total", "get_info polls that failed", ["endpoint"])
+parse_errors = Counter("nodeos_exporter_parse_errors_total", "Responses or blocks that could not be parsed", ["endpoint"])
+last_success = Gauge("nodeos_exporter_last_success_timestamp_seconds", "Unix time of the last successfully processed sample", ["endpoint"])
+missed_ticks = Counter("nodeos_exporter_missed_ticks_total", "Scheduled ticks skipped because the previous iteration overran", ["endpoint", "loop"])
+tick_jitter = Histogram(
+    "nodeos_exporter_tick_jitter_seconds",
+    "Delay between a scheduled tick and the loop actually waking up",
+    ["endpoint", "loop"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5),
+)
+
+class FixedRateSchedule:
+    """
+    Fixed-rate ticker on the monotonic clock. Tick times are derived from the
+    start time rather than from when the previous iteration finished, so
+    request latency and sleep overshoot never accumulate into drift. Ticks
+    that pass while an iteration is still running are counted as missed and
+    skipped, keeping the loop in phase.
+    """
+
+    def __init__(self, interval, name, loop):
+        self.interval = interval
+        self.name = name
+        self.loop = loop
+        self.next_tick = time.monotonic()
+
+    async def wait(self):
+        self.next_tick += self.interval
+        now = time.monotonic()
+        if now >= self.next_tick:
+            missed = int((now - self.next_tick) // self.interval) + 1
+            self.next_tick += missed * self.interval
+            missed_ticks.labels(endpoint=self.name, loop=self.loop).inc(missed)
+        await asyncio.sleep(self.next_tick - now)
+        tick_jitter.labels(endpoint=self.name, loop=self.loop).observe(max(0.0, time.monotonic() - self.next_tick))
+
+class ProducerTable:
+    """
+    Fixed-capacity store of the producers an endpoint has seen, backing every
+    metric with a producer label. Entries are kept in least-recently-seen
+    order; when the table is full the stalest producer outside the current
+    schedule is evicted, so series count stays bounded over long uptimes.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.rounds = OrderedDict()
+        self.schedule = frozenset()
 
-def fetch_nodeos_data(url):
+    def __contains__(self, producer):
+        return producer in self.rounds
+
+    def __len__(self):
+        return len(self.rounds)
+
+    def set_schedule(self, producers):
+        self.schedule = frozenset(producers)
+
+    def touch(self, producer):
+        """
+        Mark a producer as most recently seen, adding it if needed.
+        Returns the producers evicted to make room.
+        """
+        if producer in self.rounds:
+            self.rounds.move_to_end(producer)
+            return []
+
+        evicted = []
+        while len(self.rounds) >= self.size:
+            victim = next((p for p in self.rounds if p not in self.schedule), None)
+            if victim is None:
+                victim = next(iter(self.rounds))
+            del self.rounds[victim]
+            evicted.append(victim)
+        self.rounds[producer] = 0
+        return evicted
+
+class BlockHistory:
+    """
+    Fixed-size ring buffer of (head_block_num, head_block_time, lib_num, head_block_id,
+    received_at) samples, where received_at is the wall-clock time the sample
+    arrived at the exporter. Derived values are computed from the buffer ends and the previous
+    sample only, so every update is O(1) regardless of the window size.
+    """
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+
+    def add(self, head_num, head_time, lib_num, head_id=None, received_at=None):
+        """
+        Record a sample and return the rollback depth it revealed (0 if none).
+        A rollback is a head that went backwards, or the same head number
+        reported with a different block id.
+        """
+        depth = 0
+        if self.samples:
+            prev_num, _, _, prev_id, _ = self.samples[-1]
+            if head_num < prev_num:
+                depth = prev_num - head_num + 1
+            elif head_num == prev_num and head_id and prev_id and head_id != prev_id:
+                depth = 1
+
+        if depth:
+            # Samples past the fork point describe the abandoned branch
+            while self.samples and self.samples[-1][0] >= head_num:
+                self.samples.pop()
+
+        self.samples.append((head_num, head_time, lib_num, head_id, time.time() if received_at is None else received_at))
+        return depth
+
+    def blocks_per_second(self):
+        """
+        Head block advance rate between the oldest and newest sample, measured
+        against the time the samples were received rather than their block
+        timestamps, so a stalled or catching-up node shows its real rate.
+        Returns None until the window spans some wall-clock time.
+        """
+        if len(self.samples) < 2:
+            return None
+        first_num, first_received = self.samples[0][0], self.samples[0][4]
+        last_num, last_received = self.samples[-1][0], self.samples[-1][4]
+        if last_received <= first_received:
+            return None
+        return (last_num - first_num) / (last_received - first_received)
+
+def parse_endpoints(spec, default_timeout):
+    """
+    Parse the NODEOS_ENDPOINTS specification into a list of endpoint dicts.
+    Entries without a label are named after their position in the list.
     """
-    Fetch data from the Nodeos API.
+    endpoints = []
+    for index, entry in enumerate(spec.split(","), start=1):
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        timeout = default_timeout
+        if "|" in entry:
+            entry, timeout = entry.rsplit("|", 1)
+            timeout = float(timeout)
+
+        if "=" in entry:
+            name, url = entry.split("=", 1)
+        else:
+            name, url = f"node{index}", entry
+
+        endpoints.append({
+            "name": name.strip(),
+            "url": url.strip().rstrip("/"),
+            "timeout": timeout,
+        })
+    return endpoints
+
+async def fetch_nodeos_data(session, endpoint, path="get_info"):
+    """
+    Fetch a chain API call from a Nodeos endpoint over the shared session.
     Returns the JSON response if successful, or None if an error occurs.
     """
+    url = f"{endpoint['url']}/v1/chain/{path}"
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()  # Raise an HTTPError for bad responses (4xx and 5xx)
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data from Nodeos API: {e}")
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=endpoint["timeout"])) as response:
+            response.raise_for_status()  # Raise for bad responses (4xx and 5xx)
+            return await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error fetching data from Nodeos API ({endpoint['name']}): {e!r}")
+        return None
+    except ValueError as e:
+        parse_errors.labels(endpoint=endpoint["name"]).inc()
+        print(f"Invalid JSON from Nodeos API ({endpoint['name']}): {e}")
         return None
 
-def process_metrics(data, current_producer, producer_round_counts):
+def parse_block_time(value):
+    """Convert a nodeos ISO block time to a Unix timestamp."""
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+def process_metrics(data, endpoint, state):
     """
     Process and update Prometheus metrics based on Nodeos data.
+    `state` holds the per-endpoint producer tracking between samples.
+    Returns True if the sample was processed completely.
     """
+    name = endpoint["name"]
     try:
         # Update head block number
-        head_block_number.set(data["head_block_num"])
+        head_num = data["head_block_num"]
+        head_block_number.labels(endpoint=name).set(head_num)
 
         # Convert head block time to Unix timestamp and update metric
-        head_block_time_iso = data["head_block_time"]
-        head_block_time_unix = datetime.fromisoformat(head_block_time_iso.replace("Z", "+00:00")).timestamp()
-        head_block_time.set(head_block_time_unix)
+        head_time = parse_block_time(data["head_block_time"])
+        head_block_time.labels(endpoint=name).set(head_time)
 
         # Update producer
-        producer = data["head_block_producer"]
-
-        # Count rounds only when the producer changes
-        if current_producer != producer:
-            if producer not in producer_round_counts:
-                producer_round_counts[producer] = 0
-            producer_round_counts[producer] += 1
-            producer_rounds.labels(producer=producer).set(producer_round_counts[producer])
-
-        # Update the Prometheus producer metric
-        if current_producer and current_producer != producer:
-            head_block_producer.clear()  # Removes all existing labels
-        head_block_producer.labels(producer=producer).set(1)
+        update_producer(name, data["head_block_producer"], state)
 
         # Update last irreversible block number
-        last_irreversible_block_number.set(data["last_irreversible_block_num"])
+        lib_num = data["last_irreversible_block_num"]
+        last_irreversible_block_number.labels(endpoint=name).set(lib_num)
 
         # Convert last irreversible block time to Unix timestamp and update metric
-        last_irreversible_block_time_iso = data["last_irreversible_block_time"]
-        last_irreversible_block_time_unix = datetime.fromisoformat(last_irreversible_block_time_iso.replace("Z", "+00:00")).timestamp()
-        last_irreversible_block_time.set(last_irreversible_block_time_unix)
+        last_irreversible_block_time.labels(endpoint=name).set(parse_block_time(data["last_irreversible_block_time"]))
 
-        return producer
+        update_derived_metrics(name, state["history"], head_num, head_time, lib_num, data.get("head_block_id"))
+        return True
     except KeyError as e:
-        print(f"Missing key in Nodeos data: {e}")
+        print(f"Missing key in Nodeos data ({name}): {e}")
     except ValueError as e:
-        print(f"Error processing block time: {e}")
+        print(f"Error processing block time ({name}): {e}")
     except Exception as e:
-        print(f"Unexpected error processing metrics: {e}")
-    return current_producer  # Return the current producer unchanged in case of error
+        print(f"Unexpected error processing metrics ({name}): {e}")
+    parse_errors.labels(endpoint=name).inc()
+    return False
+
+def remove_producer_series(name, producer):
+    """Drop every series labelled with an evicted producer."""
+    for metric in (producer_rounds, head_block_producer, blocks_produced):
+        try:
+            metric.remove(name, producer)
+        except KeyError:
+            pass
+
+def update_producer(name, producer, state):
+    """
+    Update the head producer and round count metrics for a new head block.
+    """
+    current_producer = state["current_producer"]
+    producers = state["producers"]
+
+    # Count rounds only when the producer changes
+    if current_producer != producer:
+        for evicted in producers.touch(producer):
+            remove_producer_series(name, evicted)
+            producer_evictions.labels(endpoint=name).inc()
+        producers.rounds[producer] += 1
+        producer_rounds.labels(endpoint=name, producer=producer).set(producers.rounds[producer])
+        producer_labels.labels(endpoint=name).set(len(producers))
+
+        # Flip the head producer flag; children stay allocated for tracked producers
+        if current_producer in producers:
+            head_block_producer.labels(endpoint=name, producer=current_producer).set(0)
+        head_block_producer.labels(endpoint=name, producer=producer).set(1)
+
+    state["current_producer"] = producer
+
+def parse_producer_schedule(data):
+    """
+    Collect the producer names of the active and pending schedules from a
+    get_producer_schedule response.
+    """
+    producers = set()
+    for key in ("active", "pending"):
+        schedule = data.get(key) or {}
+        for entry in schedule.get("producers", []):
+            producers.add(entry["producer_name"])
+    return producers
+
+def update_derived_metrics(name, history, head_num, head_time, lib_num, head_id):
+    """
+    Feed one sample into the endpoint's history and update the derived
+    production rate, lag, LIB distance and rollback series.
+    """
+    depth = history.add(head_num, head_time, lib_num, head_id)
+    if depth:
+        head_rollbacks.labels(endpoint=name).inc()
+        head_rollback_depth.labels(endpoint=name).set(depth)
+        print(f"Head rollback of {depth} block(s) detected on {name} at block {head_num}")
+
+    rate = history.blocks_per_second()
+    if rate is not None:
+        blocks_per_second.labels(endpoint=name).set(rate)
+
+    head_block_lag.labels(endpoint=name).set(time.time() - head_time)
+    head_lib_distance.labels(endpoint=name).observe(head_num - lib_num)
+
+def new_endpoint_state():
+    return {
+        "current_producer": None,
+        "producers": ProducerTable(producer_table_size),
+        "history": BlockHistory(history_size),
+        "schedule_checked": None,
+        "fetched_at": None,
+    }
 
-def collect_metrics():
+def update_lib_time(name, block_times, head_num, head_time, lib_num):
     """
-    Main loop to collect metrics and update Prometheus.
+    Track the timestamps of the blocks between LIB and head and publish the
+    LIB time once the stream has delivered the LIB block itself. SHiP results
+    only carry the LIB number, so the time is unknown until then.
     """
-    nodeos_url = "http://node:8888/v1/chain/get_info"
-    current_producer = None  # Track the current producer to manage label updates
-    producer_round_counts = {}  # Track the number of rounds for each producer
+    block_times[head_num] = head_time
+    lib_time = block_times.get(lib_num)
+    if lib_time is not None:
+        last_irreversible_block_time.labels(endpoint=name).set(lib_time)
+    while block_times and next(iter(block_times)) < lib_num:
+        block_times.popitem(last=False)
 
+def process_ship_block(result, endpoint, state):
+    """
+    Update metrics from a single get_blocks result received over state history.
+    """
+    name = endpoint["name"]
+    block = result["block"]
+    this_block = result["this_block"]
+    if block is None or this_block is None:
+        return
+
+    head_num = this_block["block_num"]
+    lib_num = result["last_irreversible"]["block_num"]
+
+    head_block_number.labels(endpoint=name).set(head_num)
+    head_block_time.labels(endpoint=name).set(block["timestamp"])
+    last_irreversible_block_number.labels(endpoint=name).set(lib_num)
+    update_lib_time(name, state["block_times"], head_num, block["timestamp"], lib_num)
+    if block["schedule_producers"]:
+        state["producers"].set_schedule(block["schedule_producers"])
+    update_producer(name, block["producer"], state)
+
+    blocks_produced.labels(endpoint=name, producer=block["producer"]).inc()
+    block_transactions.labels(endpoint=name).observe(block["transactions"])
+    block_cpu_usage.labels(endpoint=name).observe(block["cpu_usage_us"])
+    block_net_usage.labels(endpoint=name).observe(block["net_usage_words"] * 8)
+
+    update_derived_metrics(name, state["history"], head_num, block["timestamp"], lib_num, this_block["block_id"])
+
+async def follow_ship_endpoint(session, endpoint):
+    """
+    Consume the state history block stream of one endpoint forever, resuming
+    after the last processed block whenever the connection drops.
+    """
+    name = endpoint["name"]
+    state = new_endpoint_state()
+    state["block_times"] = OrderedDict()
+    next_block = None
+    failures = 0
     while True:
-        data = fetch_nodeos_data(nodeos_url)
-        if data:
-            current_producer = process_metrics(data, current_producer, producer_round_counts)
-        else:
-            print("Skipping metric update due to failed data fetch.")
-        time.sleep(1)
+        try:
+            async for result in stream_blocks(session, endpoint, next_block, ship_max_in_flight):
+                endpoint_up.labels(endpoint=name).set(1)
+                failures = 0
+                try:
+                    process_ship_block(result, endpoint, state)
+                    last_success.labels(endpoint=name).set(time.time())
+                except Exception as e:
+                    # Skip the block but keep the stream, and every other endpoint's task, alive
+                    parse_errors.labels(endpoint=name).inc()
+                    print(f"Error processing state history block from {name}: {e!r}")
+                if result["this_block"] is not None:
+                    next_block = result["this_block"]["block_num"] + 1
+        except ShipDecodeError as e:
+            parse_errors.labels(endpoint=name).inc()
+            print(f"Undecodable state history message from {name}: {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"State history stream from {name} failed: {e!r}")
+
+        endpoint_up.labels(endpoint=name).set(0)
+        failures += 1
+        await asyncio.sleep(min(2 ** failures, 30))
+        ship_reconnects.labels(endpoint=name).inc()
+
+async def sample_endpoint(session, endpoint, state):
+    """
+    Take one get_info sample from an endpoint, refreshing its producer
+    schedule when due, and update every metric derived from it. Shared by
+    the poll loop and the on-scrape collector.
+    """
+    name = endpoint["name"]
+    if state["schedule_checked"] is None or time.monotonic() - state["schedule_checked"] >= schedule_refresh_interval:
+        producer_schedule = await fetch_nodeos_data(session, endpoint, "get_producer_schedule")
+        if producer_schedule:
+            state["producers"].set_schedule(parse_producer_schedule(producer_schedule))
+        state["schedule_checked"] = time.monotonic()
+
+    started = time.perf_counter()
+    data = await fetch_nodeos_data(session, endpoint)
+    fetch_duration.labels(endpoint=name).observe(time.perf_counter() - started)
+    state["fetched_at"] = time.time()
+    if data:
+        endpoint_up.labels(endpoint=name).set(1)
+        if process_metrics(data, endpoint, state):
+            last_success.labels(endpoint=name).set(time.time())
+    else:
+        endpoint_up.labels(endpoint=name).set(0)
+        fetch_errors.labels(endpoint=name).inc()
+        print(f"Skipping metric update for {name} due to failed data fetch.")
+
+async def poll_endpoint(session, endpoint):
+    """
+    Poll a single endpoint forever. Every endpoint runs in its own task so a
+    slow or unreachable node never delays samples from the others.
+    """
+    state = new_endpoint_state()
+    schedule = FixedRateSchedule(poll_interval, endpoint["name"], "poll")
+    while True:
+        await sample_endpoint(session, endpoint, state)
+        await schedule.wait()
+
+# Scrape mode families taken straight from get_info
+GET_INFO_FAMILIES = {
+    "nodeos_up",
+    "nodeos_head_block_number",
+    "nodeos_head_block_time",
+    "nodeos_head_block_producer",
+    "nodeos_last_irreversible_block_number",
+    "nodeos_last_irreversible_block_time",
+}
+
+class OnScrapeCollector:
+    """
+    Collector for scrape mode: endpoints are sampled only when Prometheus
+    scrapes, and the result is cached for `ttl` seconds. Refreshes are
+    single-flight, so concurrent scrapes (e.g. from an HA Prometheus pair)
+    share one upstream call per endpoint, and a refresh that times out is
+    cancelled so a stalled fetch never overlaps the next one. The get_info
+    families carry the timestamp of the fetch that produced them.
+
+    A refresh goes through the same sample_endpoint and probe_round code as
+    poll mode, so the derived metrics, exporter self metrics and probes are
+    all exported; probe rounds still run at most every PROBE_INTERVAL.
+
+    collect() runs on the HTTP server threads; fetches are scheduled on the
+    event loop that owns the shared aiohttp session.
+    """
+
+    def __init__(self, endpoints, session, loop, ttl, rpcs=(), registry=REGISTRY):
+        self.endpoints = endpoints
+        self.session = session
+        self.loop = loop
+        self.ttl = ttl
+        self.rpcs = rpcs
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.states = {endpoint["name"]: new_endpoint_state() for endpoint in endpoints}
+        self.probe_states = {endpoint["name"]: {"lib": None, "probed_at": None} for endpoint in endpoints}
+        self.refreshed_at = None
+        self.pending = None
+        self.fetches = 0
+        self.cache_hits = 0
+
+    async def refresh_endpoint(self, endpoint):
+        tasks = [sample_endpoint(self.session, endpoint, self.states[endpoint["name"]])]
+        probe_state = self.probe_states[endpoint["name"]]
+        if self.rpcs and (probe_state["probed_at"] is None or time.monotonic() - probe_state["probed_at"] >= probe_interval):
+            probe_state["probed_at"] = time.monotonic()
+            tasks.append(probe_round(self.session, endpoint, self.rpcs, probe_state))
+        await asyncio.gather(*tasks)
+
+    async def refresh_all(self):
+        await asyncio.gather(*(self.refresh_endpoint(endpoint) for endpoint in self.endpoints))
+
+    def refresh(self):
+        """Sample every endpoint unless the cached metrics are still fresh."""
+        with self.lock:
+            if self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.ttl:
+                self.cache_hits += 1
+                return
+
+            # A cancelled refresh may still be unwinding on the event loop;
+            # serve what it left rather than racing it on the same state
+            if self.pending is not None and not self.pending.done():
+                self.cache_hits += 1
+                return
+
+            # get_producer_schedule and get_info run back to back
+            timeout = 2 * max(endpoint["timeout"] for endpoint in self.endpoints) + 1
+            self.pending = asyncio.run_coroutine_threadsafe(self.refresh_all(), self.loop)
+            try:
+                self.pending.result(timeout)
+            except Exception:
+                self.pending.cancel()
+                raise
+            self.refreshed_at = time.monotonic()
+            self.fetches += 1
+
+    def timestamped(self, family):
+        """Copy of `family` with each sample stamped with its endpoint's get_info fetch time."""
+        copy = Metric(family.name, family.documentation, family.type, family.unit)
+        for sample in family.samples:
+            state = self.states.get(sample.labels.get("endpoint"))
+            fetched_at = state["fetched_at"] if state else None
+            copy.samples.append(sample._replace(timestamp=fetched_at) if fetched_at else sample)
+        return copy
+
+    def collect(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Error refreshing endpoint samples: {e!r}")
+
+        for family in self.registry.collect():
+            yield self.timestamped(family) if family.name in GET_INFO_FAMILIES else family
+        yield CounterMetricFamily("nodeos_exporter_upstream_fetches", "Endpoint refreshes triggered by scrapes", value=self.fetches)
+        yield CounterMetricFamily("nodeos_exporter_cache_hits", "Scrapes served from the cache", value=self.cache_hits)
+
+async def serve_on_scrape(endpoints, rpcs=()):
+    """
+    Scrape mode: serve a dedicated registry whose collector samples nodeos
+    on demand, so nothing polls nodeos while nobody is scraping.
+    """
+    loop = asyncio.get_running_loop()
+    connector = aiohttp.TCPConnector(limit_per_host=4, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        registry = CollectorRegistry()
+        registry.register(OnScrapeCollector(endpoints, session, loop, cache_ttl, rpcs))
+        start_http_server(exporter_port, registry=registry)
+        print(f"Prometheus metrics server started on port {exporter_port}")
+        await asyncio.Event().wait()
+
+def probe_request(rpc, probe_state):
+    """
+    Build the JSON body for a probe, or None if it cannot run yet (get_block
+    waits until a get_info probe has reported an irreversible block).
+    Any chain API without a dedicated body is probed with an empty object.
+    """
+    if rpc == "get_block":
+        if probe_state.get("lib") is None:
+            return None
+        return {"block_num_or_id": probe_state["lib"]}
+    if rpc == "get_account":
+        return {"account_name": probe_account}
+    if rpc == "get_table_rows":
+        return {"code": "eosio", "scope": "eosio", "table": "global", "json": True, "limit": 1}
+    return {}
+
+async def run_probe(session, endpoint, rpc, body):
+    """
+    Call one chain API and record its latency, payload size and outcome.
+    Returns the decoded response, or None on failure.
+    """
+    name = endpoint["name"]
+    url = f"{endpoint['url']}/v1/chain/{rpc}"
+    rpc_requests.labels(endpoint=name, rpc=rpc).inc()
+    started = time.perf_counter()
+    try:
+        async with session.post(url, json=body, timeout=aiohttp.ClientTimeout(total=endpoint["timeout"])) as response:
+            payload = await response.read()
+            rpc_duration.labels(endpoint=name, rpc=rpc).observe(time.perf_counter() - started)
+            rpc_response_size.labels(endpoint=name, rpc=rpc).observe(len(payload))
+            if response.status >= 400:
+                rpc_errors.labels(endpoint=name, rpc=rpc, reason=f"http_{response.status}").inc()
+                return None
+            return json.loads(payload)
+    except asyncio.TimeoutError:
+        rpc_errors.labels(endpoint=name, rpc=rpc, reason="timeout").inc()
+    except aiohttp.ClientError:
+        rpc_errors.labels(endpoint=name, rpc=rpc, reason="connection").inc()
+    except ValueError:
+        rpc_errors.labels(endpoint=name, rpc=rpc, reason="decode").inc()
+    return None
+
+async def probe_round(session, endpoint, rpcs, probe_state):
+    """Run the configured probe set once, with all probes in flight concurrently."""
+    requests = [(rpc, probe_request(rpc, probe_state)) for rpc in rpcs]
+    requests = [(rpc, body) for rpc, body in requests if body is not None]
+    results = await asyncio.gather(*(run_probe(session, endpoint, rpc, body) for rpc, body in requests))
+    for (rpc, _), result in zip(requests, results):
+        if rpc == "get_info" and result:
+            probe_state["lib"] = result.get("last_irreversible_block_num")
+
+async def probe_endpoint(session, endpoint, rpcs):
+    """
+    Run the configured probe set against one endpoint every PROBE_INTERVAL
+    seconds.
+    """
+    probe_state = {"lib": None}
+    schedule = FixedRateSchedule(probe_interval, endpoint["name"], "probe")
+    while True:
+        await probe_round(session, endpoint, rpcs, probe_state)
+        await schedule.wait()
+
+async def collect_metrics(endpoints, mode="poll", probe_endpoints=(), rpcs=()):
+    """
+    Main loop: follow all configured endpoints concurrently over one pooled,
+    keep-alive HTTP session, either by polling get_info or by streaming
+    blocks from state history, and run the RPC probe suite alongside.
+    """
+    follow = follow_ship_endpoint if mode == "ship" else poll_endpoint
+    connector = aiohttp.TCPConnector(limit_per_host=8, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [follow(session, endpoint) for endpoint in endpoints]
+        if rpcs:
+            tasks += [probe_endpoint(session, endpoint, rpcs) for endpoint in probe_endpoints]
+        await asyncio.gather(*tasks)
 
 if __name__ == "__main__":
     # Start Prometheus metrics server
     try:
-        start_http_server(8000)
-        print("Prometheus metrics server started on port 8000")
-        collect_metrics()
+        if exporter_mode == "ship":
+            endpoints = parse_endpoints(nodeos_ship_urls, nodeos_timeout)
+        else:
+            endpoints = parse_endpoints(nodeos_endpoints, nodeos_timeout)
+        print(f"Following {len(endpoints)} endpoint(s) in {exporter_mode} mode: {', '.join(e['name'] + '=' + e['url'] for e in endpoints)}")
+        rpcs = [rpc.strip() for rpc in nodeos_probes.split(",") if rpc.strip()]
+        if exporter_mode == "scrape":
+            asyncio.run(serve_on_scrape(endpoints, rpcs))
+        else:
+            start_http_server(exporter_port)
+            print(f"Prometheus metrics server started on port {exporter_port}")
+            probe_endpoints = parse_endpoints(nodeos_endpoints, nodeos_timeout)
+            asyncio.run(collect_metrics(endpoints, exporter_mode, probe_endpoints, rpcs))
     except Exception as e:
         print(f"Fatal error starting the metrics server: {e}")
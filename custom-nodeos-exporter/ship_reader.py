@@ -0,0 +1,296 @@
+"""
+Minimal state-history (SHiP) websocket client for the nodeos exporter.
+
+Only the parts of the state_history ABI the exporter needs are implemented:
+the status/blocks/ack requests, the get_blocks_result_v0 envelope and enough
+of signed_block to read the producer, timestamp and transaction receipts.
+"""
+import struct
+import aiohttp
+
+# Offset of block_timestamp_type slot 0 (2000-01-01T00:00:00Z) in milliseconds
+BLOCK_TIMESTAMP_EPOCH_MS = 946684800000
+BLOCK_INTERVAL_MS = 500
+
+# Variant indexes from the state_history "request" and "result" ABI types
+GET_STATUS_REQUEST_V0 = 0
+GET_BLOCKS_REQUEST_V0 = 1
+GET_BLOCKS_ACK_REQUEST_V0 = 2
+GET_STATUS_RESULT_V0 = 0
+GET_BLOCKS_RESULT_V0 = 1
+
+# block_header_extension id carrying a proposed producer_authority_schedule
+PRODUCER_SCHEDULE_CHANGE_EXTENSION = 1
+
+NAME_CHARMAP = ".12345abcdefghijklmnopqrstuvwxyz"
+
+class ShipDecodeError(Exception):
+    """Raised when a SHiP message does not match the expected layout."""
+
+class BinaryReader:
+    """Sequential reader for antelope binary (ABI) serialization."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def read(self, size):
+        if self.pos + size > len(self.data):
+            raise ShipDecodeError(f"read of {size} bytes past end of buffer at offset {self.pos}")
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def uint8(self):
+        return self.read(1)[0]
+
+    def uint16(self):
+        return struct.unpack_from("<H", self.read(2))[0]
+
+    def uint32(self):
+        return struct.unpack_from("<I", self.read(4))[0]
+
+    def uint64(self):
+        return struct.unpack_from("<Q", self.read(8))[0]
+
+    def varuint32(self):
+        result = 0
+        shift = 0
+        while True:
+            byte = self.uint8()
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+            if shift > 35:
+                raise ShipDecodeError("varuint32 too long")
+
+    def bool(self):
+        return self.uint8() != 0
+
+    def bytes(self):
+        return self.read(self.varuint32())
+
+    def checksum256(self):
+        return self.read(32).hex()
+
+    def name(self):
+        return decode_name(self.uint64())
+
+    def optional(self, read_value):
+        return read_value() if self.bool() else None
+
+    def skip_public_key(self):
+        key_type = self.varuint32()
+        self.read(33)
+        if key_type == 2:  # WebAuthn: user presence + rpid
+            self.uint8()
+            self.bytes()
+
+    def skip_signature(self):
+        sig_type = self.varuint32()
+        self.read(65)
+        if sig_type == 2:  # WebAuthn: auth data + client json
+            self.bytes()
+            self.bytes()
+
+    def eof(self):
+        return self.pos >= len(self.data)
+
+def decode_name(value):
+    """Convert a uint64 antelope name to its string form."""
+    chars = []
+    for i in range(13):
+        if i == 0:
+            index = (value >> 59) & 0x1F
+        elif i < 12:
+            index = (value >> (59 - 5 * i)) & 0x1F
+        else:
+            index = value & 0x0F
+        chars.append(NAME_CHARMAP[index])
+    return "".join(chars).rstrip(".")
+
+def encode_varuint32(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def encode_status_request():
+    return encode_varuint32(GET_STATUS_REQUEST_V0)
+
+def encode_blocks_request(start_block_num, max_messages_in_flight, end_block_num=0xFFFFFFFF,
+                          fetch_block=True, fetch_traces=False, fetch_deltas=False, irreversible_only=False):
+    return (
+        encode_varuint32(GET_BLOCKS_REQUEST_V0)
+        + struct.pack("<III", start_block_num, end_block_num, max_messages_in_flight)
+        + encode_varuint32(0)  # have_positions
+        + bytes([irreversible_only, fetch_block, fetch_traces, fetch_deltas])
+    )
+
+def encode_ack_request(num_messages):
+    return encode_varuint32(GET_BLOCKS_ACK_REQUEST_V0) + struct.pack("<I", num_messages)
+
+def read_block_position(reader):
+    return {"block_num": reader.uint32(), "block_id": reader.checksum256()}
+
+def decode_result(payload):
+    """
+    Decode a SHiP result message into a dict. The "type" key is either
+    "status" or "blocks"; block payloads are decoded with decode_signed_block.
+    """
+    reader = BinaryReader(payload)
+    result_type = reader.varuint32()
+
+    if result_type == GET_STATUS_RESULT_V0:
+        return {
+            "type": "status",
+            "head": read_block_position(reader),
+            "last_irreversible": read_block_position(reader),
+            "trace_begin_block": reader.uint32(),
+            "trace_end_block": reader.uint32(),
+            "chain_state_begin_block": reader.uint32(),
+            "chain_state_end_block": reader.uint32(),
+        }
+
+    if result_type == GET_BLOCKS_RESULT_V0:
+        result = {
+            "type": "blocks",
+            "head": read_block_position(reader),
+            "last_irreversible": read_block_position(reader),
+            "this_block": reader.optional(lambda: read_block_position(reader)),
+            "prev_block": reader.optional(lambda: read_block_position(reader)),
+        }
+        block = reader.optional(reader.bytes)
+        result["block"] = decode_signed_block(block) if block is not None else None
+        return result
+
+    raise ShipDecodeError(f"unsupported result variant {result_type}")
+
+def decode_producer_authority_schedule(data):
+    """Return the producer names in a producer_schedule_change_extension payload."""
+    reader = BinaryReader(data)
+    reader.uint32()  # version
+    producers = []
+    for _ in range(reader.varuint32()):
+        producers.append(reader.name())
+        authority_type = reader.varuint32()
+        if authority_type != 0:
+            raise ShipDecodeError(f"unsupported block signing authority variant {authority_type}")
+        reader.uint32()  # threshold
+        for _ in range(reader.varuint32()):
+            reader.skip_public_key()
+            reader.uint16()  # weight
+    return producers
+
+def decode_signed_block(data):
+    """
+    Decode the fields of a packed signed_block the exporter uses: timestamp,
+    producer, schedule change data and per-transaction resource usage.
+    """
+    reader = BinaryReader(data)
+
+    slot = reader.uint32()
+    producer = reader.name()
+    reader.uint16()  # confirmed
+    previous = reader.checksum256()
+    reader.read(64)  # transaction_mroot, action_mroot
+    schedule_version = reader.uint32()
+
+    new_producers = None
+    if reader.bool():
+        version = reader.uint32()
+        names = []
+        for _ in range(reader.varuint32()):
+            names.append(reader.name())
+            reader.skip_public_key()
+        new_producers = {"version": version, "producers": names}
+
+    header_extensions = []
+    schedule_producers = new_producers["producers"] if new_producers else None
+    for _ in range(reader.varuint32()):
+        extension_id = reader.uint16()
+        extension_data = bytes(reader.bytes())
+        header_extensions.append((extension_id, extension_data))
+        if extension_id == PRODUCER_SCHEDULE_CHANGE_EXTENSION:
+            schedule_producers = decode_producer_authority_schedule(extension_data)
+
+    reader.skip_signature()  # producer_signature
+
+    transactions = 0
+    cpu_usage_us = 0
+    net_usage_words = 0
+    for _ in range(reader.varuint32()):
+        reader.uint8()  # status
+        cpu_usage_us += reader.uint32()
+        net_usage_words += reader.varuint32()
+        transactions += 1
+
+        trx_type = reader.varuint32()
+        if trx_type == 0:  # transaction_id
+            reader.read(32)
+        elif trx_type == 1:  # packed_transaction
+            for _ in range(reader.varuint32()):
+                reader.skip_signature()
+            reader.uint8()  # compression
+            reader.bytes()  # packed_context_free_data
+            reader.bytes()  # packed_trx
+        else:
+            raise ShipDecodeError(f"unsupported transaction variant {trx_type}")
+
+    return {
+        "timestamp": (BLOCK_TIMESTAMP_EPOCH_MS + slot * BLOCK_INTERVAL_MS) / 1000.0,
+        "producer": producer,
+        "previous": previous,
+        "schedule_version": schedule_version,
+        "new_producers": new_producers,
+        "schedule_producers": schedule_producers,
+        "header_extensions": header_extensions,
+        "transactions": transactions,
+        "cpu_usage_us": cpu_usage_us,
+        "net_usage_words": net_usage_words,
+    }
+
+async def stream_blocks(session, endpoint, start_block_num=None, max_messages_in_flight=16, max_message_size=64 * 1024 * 1024):
+    """
+    Connect to a SHiP endpoint and yield decoded get_blocks results.
+
+    Each message is acknowledged only after the consumer asks for the next
+    one, so nodeos never has more than `max_messages_in_flight` blocks
+    outstanding and a slow consumer throttles the stream instead of
+    buffering it. Starts at the current head when `start_block_num` is None.
+    """
+    timeout = aiohttp.ClientWSTimeout(ws_receive=endpoint["timeout"])
+    async with session.ws_connect(endpoint["url"], max_msg_size=max_message_size,
+                                  timeout=timeout, heartbeat=30) as ws:
+        # The first message is always the state history ABI as JSON text
+        abi = await ws.receive()
+        if abi.type != aiohttp.WSMsgType.TEXT:
+            raise ShipDecodeError(f"expected ABI text message, got {abi.type}")
+
+        if start_block_num is None:
+            await ws.send_bytes(encode_status_request())
+            status = decode_result(await receive_binary(ws))
+            start_block_num = status["head"]["block_num"]
+
+        await ws.send_bytes(encode_blocks_request(start_block_num, max_messages_in_flight))
+
+        while True:
+            result = decode_result(await receive_binary(ws))
+            yield result
+            await ws.send_bytes(encode_ack_request(1))
+
+async def receive_binary(ws):
+    msg = await ws.receive()
+    if msg.type == aiohttp.WSMsgType.BINARY:
+        return msg.data
+    if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED):
+        raise aiohttp.ClientConnectionError("state history connection closed")
+    if msg.type == aiohttp.WSMsgType.ERROR:
+        raise aiohttp.ClientConnectionError(f"state history connection error: {ws.exception()}")
+    raise ShipDecodeError(f"unexpected websocket message type {msg.type}")
@@ -0,0 +1,199 @@
+"""
+Fake state-history (SHiP) websocket server for the exporter tests.
+
+Speaks just enough of the state_history protocol for ship_reader: the ABI
+greeting, get_status_request_v0, get_blocks_request_v0 and acks. Blocks are
+sent only while the client has unacknowledged credit left, like nodeos, and
+the server records what it saw so tests can check resume points and flow
+control.
+"""
+import struct
+from aiohttp import web, WSMsgType
+from ship_reader import (
+    BLOCK_INTERVAL_MS,
+    BLOCK_TIMESTAMP_EPOCH_MS,
+    GET_BLOCKS_ACK_REQUEST_V0,
+    GET_BLOCKS_REQUEST_V0,
+    GET_BLOCKS_RESULT_V0,
+    GET_STATUS_REQUEST_V0,
+    GET_STATUS_RESULT_V0,
+    NAME_CHARMAP,
+    PRODUCER_SCHEDULE_CHANGE_EXTENSION,
+    BinaryReader,
+    encode_varuint32,
+)
+
+# Block slot of block number 0, so fake block timestamps look current
+SLOT_OFFSET = 830_000_000
+
+def encode_name(name):
+    """Inverse of ship_reader.decode_name."""
+    value = 0
+    for i, char in enumerate(name[:13]):
+        index = NAME_CHARMAP.index(char)
+        if i < 12:
+            value |= (index & 0x1F) << (64 - 5 * (i + 1))
+        else:
+            value |= index & 0x0F
+    return value
+
+def encode_bytes(data):
+    return encode_varuint32(len(data)) + data
+
+def block_id(block_num):
+    return struct.pack(">I", block_num) + bytes(28)
+
+def block_timestamp(block_num):
+    return (BLOCK_TIMESTAMP_EPOCH_MS + (SLOT_OFFSET + block_num) * BLOCK_INTERVAL_MS) / 1000.0
+
+def encode_position(block_num):
+    return struct.pack("<I", block_num) + block_id(block_num)
+
+def encode_public_key():
+    return encode_varuint32(0) + bytes(33)
+
+def encode_signature():
+    return encode_varuint32(0) + bytes(65)
+
+def encode_authority_schedule(version, producers):
+    """producer_authority_schedule with one single-key authority per producer."""
+    out = struct.pack("<I", version) + encode_varuint32(len(producers))
+    for producer in producers:
+        out += struct.pack("<Q", encode_name(producer))
+        out += encode_varuint32(0) + struct.pack("<I", 1)  # block_signing_authority_v0, threshold
+        out += encode_varuint32(1) + encode_public_key() + struct.pack("<H", 1)
+    return out
+
+def encode_signed_block(block_num, producer="eosio", transactions=(), new_producers=None, schedule_change=None):
+    """
+    Pack a signed_block. `transactions` is a sequence of
+    (cpu_usage_us, net_usage_words, packed) tuples, where packed selects the
+    packed_transaction receipt variant over a bare transaction id.
+    `new_producers` is a (version, names) legacy schedule and
+    `schedule_change` a (version, names) producer_schedule_change_extension.
+    """
+    out = struct.pack("<I", SLOT_OFFSET + block_num)
+    out += struct.pack("<Q", encode_name(producer))
+    out += struct.pack("<H", 0)  # confirmed
+    out += block_id(block_num - 1)  # previous
+    out += bytes(64)  # transaction_mroot, action_mroot
+    out += struct.pack("<I", 0)  # schedule_version
+
+    if new_producers is None:
+        out += b"\x00"
+    else:
+        version, names = new_producers
+        out += b"\x01" + struct.pack("<I", version) + encode_varuint32(len(names))
+        for name in names:
+            out += struct.pack("<Q", encode_name(name)) + encode_public_key()
+
+    if schedule_change is None:
+        out += encode_varuint32(0)
+    else:
+        out += encode_varuint32(1) + struct.pack("<H", PRODUCER_SCHEDULE_CHANGE_EXTENSION)
+        out += encode_bytes(encode_authority_schedule(*schedule_change))
+
+    out += encode_signature()
+
+    out += encode_varuint32(len(transactions))
+    for index, (cpu_usage_us, net_usage_words, packed) in enumerate(transactions):
+        out += b"\x00" + struct.pack("<I", cpu_usage_us) + encode_varuint32(net_usage_words)
+        if packed:
+            out += encode_varuint32(1) + encode_varuint32(1) + encode_signature()
+            out += b"\x00" + encode_bytes(b"") + encode_bytes(bytes([index]) * 40)
+        else:
+            out += encode_varuint32(0) + bytes([index]) * 32
+    return out
+
+def encode_status_result(head, lib):
+    return (
+        encode_varuint32(GET_STATUS_RESULT_V0)
+        + encode_position(head)
+        + encode_position(lib)
+        + struct.pack("<IIII", 1, head, 1, head)
+    )
+
+def encode_blocks_result(head, lib, block_num, block=None):
+    """get_blocks_result_v0 for `block_num`, or an empty result when it is None."""
+    out = encode_varuint32(GET_BLOCKS_RESULT_V0) + encode_position(head) + encode_position(lib)
+    if block_num is None:
+        return out + b"\x00\x00\x00"
+    out += b"\x01" + encode_position(block_num)
+    out += b"\x01" + encode_position(block_num - 1)
+    if block is None:
+        return out + b"\x00"
+    return out + b"\x01" + encode_bytes(block)
+
+class FakeShipServer:
+    """
+    Serves blocks `first_block`..`last_block`, reporting `first_block` as the
+    head in get_status and a LIB `lib_lag` blocks behind each block sent.
+    With `drop_after`, the first connection is closed after that many blocks.
+    """
+
+    def __init__(self, first_block=1, last_block=20, lib_lag=3, drop_after=None):
+        self.first_block = first_block
+        self.last_block = last_block
+        self.lib_lag = lib_lag
+        self.drop_after = drop_after
+        self.connections = 0
+        self.block_requests = []
+        self.max_outstanding = 0
+        self.runner = None
+        self.url = None
+
+    def block(self, block_num):
+        return encode_signed_block(block_num, producer=f"producer{block_num % 3 + 1}",
+                                   transactions=[(100, 12, False), (250, 20, True)])
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"ws://127.0.0.1:{self.runner.addresses[0][1]}"
+        return self
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        drop_after, self.drop_after = self.drop_after, None
+        await ws.send_str('{"version": "eosio::abi/1.1", "structs": []}')
+
+        next_block = None
+        credit = 0
+        max_in_flight = 0
+        sent = 0
+        async for msg in ws:
+            if msg.type != WSMsgType.BINARY:
+                break
+            reader = BinaryReader(msg.data)
+            request_type = reader.varuint32()
+            if request_type == GET_STATUS_REQUEST_V0:
+                await ws.send_bytes(encode_status_result(self.first_block, max(self.first_block - self.lib_lag, 1)))
+                continue
+            if request_type == GET_BLOCKS_REQUEST_V0:
+                next_block = reader.uint32()
+                reader.uint32()  # end_block_num
+                max_in_flight = credit = reader.uint32()
+                self.block_requests.append((next_block, max_in_flight))
+            elif request_type == GET_BLOCKS_ACK_REQUEST_V0:
+                credit += reader.uint32()
+
+            while next_block is not None and credit > 0 and next_block <= self.last_block:
+                if drop_after is not None and sent == drop_after:
+                    await ws.close()
+                    return ws
+                lib = max(next_block - self.lib_lag, 1)
+                await ws.send_bytes(encode_blocks_result(next_block, lib, next_block, self.block(next_block)))
+                next_block += 1
+                credit -= 1
+                sent += 1
+                self.max_outstanding = max(self.max_outstanding, max_in_flight - credit)
+        return ws
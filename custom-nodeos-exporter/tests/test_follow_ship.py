@@ -0,0 +1,64 @@
+import asyncio
+import aiohttp
+from prometheus_client import REGISTRY
+import nodeos_exporter
+from fake_ship import FakeShipServer, block_timestamp
+
+def sample(metric, endpoint):
+    return REGISTRY.get_sample_value(metric, {"endpoint": endpoint})
+
+async def follow_until(server, name, block_num, timeout=15):
+    """Run follow_ship_endpoint until it has processed `block_num`."""
+    endpoint = {"name": name, "url": server.url, "timeout": 5}
+    async with aiohttp.ClientSession() as session:
+        task = asyncio.ensure_future(nodeos_exporter.follow_ship_endpoint(session, endpoint))
+        try:
+            deadline = asyncio.get_running_loop().time() + timeout
+            while sample("nodeos_head_block_number", name) != block_num:
+                assert not task.done(), task.exception()
+                assert asyncio.get_running_loop().time() < deadline, "stream did not reach the last block"
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+def run_follow(name, block_num, **kwargs):
+    async def run():
+        server = await FakeShipServer(**kwargs).start()
+        try:
+            await follow_until(server, name, block_num)
+        finally:
+            await server.stop()
+        return server
+
+    return asyncio.run(run())
+
+def test_follow_updates_metrics():
+    server = run_follow("follow", 30, first_block=10, last_block=30, lib_lag=3)
+    assert server.connections == 1
+    assert sample("nodeos_last_irreversible_block_number", "follow") == 27
+    assert sample("nodeos_last_irreversible_block_time", "follow") == block_timestamp(27)
+    assert sample("nodeos_head_block_time", "follow") == block_timestamp(30)
+    assert sample("nodeos_block_transactions_sum", "follow") == 2 * 21
+    assert sample("nodeos_ship_reconnects_total", "follow") in (None, 0)
+
+def test_follow_resumes_after_disconnect():
+    server = run_follow("resume", 20, first_block=1, last_block=20, drop_after=8)
+    assert server.connections == 2
+    # The stream starts at the reported head, then resumes after the last block processed
+    assert [start for start, _ in server.block_requests] == [1, 9]
+    assert sample("nodeos_ship_reconnects_total", "resume") == 1
+    assert sample("nodeos_up", "resume") == 1
+
+def test_follow_survives_bad_block(monkeypatch):
+    process_ship_block = nodeos_exporter.process_ship_block
+
+    def failing_process_ship_block(result, endpoint, state):
+        if result["this_block"]["block_num"] == 5:
+            raise KeyError("timestamp")
+        process_ship_block(result, endpoint, state)
+
+    monkeypatch.setattr(nodeos_exporter, "process_ship_block", failing_process_ship_block)
+    server = run_follow("badblock", 12, first_block=1, last_block=12)
+    assert server.connections == 1
+    assert sample("nodeos_exporter_parse_errors_total", "badblock") == 1
@@ -0,0 +1,131 @@
+import asyncio
+import aiohttp
+from aiohttp import web
+import nodeos_exporter
+
+class FakeNodeos:
+    """Chain API stub whose head advances on every exporter get_info poll (probes POST)."""
+
+    def __init__(self):
+        self.calls = {}
+        self.head = 1000
+
+    async def handle(self, request):
+        rpc = request.match_info["rpc"]
+        self.calls[rpc] = self.calls.get(rpc, 0) + 1
+        if rpc == "get_info":
+            if request.method == "GET":
+                self.head += 1
+            return web.json_response({
+                "head_block_num": self.head,
+                "head_block_time": "2025-01-01T00:00:00.500",
+                "head_block_producer": "alpha",
+                "head_block_id": f"{self.head:08x}" + "0" * 56,
+                "last_irreversible_block_num": self.head - 3,
+                "last_irreversible_block_time": "2025-01-01T00:00:00.000",
+            })
+        if rpc == "get_producer_schedule":
+            return web.json_response({"active": {"producers": [{"producer_name": "alpha"}]}})
+        return web.json_response({})
+
+async def collect_twice(name, ttl):
+    """Scrape an OnScrapeCollector twice from a worker thread, like the HTTP server does."""
+    nodeos = FakeNodeos()
+    app = web.Application()
+    app.router.add_route("*", "/v1/chain/{rpc}", nodeos.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    endpoint = {"name": name, "url": f"http://127.0.0.1:{runner.addresses[0][1]}", "timeout": 5}
+    try:
+        async with aiohttp.ClientSession() as session:
+            loop = asyncio.get_running_loop()
+            collector = nodeos_exporter.OnScrapeCollector([endpoint], session, loop, ttl, ["get_info", "get_block"])
+            first = await loop.run_in_executor(None, lambda: list(collector.collect()))
+            second = await loop.run_in_executor(None, lambda: list(collector.collect()))
+    finally:
+        await runner.cleanup()
+    return nodeos, collector, first, second
+
+def samples(families, name):
+    """Sample values of the series labelled with endpoint `name`, keyed by sample name."""
+    return {
+        (sample.name, sample.labels.get("rpc")): sample.value
+        for family in families
+        for sample in family.samples
+        if sample.labels.get("endpoint") == name
+    }
+
+def test_scrape_exports_poll_mode_metrics():
+    nodeos, collector, first, _ = asyncio.run(collect_twice("scrape", ttl=60))
+    values = samples(first, "scrape")
+    assert values[("nodeos_up", None)] == 1
+    assert values[("nodeos_head_block_number", None)] == 1001
+    assert values[("nodeos_last_irreversible_block_number", None)] == 998
+    assert ("nodeos_head_block_lag_seconds", None) in values
+    assert values[("nodeos_head_lib_distance_blocks_count", None)] == 1
+    assert values[("nodeos_exporter_fetch_duration_seconds_count", None)] == 1
+    assert ("nodeos_exporter_last_success_timestamp_seconds", None) in values
+    assert values[("nodeos_exporter_producer_labels", None)] == 1
+    # get_block waits for a get_info probe to report the LIB, so only get_info runs in the first round
+    assert values[("nodeos_rpc_requests_total", "get_info")] == 1
+    assert nodeos.calls["get_producer_schedule"] == 1
+
+def test_scrape_cache_and_derived_rate():
+    nodeos, collector, first, second = asyncio.run(collect_twice("cached", ttl=60))
+    assert collector.fetches == 1 and collector.cache_hits == 1
+    assert nodeos.calls["get_info"] == 2  # one sample plus one probe
+    assert samples(second, "cached") == samples(first, "cached")
+
+    nodeos, collector, _, second = asyncio.run(collect_twice("uncached", ttl=0))
+    assert collector.fetches == 2 and collector.cache_hits == 0
+    values = samples(second, "uncached")
+    assert values[("nodeos_head_block_number", None)] == 1002
+    assert values[("nodeos_blocks_per_second", None)] > 0
+    # Probe rounds keep to PROBE_INTERVAL however often Prometheus scrapes
+    assert values[("nodeos_rpc_requests_total", "get_info")] == 1
+
+def test_scrape_get_info_timestamps():
+    nodeos, collector, first, _ = asyncio.run(collect_twice("stamped", ttl=60))
+    fetched_at = collector.states["stamped"]["fetched_at"]
+    assert fetched_at is not None
+    for family in first:
+        for sample in family.samples:
+            if sample.labels.get("endpoint") != "stamped":
+                continue
+            if family.name in nodeos_exporter.GET_INFO_FAMILIES:
+                assert sample.timestamp == fetched_at, sample
+            else:
+                assert sample.timestamp is None, sample
+
+def test_scrape_cancels_stalled_refresh(monkeypatch):
+    cancelled = []
+    started = []
+
+    async def stalled_sample_endpoint(session, endpoint, state):
+        started.append(endpoint["name"])
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(endpoint["name"])
+            raise
+
+    monkeypatch.setattr(nodeos_exporter, "sample_endpoint", stalled_sample_endpoint)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        endpoint = {"name": "stalled", "url": "http://127.0.0.1:9", "timeout": 0.1}
+        async with aiohttp.ClientSession() as session:
+            collector = nodeos_exporter.OnScrapeCollector([endpoint], session, loop, 0)
+            await loop.run_in_executor(None, lambda: list(collector.collect()))
+            await asyncio.sleep(0.05)
+            assert collector.pending.cancelled()
+            # The next scrape starts a fresh refresh instead of overlapping the stalled one
+            await loop.run_in_executor(None, lambda: list(collector.collect()))
+            await asyncio.sleep(0.05)
+        return collector
+
+    collector = asyncio.run(run())
+    assert started == ["stalled", "stalled"]
+    assert cancelled == ["stalled", "stalled"]
+    assert collector.fetches == 0
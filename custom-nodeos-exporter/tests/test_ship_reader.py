@@ -0,0 +1,134 @@
+import asyncio
+import aiohttp
+import pytest
+from fake_ship import (
+    FakeShipServer,
+    block_id,
+    block_timestamp,
+    encode_blocks_result,
+    encode_name,
+    encode_signed_block,
+    encode_status_result,
+)
+from ship_reader import (
+    ShipDecodeError,
+    decode_name,
+    decode_result,
+    decode_signed_block,
+    encode_ack_request,
+    encode_blocks_request,
+    stream_blocks,
+)
+
+def test_decode_name():
+    assert decode_name(6138663577826885632) == "eosio"
+    for name in ("eosio.token", "producer1", "a", "zzzzzzzzzzzzj"):
+        assert decode_name(encode_name(name)) == name
+
+def test_decode_signed_block():
+    block = decode_signed_block(encode_signed_block(
+        42, producer="blockone",
+        transactions=[(100, 12, False), (250, 20, True), (50, 1, False)],
+        new_producers=(3, ["alpha", "beta"]),
+    ))
+    assert block["producer"] == "blockone"
+    assert block["timestamp"] == block_timestamp(42)
+    assert block["previous"] == block_id(41).hex()
+    assert block["new_producers"] == {"version": 3, "producers": ["alpha", "beta"]}
+    assert block["schedule_producers"] == ["alpha", "beta"]
+    assert block["transactions"] == 3
+    assert block["cpu_usage_us"] == 400
+    assert block["net_usage_words"] == 33
+
+def test_decode_schedule_change_extension():
+    block = decode_signed_block(encode_signed_block(7, schedule_change=(4, ["gamma", "delta", "eps"])))
+    assert block["new_producers"] is None
+    assert block["schedule_producers"] == ["gamma", "delta", "eps"]
+    assert block["header_extensions"][0][0] == 1
+    assert block["transactions"] == 0
+
+def test_decode_status_result():
+    status = decode_result(encode_status_result(100, 97))
+    assert status["type"] == "status"
+    assert status["head"] == {"block_num": 100, "block_id": block_id(100).hex()}
+    assert status["last_irreversible"]["block_num"] == 97
+
+def test_decode_blocks_result():
+    result = decode_result(encode_blocks_result(100, 97, 99, encode_signed_block(99, producer="alpha")))
+    assert result["type"] == "blocks"
+    assert result["this_block"]["block_num"] == 99
+    assert result["prev_block"]["block_num"] == 98
+    assert result["last_irreversible"]["block_num"] == 97
+    assert result["block"]["producer"] == "alpha"
+
+    empty = decode_result(encode_blocks_result(100, 97, None))
+    assert empty["this_block"] is None and empty["block"] is None
+
+def test_decode_errors():
+    payload = encode_blocks_result(100, 97, 99, encode_signed_block(99))
+    with pytest.raises(ShipDecodeError):
+        decode_result(payload[:-10])
+    with pytest.raises(ShipDecodeError):
+        decode_result(b"\x05")
+    with pytest.raises(ShipDecodeError):
+        decode_signed_block(encode_signed_block(1, transactions=[(1, 1, False)])[:-1])
+
+def test_encode_requests():
+    request = encode_blocks_request(10, 16)
+    assert request[0] == 1
+    assert request[1:13] == bytes.fromhex("0a000000ffffffff10000000")
+    assert request[13:] == b"\x00\x00\x01\x00\x00"
+    assert encode_ack_request(1) == b"\x02\x01\x00\x00\x00"
+
+async def read_stream(server, count, start_block_num=None, max_in_flight=16, delay=0):
+    endpoint = {"name": "fake", "url": server.url, "timeout": 5}
+    results = []
+    async with aiohttp.ClientSession() as session:
+        stream = stream_blocks(session, endpoint, start_block_num, max_in_flight)
+        async for result in stream:
+            results.append(result)
+            if len(results) == count:
+                break
+            await asyncio.sleep(delay)
+        await stream.aclose()
+    return results
+
+def test_stream_starts_at_head():
+    async def run():
+        server = await FakeShipServer(first_block=10, last_block=20).start()
+        try:
+            results = await read_stream(server, 5)
+        finally:
+            await server.stop()
+        return server, results
+
+    server, results = asyncio.run(run())
+    assert server.block_requests == [(10, 16)]
+    assert [r["this_block"]["block_num"] for r in results] == [10, 11, 12, 13, 14]
+    assert results[0]["last_irreversible"]["block_num"] == 7
+    assert results[0]["block"]["cpu_usage_us"] == 350
+
+def test_stream_backpressure():
+    async def run():
+        server = await FakeShipServer(first_block=1, last_block=40).start()
+        try:
+            results = await read_stream(server, 30, start_block_num=1, max_in_flight=4, delay=0.005)
+        finally:
+            await server.stop()
+        return server, results
+
+    server, results = asyncio.run(run())
+    assert [r["this_block"]["block_num"] for r in results] == list(range(1, 31))
+    # The server only ever got ahead of the slow consumer by the in-flight window
+    assert server.max_outstanding == 4
+
+def test_stream_closed_by_server():
+    async def run():
+        server = await FakeShipServer(first_block=1, last_block=20, drop_after=3).start()
+        try:
+            with pytest.raises(aiohttp.ClientConnectionError):
+                await read_stream(server, 10, start_block_num=1)
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
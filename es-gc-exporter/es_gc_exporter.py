@@ -0,0 +1,142 @@
+from prometheus_client import start_http_server, Counter, Gauge, Histogram
+from datetime import datetime
+import os
+import re
+import time
+
+# Exporter configuration
+node_name = os.getenv("NODE_NAME", "es1")
+gc_log = os.getenv("GC_LOG", "/logs/gc.log")
+exporter_port = int(os.getenv("EXPORTER_PORT", "9500"))
+poll_interval = float(os.getenv("POLL_INTERVAL", "1"))
+# Start at the end of an existing log instead of replaying its history
+from_start = os.getenv("FROM_START", "false").lower() == "true"
+
+# Define Prometheus metrics
+pause_seconds = Histogram(
+    "es_gc_pause_seconds",
+    "Stop-the-world GC pauses",
+    ["node", "type"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+allocation_rate = Histogram(
+    "es_gc_allocation_rate_bytes_per_second",
+    "Heap allocated between consecutive GCs divided by the time between them",
+    ["node"],
+    buckets=[1024 ** 2 * 4 ** i for i in range(9)],
+)
+heap_after_gc = Gauge("es_gc_heap_after_bytes", "Heap used right after the last GC", ["node"])
+heap_committed = Gauge("es_gc_heap_committed_bytes", "Committed heap at the last GC", ["node"])
+heap_occupancy = Histogram(
+    "es_gc_heap_occupancy_after_ratio",
+    "Heap used after each GC as a fraction of committed heap; old-gen pressure when this stays high",
+    ["node"],
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0),
+)
+log_rotations = Counter("es_gc_log_rotations_total", "GC log files reopened after rotation or truncation", ["node"])
+parse_errors = Counter("es_gc_exporter_parse_errors_total", "GC pause lines that could not be parsed", ["node"])
+
+# Unified JVM logging as configured by Elasticsearch's jvm.options, e.g.
+# [2024-06-01T12:00:00.123+0000][7][info][gc] GC(12) Pause Young (Normal) (G1 Evacuation Pause) 512M->128M(1024M) 12.345ms
+PAUSE = re.compile(
+    r"^\[(?P<time>[^\]]+)\].*\[gc\s*\] GC\(\d+\) Pause (?P<kind>\w+)(?P<causes>(?: \([^)]*\))*) "
+    r"(?P<before>\d+)(?P<before_unit>[KMG])->(?P<after>\d+)(?P<after_unit>[KMG])"
+    r"\((?P<committed>\d+)(?P<committed_unit>[KMG])\) (?P<ms>[\d.]+)ms"
+)
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+def pause_type(kind, causes):
+    """young, mixed, remark, cleanup or full."""
+    if kind == "Young" and "(Mixed)" in causes:
+        return "mixed"
+    return kind.lower()
+
+def parse_time(text):
+    try:
+        return datetime.strptime(text, "%Y-%m-%dT%H:%M:%S.%f%z").timestamp()
+    except ValueError:
+        return None
+
+class GcLogParser:
+    """Turns GC pause lines into metrics, tracking the previous GC for allocation rates."""
+
+    def __init__(self, node):
+        self.node = node
+        self.last_time = None
+        self.last_after = None
+
+    def feed(self, line):
+        if "Pause" not in line:
+            return
+        match = PAUSE.match(line)
+        if not match:
+            if "[gc " in line or "[gc]" in line:
+                parse_errors.labels(self.node).inc()
+            return
+        before = int(match.group("before")) * UNITS[match.group("before_unit")]
+        after = int(match.group("after")) * UNITS[match.group("after_unit")]
+        committed = int(match.group("committed")) * UNITS[match.group("committed_unit")]
+        pause_seconds.labels(self.node, pause_type(match.group("kind"), match.group("causes"))).observe(
+            float(match.group("ms")) / 1000)
+        heap_after_gc.labels(self.node).set(after)
+        heap_committed.labels(self.node).set(committed)
+        if committed:
+            heap_occupancy.labels(self.node).observe(after / committed)
+
+        timestamp = parse_time(match.group("time"))
+        if timestamp is not None and self.last_time is not None and timestamp > self.last_time:
+            allocated = before - self.last_after
+            if allocated >= 0:
+                allocation_rate.labels(self.node).observe(allocated / (timestamp - self.last_time))
+        self.last_time = timestamp
+        self.last_after = after
+
+def follow(path):
+    """
+    Yield lines appended to `path`, reopening it when the JVM rotates it
+    (a new inode) or it shrinks. Waits for the file to appear.
+    """
+    handle = None
+    inode = None
+    first_open = True
+    partial = ""
+    while True:
+        if handle is None:
+            try:
+                handle = open(path)
+            except OSError:
+                time.sleep(poll_interval)
+                continue
+            inode = os.fstat(handle.fileno()).st_ino
+            if first_open and not from_start:
+                handle.seek(0, os.SEEK_END)
+            first_open = False
+
+        chunk = handle.readline()
+        if chunk:
+            partial += chunk
+            if partial.endswith("\n"):
+                yield partial
+                partial = ""
+            continue
+
+        time.sleep(poll_interval)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if stat.st_ino != inode or stat.st_size < handle.tell():
+            # Finish the old file, then start the new one from its beginning
+            for line in handle:
+                yield line
+            handle.close()
+            handle = None
+            partial = ""
+            log_rotations.labels(node_name).inc()
+
+if __name__ == "__main__":
+    start_http_server(exporter_port)
+    print(f"Prometheus metrics server started on port {exporter_port}, following {gc_log} for {node_name}")
+    parser = GcLogParser(node_name)
+    for line in follow(gc_log):
+        parser.feed(line)
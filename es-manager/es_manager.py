@@ -0,0 +1,425 @@
+import argparse
+import fnmatch
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Manager configuration, set by generate_hyperion_compose.py
+es_url = os.getenv("ES_URL", "http://es1:9200").rstrip("/")
+request_timeout = float(os.getenv("ES_TIMEOUT", "30"))
+check_interval = float(os.getenv("CHECK_INTERVAL", "300"))
+lifecycle_enabled = os.getenv("LIFECYCLE_ENABLED", "false").lower() == "true"
+backfill_enabled = os.getenv("BACKFILL_ENABLED", "false").lower() == "true"
+# Comma separated index patterns whose sealed partitions move to the warm tier
+lifecycle_indices = os.getenv("LIFECYCLE_INDICES", "wax-action-*,wax-delta-*")
+lifecycle_policy = os.getenv("LIFECYCLE_POLICY", "hyperion-warm")
+lifecycle_template = os.getenv("LIFECYCLE_TEMPLATE", "hyperion-tiering")
+warm_min_age = os.getenv("WARM_MIN_AGE", "1d")
+warm_replicas = int(os.getenv("WARM_REPLICAS", "0"))
+warm_shrink_shards = int(os.getenv("WARM_SHRINK_SHARDS", "1"))
+# Newest partitions per index family that Hyperion may still be writing to
+keep_hot_partitions = max(1, int(os.getenv("KEEP_HOT_PARTITIONS", "1")))
+# Shard layout per index pattern from the generator, "pattern=shards/replicas,..."
+index_layout = os.getenv("INDEX_LAYOUT", "")
+# Backfill: indices held in the bulk-ingest profile until the highest
+# block_num in BACKFILL_PROGRESS_INDEX is within BACKFILL_CATCHUP_BLOCKS of head
+nodeos_url = os.getenv("NODEOS_URL", "http://node:8888").rstrip("/")
+backfill_indices = os.getenv("BACKFILL_INDICES", "wax-*")
+backfill_progress_index = os.getenv("BACKFILL_PROGRESS_INDEX", "wax-block-*")
+backfill_catchup_blocks = int(os.getenv("BACKFILL_CATCHUP_BLOCKS", "600"))
+backfill_template = os.getenv("BACKFILL_TEMPLATE", "hyperion-backfill")
+serving_refresh_interval = os.getenv("SERVING_REFRESH_INTERVAL", "1s")
+serving_replicas = int(os.getenv("SERVING_REPLICAS", "0"))
+# Snapshots: shared filesystem repository (path.repo on every node) and an
+# SLM policy taking incremental snapshots on SNAPSHOT_SCHEDULE
+snapshot_enabled = os.getenv("SNAPSHOT_ENABLED", "false").lower() == "true"
+snapshot_repository = os.getenv("SNAPSHOT_REPOSITORY", "hyperion-snapshots")
+snapshot_location = os.getenv("SNAPSHOT_LOCATION", "/usr/share/elasticsearch/snapshots")
+snapshot_policy = os.getenv("SNAPSHOT_POLICY", "hyperion-snapshots")
+snapshot_schedule = os.getenv("SNAPSHOT_SCHEDULE", "0 30 1 * * ?")
+snapshot_indices = os.getenv("SNAPSHOT_INDICES", "wax-*")
+snapshot_retention = os.getenv("SNAPSHOT_RETENTION", "30d")
+restore_parallelism = int(os.getenv("RESTORE_PARALLELISM", "4"))
+restore_poll_interval = float(os.getenv("RESTORE_POLL_INTERVAL", "10"))
+# A restore fails when one index takes longer than RESTORE_TIMEOUT seconds,
+# or its recoveries make no progress for RESTORE_STALL_TIMEOUT seconds
+restore_timeout = float(os.getenv("RESTORE_TIMEOUT", "21600"))
+restore_stall_timeout = float(os.getenv("RESTORE_STALL_TIMEOUT", "900"))
+
+# ILM shrink renames an index to shrink-<random>-<index>
+SHRINK_PREFIX = re.compile(r"^shrink-[a-z0-9]+-")
+PARTITION = re.compile(r"^(?P<family>.+)-(?P<number>\d+)$")
+
+class RestoreError(Exception):
+    """Raised when an index restore fails, stalls or runs past its deadline."""
+
+def es(method, path, body=None):
+    response = requests.request(method, f"{es_url}{path}", json=body, timeout=request_timeout)
+    response.raise_for_status()
+    return response.json()
+
+def wait_for_cluster():
+    """Block until the cluster answers with at least yellow health."""
+    while True:
+        try:
+            health = es("GET", "/_cluster/health?wait_for_status=yellow&timeout=30s")
+            if not health.get("timed_out"):
+                print(f"Cluster {health['cluster_name']} is {health['status']} with {health['number_of_data_nodes']} data nodes")
+                return
+            print(f"Cluster is {health['status']}, waiting")
+        except requests.RequestException as e:
+            print(f"Waiting for Elasticsearch at {es_url}: {e}")
+            time.sleep(5)
+
+def warm_policy():
+    """
+    ILM policy for partitions Hyperion has finished writing. The warm phase
+    implicitly migrates the index to data_warm nodes, drops replicas,
+    shrinks it and merges it down to one segment so it costs as little
+    heap and disk as possible while staying searchable.
+    """
+    return {
+        "policy": {
+            "_meta": {"managed_by": "es-manager"},
+            "phases": {
+                "hot": {
+                    "min_age": "0ms",
+                    "actions": {"set_priority": {"priority": 100}},
+                },
+                "warm": {
+                    "min_age": warm_min_age,
+                    "actions": {
+                        "allocate": {"number_of_replicas": warm_replicas},
+                        "shrink": {"number_of_shards": warm_shrink_shards},
+                        "forcemerge": {"max_num_segments": 1},
+                        "set_priority": {"priority": 50},
+                    },
+                },
+            },
+        }
+    }
+
+def tiering_template():
+    """
+    Legacy template merged on top of Hyperion's own index templates, so
+    new partitions are created on the hot tier without overriding
+    Hyperion's mappings.
+    """
+    return {
+        "index_patterns": [pattern.strip() for pattern in lifecycle_indices.split(",") if pattern.strip()],
+        "order": 100,
+        "settings": {"index.routing.allocation.include._tier_preference": "data_hot"},
+    }
+
+def install_lifecycle():
+    es("PUT", f"/_ilm/policy/{lifecycle_policy}", warm_policy())
+    es("PUT", f"/_template/{lifecycle_template}", tiering_template())
+    print(f"Installed ILM policy {lifecycle_policy} and index template {lifecycle_template} for {lifecycle_indices}")
+
+def sealed_partitions(indices):
+    """
+    Indices that are no longer among the newest `keep_hot_partitions`
+    partitions of their family (wax-action-v1-000003 is sealed once
+    wax-action-v1-000004 exists).
+    """
+    families = {}
+    for index in indices:
+        match = PARTITION.match(SHRINK_PREFIX.sub("", index))
+        if match:
+            families.setdefault(match.group("family"), []).append((int(match.group("number")), index))
+    sealed = []
+    for partitions in families.values():
+        partitions.sort()
+        sealed += [index for _, index in partitions[:-keep_hot_partitions]]
+    return sealed
+
+def apply_lifecycle():
+    """Attach the warm policy to sealed partitions that do not have one yet."""
+    settings = es("GET", f"/{lifecycle_indices}/_settings/index.lifecycle.name?expand_wildcards=open")
+    for index in sealed_partitions(settings):
+        if settings[index]["settings"].get("index", {}).get("lifecycle", {}).get("name"):
+            continue
+        # Age the partition from the moment it was sealed, not from its creation
+        es("PUT", f"/{index}/_settings", {
+            "index.lifecycle.name": lifecycle_policy,
+            "index.lifecycle.origination_date": int(time.time() * 1000),
+        })
+        print(f"Sealed {index}: moving to the warm tier after {warm_min_age}")
+
+def install_index_layout():
+    """
+    One legacy template per pattern setting its primary shards and
+    replicas. It is ordered above Hyperion's own templates and the
+    tiering template, and below the backfill template, and only affects
+    partitions created from now on.
+    """
+    for entry in index_layout.split(","):
+        pattern, _, counts = entry.partition("=")
+        shards, _, replicas = counts.partition("/")
+        name = "hyperion-layout-" + pattern.rstrip("-*")
+        es("PUT", f"/_template/{name}", {
+            "index_patterns": [pattern],
+            "order": 150,
+            "settings": {"index.number_of_shards": int(shards), "index.number_of_replicas": int(replicas)},
+        })
+        print(f"Installed index template {name}: {shards} primary shards, {replicas} replicas for {pattern}")
+
+BACKFILL_SETTINGS = {
+    "index.refresh_interval": "-1",
+    "index.number_of_replicas": 0,
+    "index.translog.durability": "async",
+}
+
+def indexer_lag():
+    """Blocks between nodeos head and the highest block Hyperion has indexed."""
+    response = requests.get(f"{nodeos_url}/v1/chain/get_info", timeout=request_timeout)
+    response.raise_for_status()
+    head = response.json()["head_block_num"]
+    result = es("POST", f"/{backfill_progress_index}/_search?ignore_unavailable=true&allow_no_indices=true",
+                {"size": 0, "aggs": {"indexed": {"max": {"field": "block_num"}}}})
+    indexed = int(result["aggregations"]["indexed"]["value"] or 0)
+    return head - indexed
+
+def apply_backfill_profile():
+    """
+    Stop refreshes, drop replicas and fsync the translog asynchronously on
+    the existing indices, and via a template on the partitions Hyperion
+    creates while it catches up.
+    """
+    es("PUT", f"/_template/{backfill_template}", {
+        "index_patterns": [pattern.strip() for pattern in backfill_indices.split(",") if pattern.strip()],
+        # Above the tiering template so these settings win
+        "order": 200,
+        "settings": BACKFILL_SETTINGS,
+    })
+    es("PUT", f"/{backfill_indices}/_settings?allow_no_indices=true", BACKFILL_SETTINGS)
+
+def apply_serving_profile():
+    """Undo apply_backfill_profile, leaving replicas of ILM-managed (warm) indices alone."""
+    try:
+        es("DELETE", f"/_template/{backfill_template}")
+    except requests.HTTPError as e:
+        if e.response.status_code != 404:
+            raise
+    es("PUT", f"/{backfill_indices}/_settings?allow_no_indices=true", {
+        "index.refresh_interval": serving_refresh_interval,
+        "index.translog.durability": "request",
+    })
+    settings = es("GET", f"/{backfill_indices}/_settings/index.lifecycle.name?expand_wildcards=open")
+    unmanaged = [index for index, values in settings.items()
+                 if not values["settings"].get("index", {}).get("lifecycle", {}).get("name")]
+    if unmanaged:
+        es("PUT", f"/{','.join(unmanaged)}/_settings", {"index.number_of_replicas": serving_replicas})
+    es("POST", f"/{backfill_indices}/_refresh?allow_no_indices=true")
+
+def update_backfill(active):
+    """
+    Move between the backfill and serving profiles. `active` is None on
+    the first check, which decides whether a backfill is running at all;
+    once the indexer has caught up the serving profile stays.
+    """
+    lag = indexer_lag()
+    if active is None:
+        if lag <= backfill_catchup_blocks:
+            print(f"Indexer is {lag} blocks behind head, keeping the serving profile")
+            return False
+        apply_backfill_profile()
+        print(f"Indexer is {lag} blocks behind head, applied the backfill profile to {backfill_indices}")
+        return True
+    if lag <= backfill_catchup_blocks:
+        apply_serving_profile()
+        print(f"Indexer caught up ({lag} blocks behind head), restored the serving profile")
+        return False
+    print(f"Backfilling, {lag} blocks behind head")
+    return True
+
+def install_snapshot_repository():
+    es("PUT", f"/_snapshot/{snapshot_repository}", {
+        "type": "fs",
+        "settings": {"location": snapshot_location, "compress": True},
+    })
+
+def install_snapshots():
+    """
+    Register the repository and the SLM policy. Every snapshot after the
+    first only copies segment files the repository does not have yet, so
+    the schedule can be frequent without duplicating data.
+    """
+    install_snapshot_repository()
+    es("PUT", f"/_slm/policy/{snapshot_policy}", {
+        "schedule": snapshot_schedule,
+        "name": "<hyperion-{now/d}>",
+        "repository": snapshot_repository,
+        "config": {
+            "indices": [pattern.strip() for pattern in snapshot_indices.split(",") if pattern.strip()],
+            "include_global_state": False,
+        },
+        "retention": {"expire_after": snapshot_retention, "min_count": 3},
+    })
+    print(f"Installed snapshot repository {snapshot_repository} ({snapshot_location}) and "
+          f"SLM policy {snapshot_policy} on '{snapshot_schedule}'")
+
+def latest_snapshot():
+    snapshots = es("GET", f"/_snapshot/{snapshot_repository}/_all")["snapshots"]
+    successful = [snapshot for snapshot in snapshots if snapshot["state"] == "SUCCESS"]
+    if not successful:
+        raise SystemExit(f"No successful snapshot in {snapshot_repository}")
+    return max(successful, key=lambda snapshot: snapshot["start_time_in_millis"])
+
+def failed_primaries(index):
+    """Primary shards of `index` whose snapshot recovery failed and left them unassigned."""
+    shards = es("GET", f"/_cat/shards/{index}?format=json&h=shard,prirep,state,unassigned.reason")
+    return [shard["shard"] for shard in shards
+            if shard["prirep"] == "p" and shard["state"] == "UNASSIGNED"
+            and shard.get("unassigned.reason") == "ALLOCATION_FAILED"]
+
+def wait_for_recovery(index, abort):
+    """
+    Poll the recovery API until every primary shard of a restoring index
+    has finished copying its files. Shards still queued behind the
+    recovery throttle are not listed yet, hence the count check. Raises
+    RestoreError when a primary failed to recover, nothing moved for
+    RESTORE_STALL_TIMEOUT seconds or RESTORE_TIMEOUT has passed, and
+    stops waiting once `abort` is set because another index failed.
+    """
+    settings = es("GET", f"/{index}/_settings/index.number_of_shards")
+    primaries = int(settings[index]["settings"]["index"]["number_of_shards"])
+    started = time.monotonic()
+    progress = None
+    progressed_at = started
+    while True:
+        shards = es("GET", f"/{index}/_recovery").get(index, {}).get("shards", [])
+        done = sum(1 for shard in shards if shard["primary"] and shard["stage"] == "DONE")
+        if done == primaries:
+            return
+
+        failed = failed_primaries(index)
+        if failed:
+            raise RestoreError(f"{index}: recovery of primary shard(s) {', '.join(failed)} failed")
+
+        now = time.monotonic()
+        current = (done, sum(shard["index"]["size"].get("recovered_in_bytes", 0) for shard in shards))
+        if current != progress:
+            progress, progressed_at = current, now
+        elif now - progressed_at >= restore_stall_timeout:
+            raise RestoreError(f"{index}: no recovery progress for {restore_stall_timeout:.0f}s "
+                               f"({done}/{primaries} primaries done)")
+        if now - started >= restore_timeout:
+            raise RestoreError(f"{index}: not restored within {restore_timeout:.0f}s ({done}/{primaries} primaries done)")
+        if abort.wait(restore_poll_interval):
+            raise RestoreError(f"{index}: stopped waiting after another index failed")
+
+def restore_index(snapshot, index, abort):
+    """
+    Start the restore of one index and wait for its primaries. A restore
+    can take far longer than any sane client timeout, so the request
+    returns once the restore is accepted and completion is polled. Any
+    failure sets `abort`, so queued indices are not started and the other
+    workers stop waiting.
+    """
+    if abort.is_set():
+        raise RestoreError(f"{index}: not started after another index failed")
+    started = time.time()
+    try:
+        es("POST", f"/_snapshot/{snapshot_repository}/{snapshot}/_restore?wait_for_completion=false", {
+            "indices": index,
+            "include_global_state": False,
+            "include_aliases": True,
+        })
+        wait_for_recovery(index, abort)
+    except Exception:
+        abort.set()
+        raise
+    print(f"Restored {index} in {time.time() - started:.0f}s")
+    return index
+
+def restore(snapshot=None, pattern=None, parallelism=None):
+    """
+    Rehydrate a fresh cluster from a snapshot: every index missing from
+    the cluster is restored by its own request, `parallelism` at a time,
+    with the per-node recovery limit raised to match so the shard file
+    copies run side by side.
+    """
+    wait_for_cluster()
+    install_snapshot_repository()
+    parallelism = parallelism or restore_parallelism
+    info = es("GET", f"/_snapshot/{snapshot_repository}/{snapshot}")["snapshots"][0] if snapshot else latest_snapshot()
+    patterns = [p.strip() for p in (pattern or snapshot_indices).split(",") if p.strip()]
+    existing = set(es("GET", "/_settings/index.uuid?expand_wildcards=all"))
+    indices = sorted(index for index in info["indices"]
+                     if any(fnmatch.fnmatch(index, p) for p in patterns) and index not in existing)
+    skipped = [index for index in info["indices"] if index in existing]
+    if skipped:
+        print(f"Skipping {len(skipped)} indices that already exist: {', '.join(sorted(skipped))}")
+    print(f"Restoring {len(indices)} indices from {info['snapshot']} with {parallelism} in parallel")
+
+    es("PUT", "/_cluster/settings", {"persistent": {"cluster.routing.allocation.node_concurrent_recoveries": parallelism}})
+    started = time.time()
+    abort = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            list(pool.map(lambda index: restore_index(info["snapshot"], index, abort), indices))
+    except (requests.RequestException, RestoreError):
+        # Accepted restores keep running on the cluster, so the limit stays raised
+        print(f"Restore interrupted; cluster.routing.allocation.node_concurrent_recoveries is left at {parallelism} "
+              f"until the running restores finish and it is reset to null")
+        raise
+    es("PUT", "/_cluster/settings", {"persistent": {"cluster.routing.allocation.node_concurrent_recoveries": None}})
+    print(f"Restored {len(indices)} indices in {time.time() - started:.0f}s")
+
+def run():
+    wait_for_cluster()
+    if lifecycle_enabled:
+        install_lifecycle()
+    if index_layout:
+        install_index_layout()
+    if snapshot_enabled:
+        install_snapshots()
+    backfilling = None if backfill_enabled else False
+    while True:
+        if backfilling is not False:
+            try:
+                backfilling = update_backfill(backfilling)
+            except (requests.RequestException, KeyError) as e:
+                print(f"Backfill check failed: {e}")
+        if lifecycle_enabled:
+            try:
+                apply_lifecycle()
+            except requests.RequestException as e:
+                print(f"Lifecycle check failed: {e}")
+        time.sleep(check_interval)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the Hyperion Elasticsearch cluster")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("run", help="Install policies and templates, then keep them applied (default)")
+
+    subparsers.add_parser("snapshot", help="Take a snapshot with the SLM policy now")
+
+    restore_parser = subparsers.add_parser("restore", help="Restore indices missing from the cluster from a snapshot")
+    restore_parser.add_argument("--snapshot", help="Snapshot name (default: the latest successful one)")
+    restore_parser.add_argument("--indices", help=f"Comma separated index patterns (default: {snapshot_indices})")
+    restore_parser.add_argument("--parallel", type=int, help=f"Indices restored at once (default: {restore_parallelism})")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args.command = "run"
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "run":
+        run()
+    elif args.command == "snapshot":
+        wait_for_cluster()
+        result = es("POST", f"/_slm/policy/{snapshot_policy}/_execute")
+        print(f"Started snapshot {result['snapshot_name']}")
+    elif args.command == "restore":
+        try:
+            restore(args.snapshot, args.indices, args.parallel)
+        except RestoreError as e:
+            raise SystemExit(f"Restore failed: {e}")
@@ -1,10 +1,590 @@
+import argparse
+import base64
+import fnmatch
+import hashlib
+import json
+import math
 import os
+import re
+import sys
+import textwrap
+from dataclasses import dataclass, field, fields
+import yaml
 from dotenv import load_dotenv
 
-def generate_elasticsearch_config():
-    return """
+COMPOSE_FILE = "docker-compose-generated-hyperion.yml"
+
+def env_field(env, default):
+    """Dataclass field loaded from the environment variable `env`."""
+    return field(default=default, metadata={"env": env})
+
+@dataclass
+class HyperionConfig:
+    """
+    Settings for the generated Hyperion stack. Every field is read from the
+    environment variable named in its metadata (see from_env), so defaults
+    live in one place and the compose builder never touches os.environ.
+    """
+    # Topology
+    amount_of_nodes: int = env_field("AMOUNT_OF_NODE_INSTANCES", 1)
+    amount_of_rabbitmq_instances: int = env_field("AMOUNT_OF_RABBITMQ_INSTANCES", 1)
+    monitoring_enabled: bool = env_field("MONITORING_ENABLED", True)
+    proxy_enabled: bool = env_field("PROXY_ENABLED", False)
+    certbot_enabled: bool = env_field("CERTBOT_ENABLED", False)
+
+    # Elasticsearch / Kibana
+    elasticsearch_version: str = env_field("ELASTICSEARCH_VERSION", "8.17.0")
+    elastic_min_mem: str = env_field("ELASTIC_MIN_MEM", "15g")
+    elastic_max_mem: str = env_field("ELASTIC_MAX_MEM", "15g")
+    es_heap_dump_path: str = env_field("ES_HEAP_DUMP_PATH", "/var/log/elasticsearch")
+    es_gc_log_path: str = env_field("ES_GC_LOG_PATH", "/var/log/elasticsearch")
+    es_java_opts: str = env_field("ES_JAVA_OPTS", "-XX:+HeapDumpOnOutOfMemoryError")
+    kibana_version: str = env_field("KIBANA_VERSION", "8.17.0")
+    # "auto" sizes heap, thread pools and limits from the host (see plan_elasticsearch)
+    es_sizing: str = env_field("ES_SIZING", "manual")
+    es_sizing_host_cpus: str = env_field("ES_SIZING_HOST_CPUS", "")
+    es_sizing_host_memory: str = env_field("ES_SIZING_HOST_MEMORY", "")
+    es_sizing_reserved_memory: str = env_field("ES_SIZING_RESERVED_MEMORY", "2g")
+    es_sizing_max_heap: str = env_field("ES_SIZING_MAX_HEAP", "26g")
+    # Role topology such as "masters=3,data=4,coordinating=2,warm=2"; empty
+    # keeps AMOUNT_OF_NODE_INSTANCES nodes that each hold every role
+    es_topology: str = env_field("ES_TOPOLOGY", "")
+    es_master_heap: str = env_field("ES_MASTER_HEAP", "2g")
+    es_master_memory: str = env_field("ES_MASTER_MEMORY", "4g")
+    es_master_cpus: str = env_field("ES_MASTER_CPUS", "1")
+    es_coordinating_heap: str = env_field("ES_COORDINATING_HEAP", "4g")
+    es_coordinating_memory: str = env_field("ES_COORDINATING_MEMORY", "8g")
+    es_coordinating_cpus: str = env_field("ES_COORDINATING_CPUS", "2")
+    es_warm_heap: str = env_field("ES_WARM_HEAP", "8g")
+    es_warm_memory: str = env_field("ES_WARM_MEMORY", "16g")
+    es_warm_cpus: str = env_field("ES_WARM_CPUS", "2")
+    # Host directories for the hot (data) and warm tier volumes, e.g. NVMe
+    # and spinning disks; empty uses named docker volumes
+    es_hot_data_path: str = env_field("ES_HOT_DATA_PATH", "")
+    es_warm_data_path: str = env_field("ES_WARM_DATA_PATH", "")
+    # Index lifecycle applied by es-manager when there is a warm tier
+    es_lifecycle_indices: str = env_field("ES_LIFECYCLE_INDICES", "wax-action-*,wax-delta-*")
+    es_warm_min_age: str = env_field("ES_WARM_MIN_AGE", "1d")
+    es_warm_replicas: int = env_field("ES_WARM_REPLICAS", 0)
+    es_warm_shrink_shards: int = env_field("ES_WARM_SHRINK_SHARDS", 1)
+    # Shard layout for new Hyperion partitions: manual keeps Hyperion's
+    # templates, auto derives shards/replicas from data nodes and volume
+    es_shard_layout: str = env_field("ES_SHARD_LAYOUT", "manual")
+    es_daily_actions: int = env_field("ES_DAILY_ACTIONS", 0)
+    es_daily_deltas: int = env_field("ES_DAILY_DELTAS", 0)
+    es_action_doc_size: str = env_field("ES_ACTION_DOC_SIZE", "1k")
+    es_delta_doc_size: str = env_field("ES_DELTA_DOC_SIZE", "512")
+    es_target_shard_size: str = env_field("ES_TARGET_SHARD_SIZE", "30g")
+    es_index_replicas: int = env_field("ES_INDEX_REPLICAS", 1)
+    # Snapshot repository shared by every ES node, and the SLM schedule
+    es_snapshots: bool = env_field("ES_SNAPSHOTS", False)
+    es_snapshot_path: str = env_field("ES_SNAPSHOT_PATH", "")
+    es_snapshot_schedule: str = env_field("ES_SNAPSHOT_SCHEDULE", "0 30 1 * * ?")
+    es_snapshot_indices: str = env_field("ES_SNAPSHOT_INDICES", "wax-*")
+    es_snapshot_retention: str = env_field("ES_SNAPSHOT_RETENTION", "30d")
+    es_restore_parallelism: int = env_field("ES_RESTORE_PARALLELISM", 4)
+    es_restore_timeout: int = env_field("ES_RESTORE_TIMEOUT", 21600)
+    es_restore_stall_timeout: int = env_field("ES_RESTORE_STALL_TIMEOUT", 900)
+    # Bulk-ingest profile held by es-manager until the indexer reaches head
+    es_backfill: bool = env_field("ES_BACKFILL", False)
+    es_backfill_indices: str = env_field("ES_BACKFILL_INDICES", "wax-*")
+    es_backfill_progress_index: str = env_field("ES_BACKFILL_PROGRESS_INDEX", "wax-block-*")
+    es_backfill_catchup_blocks: int = env_field("ES_BACKFILL_CATCHUP_BLOCKS", 600)
+    es_backfill_index_buffer: str = env_field("ES_BACKFILL_INDEX_BUFFER", "40%")
+    es_backfill_write_queue_size: int = env_field("ES_BACKFILL_WRITE_QUEUE_SIZE", 10000)
+    es_serving_refresh_interval: str = env_field("ES_SERVING_REFRESH_INTERVAL", "1s")
+    es_serving_replicas: int = env_field("ES_SERVING_REPLICAS", 0)
+
+    # RabbitMQ
+    rabbitmq_cluster_name: str = env_field("RABBITMQ_CLUSTER_NAME", "hyperion-cluster")
+    rabbitmq_erlang_cookie: str = env_field("RABBITMQ_ERLANG_COOKIE", "SWQOKODSQALRPCLNMEQG")
+    rabbitmq_user: str = env_field("RABBITMQ_DEFAULT_USER", "rabbitmquser")
+    rabbitmq_pass: str = env_field("RABBITMQ_DEFAULT_PASS", "rabbitmqpass")
+    rabbitmq_vhost: str = env_field("RABBITMQ_DEFAULT_VHOST", "hyperion")
+    rabbitmq_haproxy_check_inter: str = env_field("RABBITMQ_HAPROXY_CHECK_INTER", "2s")
+    rabbitmq_haproxy_check_rise: int = env_field("RABBITMQ_HAPROXY_CHECK_RISE", 2)
+    rabbitmq_haproxy_check_fall: int = env_field("RABBITMQ_HAPROXY_CHECK_FALL", 3)
+    # classic, or quorum to replicate Hyperion's pipeline queues with their leaders spread across the brokers
+    rabbitmq_queue_type: str = env_field("RABBITMQ_QUEUE_TYPE", "classic")
+    # Comma-separated exchanges partitioned by the sharding plugin into a queue on every broker
+    rabbitmq_sharded_exchanges: str = env_field("RABBITMQ_SHARDED_EXCHANGES", "")
+    rabbitmq_shards_per_node: int = env_field("RABBITMQ_SHARDS_PER_NODE", 1)
+
+    # Hyperion / nodeos
+    hyperion_environment: str = env_field("HYPERION_ENVIRONMENT", "testnet")
+    hyperion_launch_on_startup: str = env_field("HYPERION_LAUNCH_ON_STARTUP", "false")
+    hyperion_version: str = env_field("HYPERION_VERSION", "v3.3.10-1")
+    leap_file: str = env_field("LEAP_FILE", "https://apt.eossweden.org/wax/pool/stable/w/wax-leap-404wax01/wax-leap-404wax01_4.0.4wax01-ubuntu-18.04_amd64.deb")
+    # Readiness gate (hyperion/Deployment/wait-for-stack.sh) before the indexer starts
+    hyperion_ready_timeout: int = env_field("HYPERION_READY_TIMEOUT", 600)
+    hyperion_ready_nodeos_max_lag: int = env_field("HYPERION_READY_NODEOS_MAX_LAG", 30)
+    # Backpressure controller pausing pipeline intake on deep queues or ES write
+    # rejections; depths of 0 follow the chain config's scaling block
+    hyperion_backpressure: bool = env_field("HYPERION_BACKPRESSURE", False)
+    hyperion_backpressure_pause_depth: int = env_field("HYPERION_BACKPRESSURE_PAUSE_DEPTH", 0)
+    hyperion_backpressure_resume_depth: int = env_field("HYPERION_BACKPRESSURE_RESUME_DEPTH", 0)
+    hyperion_backpressure_max_rejections: str = env_field("HYPERION_BACKPRESSURE_MAX_REJECTIONS", "1")
+    leap_deb_file: str = env_field("LEAP_DEB_FILE", "wax-leap-404wax01_4.0.4wax01-ubuntu-18.04_amd64.deb")
+
+    # Monitoring
+    gf_username: str = env_field("GF_USERNAME", "admin")
+    gf_password: str = env_field("GF_PASSWORD", "admin123")
+    nodeos_exporter_endpoints: str = env_field("NODEOS_EXPORTER_ENDPOINTS", "node=http://node:8888")
+    nodeos_exporter_mode: str = env_field("NODEOS_EXPORTER_MODE", "poll")
+    nodeos_exporter_ship_urls: str = env_field("NODEOS_EXPORTER_SHIP_URLS", "node=ws://node:9876")
+    # "node" runs one elasticsearch-exporter per ES node scraped every
+    # second; "cluster" runs a single --es.all exporter
+    es_exporter_mode: str = env_field("ES_EXPORTER_MODE", "node")
+    es_exporter_scrape_interval: str = env_field("ES_EXPORTER_SCRAPE_INTERVAL", "15s")
+    es_exporter_indices: bool = env_field("ES_EXPORTER_INDICES", False)
+    es_exporter_indices_interval: str = env_field("ES_EXPORTER_INDICES_INTERVAL", "60s")
+    # "exporter" runs a kbudde rabbitmq-exporter per broker; "native" only
+    # scrapes the brokers' rabbitmq_prometheus endpoints
+    rabbitmq_exporter_mode: str = env_field("RABBITMQ_EXPORTER_MODE", "exporter")
+    rabbitmq_scrape_interval: str = env_field("RABBITMQ_SCRAPE_INTERVAL", "15s")
+    # GC log sidecar per ES node (es-gc-exporter)
+    es_gc_exporter: bool = env_field("ES_GC_EXPORTER", False)
+    nodeos_exporter_probes: str = env_field("NODEOS_EXPORTER_PROBES", "get_info,get_block,get_account,get_table_rows")
+
+    # Proxy / certificates
+    haproxy_http_port: str = env_field("HAPROXY_HTTP_PORT", "80")
+    haproxy_https_port: str = env_field("HAPROXY_HTTPS_PORT", "443")
+    certbot_email: str = env_field("CERTBOT_EMAIL", "")
+    certbot_staging: bool = env_field("CERTBOT_STAGING", True)
+    request_kibana_cert: bool = env_field("REQUEST_KIBANA_CERT", True)
+    request_grafana_cert: bool = env_field("REQUEST_GRAFANA_CERT", True)
+    request_hyperion_cert: bool = env_field("REQUEST_HYPERION_CERT", True)
+    production_alias_kibana: str = env_field("PRODUCTION_ALIAS_KIBANA", "")
+    production_alias_grafana: str = env_field("PRODUCTION_ALIAS_GRAFANA", "")
+    production_alias_hyperion: str = env_field("PRODUCTION_ALIAS_HYPERION", "")
+
+    # Resource constraints
+    redis_memory: str = env_field("REDIS_MEMORY", "2g")
+    redis_cpus: str = env_field("REDIS_CPUS", "1")
+    rabbitmq_memory: str = env_field("RABBITMQ_MEMORY", "2g")
+    rabbitmq_cpus: str = env_field("RABBITMQ_CPUS", "1")
+    hyperion_memory: str = env_field("HYPERION_MEMORY", "8g")
+    hyperion_cpus: str = env_field("HYPERION_CPUS", "2")
+    node_memory: str = env_field("NODE_MEMORY", "16g")
+    node_cpus: str = env_field("NODE_CPUS", "4")
+    kibana_memory: str = env_field("KIBANA_MEMORY", "2g")
+    kibana_cpus: str = env_field("KIBANA_CPUS", "1")
+    prometheus_memory: str = env_field("PROMETHEUS_MEMORY", "2g")
+    prometheus_cpus: str = env_field("PROMETHEUS_CPUS", "1")
+    grafana_memory: str = env_field("GRAFANA_MEMORY", "1g")
+    grafana_cpus: str = env_field("GRAFANA_CPUS", "1")
+    haproxy_memory: str = env_field("HAPROXY_MEMORY", "1g")
+    haproxy_cpus: str = env_field("HAPROXY_CPUS", "1")
+
+    def __post_init__(self):
+        if self.amount_of_nodes < 1:
+            raise ValueError("AMOUNT_OF_NODE_INSTANCES must be at least 1")
+        if self.amount_of_rabbitmq_instances < 1:
+            raise ValueError("AMOUNT_OF_RABBITMQ_INSTANCES must be at least 1")
+        if self.es_sizing not in ("manual", "auto"):
+            raise ValueError(f"ES_SIZING must be manual or auto, got {self.es_sizing!r}")
+        if self.es_exporter_mode not in ("node", "cluster"):
+            raise ValueError(f"ES_EXPORTER_MODE must be node or cluster, got {self.es_exporter_mode!r}")
+        if self.es_shard_layout not in ("manual", "auto"):
+            raise ValueError(f"ES_SHARD_LAYOUT must be manual or auto, got {self.es_shard_layout!r}")
+        if self.rabbitmq_queue_type not in ("classic", "quorum"):
+            raise ValueError(f"RABBITMQ_QUEUE_TYPE must be classic or quorum, got {self.rabbitmq_queue_type!r}")
+        if self.rabbitmq_shards_per_node < 1:
+            raise ValueError("RABBITMQ_SHARDS_PER_NODE must be at least 1")
+        if self.rabbitmq_exporter_mode not in ("exporter", "native"):
+            raise ValueError(f"RABBITMQ_EXPORTER_MODE must be exporter or native, got {self.rabbitmq_exporter_mode!r}")
+        if self.hyperion_backpressure and not self.monitoring_enabled:
+            raise ValueError("HYPERION_BACKPRESSURE reads queue depths and rejections from Prometheus; set MONITORING_ENABLED=true")
+        self.es_tier_counts()
+
+    @classmethod
+    def from_env(cls):
+        """Build the config from os.environ, converting values to each field's type."""
+        values = {}
+        for config_field in fields(cls):
+            raw = os.getenv(config_field.metadata["env"])
+            if raw is None:
+                continue
+            if config_field.type is bool:
+                values[config_field.name] = raw.lower() == "true"
+            elif config_field.type is int:
+                try:
+                    values[config_field.name] = int(raw)
+                except ValueError:
+                    raise ValueError(f"{config_field.metadata['env']} must be an integer, got {raw!r}")
+            else:
+                values[config_field.name] = raw
+        return cls(**values)
+
+    @property
+    def rabbitmq_clustered(self):
+        return self.amount_of_rabbitmq_instances > 1
+
+    @property
+    def rabbitmq_nodes(self):
+        """Compose service names of the RabbitMQ brokers."""
+        if not self.rabbitmq_clustered:
+            return ["rabbitmq"]
+        return [f"rabbitmq-{i}" for i in range(1, self.amount_of_rabbitmq_instances + 1)]
+
+    @property
+    def rabbitmq_sharded(self):
+        return [name.strip() for name in self.rabbitmq_sharded_exchanges.split(",") if name.strip()]
+
+    @property
+    def rabbitmq_plugins(self):
+        plugins = ["rabbitmq_management", "rabbitmq_prometheus"]
+        if self.rabbitmq_sharded:
+            plugins.append("rabbitmq_sharding")
+        return plugins
+
+    @property
+    def rabbitmq_definitions_enabled(self):
+        return self.rabbitmq_queue_type != "classic" or bool(self.rabbitmq_sharded)
+
+    def es_tier_counts(self):
+        """
+        Parse ES_TOPOLOGY into node counts per tier, or None when no
+        topology is set. "data" defaults to AMOUNT_OF_NODE_INSTANCES.
+        """
+        if not self.es_topology:
+            return None
+        counts = {"masters": 3, "data": self.amount_of_nodes, "coordinating": 0, "warm": 0}
+        for item in self.es_topology.split(","):
+            key, _, value = item.partition("=")
+            key = key.strip()
+            if key not in counts or not value.strip().isdigit():
+                raise ValueError(f"ES_TOPOLOGY entries must be masters=N, data=N, coordinating=N or warm=N, got {item!r}")
+            counts[key] = int(value)
+        if counts["masters"] < 1 or counts["data"] < 1:
+            raise ValueError("ES_TOPOLOGY needs at least one master and one data node")
+        return counts
+
+    @property
+    def es_lifecycle_enabled(self):
+        """Hot/warm index lifecycle management runs when ES_TOPOLOGY has a warm tier."""
+        counts = self.es_tier_counts()
+        return bool(counts and counts["warm"])
+
+    @property
+    def es_manager_enabled(self):
+        return self.es_lifecycle_enabled or self.es_backfill or self.es_shard_layout == "auto" or self.es_snapshots
+
+    @property
+    def es_snapshot_volume(self):
+        """Source of the snapshot repository mount: ES_SNAPSHOT_PATH or a named volume."""
+        return self.es_snapshot_path.rstrip("/") or "es-snapshots"
+
+@dataclass
+class ElasticsearchNode:
+    name: str
+    tier: str  # mixed, master, data, coordinating or warm
+    roles: str
+    volume: str  # named volume, or host directory for ES_HOT/WARM_DATA_PATH
+
+# Tier -> (service name prefix, node.roles) for ES_TOPOLOGY layouts
+ES_TIERS = {
+    "master": ("es-master", "[master]"),
+    "data": ("es-data", "[data, ingest, remote_cluster_client]"),
+    "coordinating": ("es-coord", "[]"),
+    "warm": ("es-warm", "[data_warm]"),
+}
+# Data node roles once a warm tier exists: new indices stay on the hot tier
+ES_HOT_ROLES = "[data_hot, data_content, ingest, remote_cluster_client]"
+# Elasticsearch's log directory; its bundled jvm.options writes gc.log here
+ES_LOG_DIR = "/usr/share/elasticsearch/logs"
+# Where the shared snapshot repository is mounted in every ES container
+ES_SNAPSHOT_LOCATION = "/usr/share/elasticsearch/snapshots"
+
+def elasticsearch_nodes(config):
+    """Every Elasticsearch node in the stack, masters first."""
+    counts = config.es_tier_counts()
+    if counts is None:
+        return [ElasticsearchNode(f"es{i}", "mixed", "[master, data, ingest, remote_cluster_client]", f"esdata{i}")
+                for i in range(1, config.amount_of_nodes + 1)]
+
+    counts = {"master": counts["masters"], "data": counts["data"], "coordinating": counts["coordinating"],
+              "warm": counts["warm"]}
+    data_paths = {"data": config.es_hot_data_path, "warm": config.es_warm_data_path}
+    nodes = []
+    for tier, (prefix, roles) in ES_TIERS.items():
+        if tier == "data" and counts["warm"]:
+            roles = ES_HOT_ROLES
+        for i in range(1, counts[tier] + 1):
+            name = f"{prefix}-{i}"
+            path = data_paths.get(tier)
+            volume = f"{path.rstrip('/')}/{name}" if path else f"{name}-data"
+            nodes.append(ElasticsearchNode(name, tier, roles, volume))
+    return nodes
+
+def master_eligible_nodes(nodes):
+    return [node for node in nodes if node.tier in ("mixed", "master")]
+
+def data_nodes(nodes):
+    """Nodes that take Hyperion's writes (the hot tier in hot/warm layouts)."""
+    return [node for node in nodes if node.tier in ("mixed", "data")]
+
+def client_nodes(nodes):
+    """Nodes that serve Kibana and Hyperion API queries: the coordinating tier when there is one."""
+    return [node for node in nodes if node.tier == "coordinating"] or data_nodes(nodes)
+
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+def parse_size(value):
+    """Parse a docker/JVM style size ("512m", "15g", "2gb") into bytes."""
+    text = str(value).strip().lower().rstrip("b") or "0"
+    unit = text[-1] if text[-1] in SIZE_UNITS else ""
+    number = text[:-1] if unit else text
+    try:
+        return int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"invalid size {value!r}")
+
+def format_size(size):
+    """Format bytes as the largest whole docker/JVM unit (g or m)."""
+    mb = size // 1024 ** 2
+    return f"{mb // 1024}g" if mb % 1024 == 0 else f"{mb}m"
+
+def read_cgroup(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def cgroup_cpu_limit():
+    """CPU quota of the current cgroup (v2, then v1), or None when unlimited."""
+    cpu_max = read_cgroup("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, period = cpu_max.split()
+        return int(quota) / int(period) if quota != "max" else None
+    quota = read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+def cgroup_memory_limit():
+    """Memory limit of the current cgroup (v2, then v1), or None when unlimited."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        value = read_cgroup(path)
+        # v1 reports "unlimited" as a huge page-aligned number
+        if value and value != "max" and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+@dataclass
+class HostResources:
+    cpus: float
+    memory: int
+
+    @classmethod
+    def detect(cls, config):
+        """
+        CPUs and memory available to the stack: ES_SIZING_HOST_CPUS/MEMORY
+        when set (to plan for another machine), otherwise the smaller of
+        the host totals and any cgroup limit the generator runs under.
+        """
+        if config.es_sizing_host_cpus:
+            cpus = float(config.es_sizing_host_cpus)
+        else:
+            cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+            quota = cgroup_cpu_limit()
+            if quota:
+                cpus = min(cpus, quota)
+
+        if config.es_sizing_host_memory:
+            memory = parse_size(config.es_sizing_host_memory)
+        else:
+            memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+            limit = cgroup_memory_limit()
+            if limit:
+                memory = min(memory, limit)
+        return cls(cpus=cpus, memory=memory)
+
+@dataclass
+class ElasticsearchPlan:
+    """Per-node Elasticsearch sizing computed by plan_elasticsearch."""
+    heap: int
+    memory: int
+    cpus: float
+    processors: int
+    write_threads: int
+    search_threads: int
+    index_buffer_percent: int
+
+    @property
+    def java_heap(self):
+        return format_size(self.heap)
+
+    @property
+    def memory_limit(self):
+        return format_size(self.memory)
+
+    @property
+    def cpu_limit(self):
+        return f"{self.cpus:g}"
+
+def size_node(heap, memory, cpus):
+    """Thread pools and indexing buffer for a node with the given heap, memory and CPUs."""
+    processors = max(int(cpus), 1)
+    if heap >= 8 * 1024 ** 3:
+        index_buffer_percent = 30
+    elif heap >= 4 * 1024 ** 3:
+        index_buffer_percent = 20
+    else:
+        index_buffer_percent = 10
+
+    return ElasticsearchPlan(
+        heap=heap,
+        memory=memory,
+        cpus=cpus,
+        processors=processors,
+        write_threads=processors,
+        # Elasticsearch's own default for the search pool
+        search_threads=processors * 3 // 2 + 1,
+        index_buffer_percent=index_buffer_percent,
+    )
+
+def co_located_limits(config, plans):
+    """Total memory and CPU limits of every service in the stack except the data nodes."""
+    data_names = {node.name for node in data_nodes(elasticsearch_nodes(config))}
+    memory = 0
+    cpus = 0.0
+    for name, service in build_services(config, plans).items():
+        if name in data_names:
+            continue
+        limits = service.get("deploy", {}).get("resources", {}).get("limits", {})
+        memory += parse_size(limits.get("memory", 0))
+        cpus += float(limits.get("cpus", 0))
+    return memory, cpus
+
+def plan_elasticsearch(config, host, plans):
+    """
+    Split the host resources left over by the rest of the stack (including
+    any dedicated master and coordinating nodes in `plans`) evenly between
+    the Elasticsearch data nodes so co-located nodes never add up to more
+    CPU or memory than the box has.
+
+    Each node gets half its memory share as heap (the rest is page cache
+    for Lucene), capped at ES_SIZING_MAX_HEAP to stay under the
+    compressed-oops cutoff. Thread pools follow the allocated processors
+    instead of fixed sizes, and the indexing buffer grows with the heap.
+    """
+    node_count = len(data_nodes(elasticsearch_nodes(config)))
+    other_memory, other_cpus = co_located_limits(config, plans)
+    memory_budget = host.memory - other_memory - parse_size(config.es_sizing_reserved_memory)
+    cpu_budget = host.cpus - other_cpus
+
+    memory = memory_budget // node_count
+    if memory < 2 * 1024 ** 3:
+        raise ValueError(
+            f"{format_size(host.memory)} host memory leaves {format_size(max(memory_budget, 0))} for "
+            f"{node_count} Elasticsearch nodes after {format_size(other_memory)} of other services; "
+            f"each node needs at least 2g"
+        )
+    # Whole 256m steps keep the JVM options readable
+    step = 256 * 1024 ** 2
+    heap = min(memory // 2, parse_size(config.es_sizing_max_heap)) // step * step
+    memory = memory // step * step
+
+    if cpu_budget < node_count:
+        print(f"Warning: other services already claim {other_cpus:g} of {host.cpus:g} CPUs; "
+              f"giving each Elasticsearch node 1 CPU oversubscribes the host")
+    cpus = max(cpu_budget / node_count, 1.0)
+    return size_node(heap, memory, round(cpus, 1))
+
+def elasticsearch_plans(config):
+    """
+    Sizing per node tier. Dedicated master, coordinating and warm nodes
+    are always sized from their ES_MASTER_*/ES_COORDINATING_*/ES_WARM_*
+    settings; data
+    nodes only with ES_SIZING=auto (otherwise they keep ELASTIC_*_MEM and
+    the static elasticsearch.yml).
+    """
+    plans = {}
+    if config.es_tier_counts():
+        plans["master"] = size_node(parse_size(config.es_master_heap), parse_size(config.es_master_memory),
+                                    float(config.es_master_cpus))
+        plans["coordinating"] = size_node(parse_size(config.es_coordinating_heap), parse_size(config.es_coordinating_memory),
+                                          float(config.es_coordinating_cpus))
+        plans["warm"] = size_node(parse_size(config.es_warm_heap), parse_size(config.es_warm_memory),
+                                  float(config.es_warm_cpus))
+    if config.es_sizing == "auto":
+        data_tier = "data" if config.es_tier_counts() else "mixed"
+        plans[data_tier] = plan_elasticsearch(config, HostResources.detect(config), plans)
+    return plans
+
+# WAX produces a block every half second
+BLOCKS_PER_DAY = 2 * 60 * 60 * 24
+# Planning horizon for indices Hyperion does not partition (index_partition_size 0)
+UNPARTITIONED_DAYS = 365
+
+@dataclass
+class IndexLayout:
+    """Shard layout for the partitions matching `pattern`, installed as an index template by es-manager."""
+    pattern: str
+    shards: int
+    replicas: int
+    partition_size: int  # expected primary bytes per partition
+
+def chain_config(config):
+    """The Hyperion chain config baked into the image."""
+    path = f"hyperion/Deployment/{config.hyperion_environment}/chains/wax.config.json"
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def chain_settings(config):
+    """The "settings" block of the Hyperion chain config."""
+    return chain_config(config).get("settings", {})
+
+def plan_index_layout(config):
+    """
+    Primary shards and replicas for new action and delta partitions.
+
+    A partition spans index_partition_size blocks, so its expected size is
+    daily volume x document size x the days it takes to fill. That is
+    split into shards of at most ES_TARGET_SHARD_SIZE, rounded up to a
+    multiple of the data node count so every node takes an equal share of
+    the bulk writes. Replicas are capped so each copy can live on a
+    different node.
+    """
+    data_count = len(data_nodes(elasticsearch_nodes(config)))
+    settings = chain_settings(config)
+    chain = settings.get("chain", "wax")
+    partition_blocks = settings.get("index_partition_size", 0)
+    days = partition_blocks / BLOCKS_PER_DAY if partition_blocks else UNPARTITIONED_DAYS
+    target = parse_size(config.es_target_shard_size)
+    replicas = min(config.es_index_replicas, data_count - 1)
+
+    layouts = []
+    for family, daily, doc_size in (("action", config.es_daily_actions, config.es_action_doc_size),
+                                    ("delta", config.es_daily_deltas, config.es_delta_doc_size)):
+        size = int(daily * days * parse_size(doc_size))
+        shards = max(math.ceil(size / target), 1)
+        shards = math.ceil(shards / data_count) * data_count
+        if config.es_lifecycle_enabled and shards % config.es_warm_shrink_shards:
+            raise ValueError(f"ES_WARM_SHRINK_SHARDS={config.es_warm_shrink_shards} must divide the "
+                             f"{shards} primary shards planned for {chain}-{family}-*")
+        layouts.append(IndexLayout(f"{chain}-{family}-*", shards, replicas, size))
+    return layouts
+
+def generate_elasticsearch_config(plan=None, backfill=None):
+    """
+    elasticsearch.yml for a node: the static defaults, or sized from
+    `plan`. `backfill` is a (index buffer, write queue size) pair that
+    overrides both for bulk-ingest catch-up; they are node settings, so
+    they stay until the file is regenerated and the node restarted.
+    """
+    if plan is not None:
+        return generate_planned_elasticsearch_config(plan, backfill)
+    index_buffer, write_queue_size = backfill or ("30%", 1000)
+    return f"""
 # Memory settings
-indices.memory.index_buffer_size: 30%
+indices.memory.index_buffer_size: {index_buffer}
 indices.fielddata.cache.size: 25%
 indices.queries.cache.size: 25%
 
@@ -12,7 +592,7 @@ indices.queries.cache.size: 25%
 thread_pool:
   write:
     size: 8
-    queue_size: 1000
+    queue_size: {write_queue_size}
   search:
     size: 12
     queue_size: 1000
@@ -31,63 +611,156 @@ cluster.routing.allocation.disk.threshold_enabled: false
 http.max_content_length: 500mb
 """
 
-def setup_elasticsearch_config(node_count):
-    import os
-    
+def generate_planned_elasticsearch_config(plan, backfill=None):
+    index_buffer, write_queue_size = backfill or (f"{plan.index_buffer_percent}%", 1000)
+    return f"""
+# Sized for {plan.java_heap} heap, {plan.memory_limit} memory and {plan.cpu_limit} CPUs per node
+node.processors: {plan.processors}
+
+# Memory settings
+indices.memory.index_buffer_size: {index_buffer}
+indices.fielddata.cache.size: 20%
+indices.queries.cache.size: 10%
+
+# Thread pool settings
+thread_pool:
+  write:
+    size: {plan.write_threads}
+    queue_size: {write_queue_size}
+  search:
+    size: {plan.search_threads}
+    queue_size: 1000
+
+# Recovery settings
+indices.recovery.max_bytes_per_sec: 500mb
+indices.recovery.max_concurrent_file_chunks: 8
+
+# Cache settings
+cache.recycler.page.type: NONE
+
+# Disk settings
+cluster.routing.allocation.disk.threshold_enabled: false
+
+# HTTP settings
+http.max_content_length: 500mb
+"""
+
+def setup_elasticsearch_config(nodes, plans=None, backfill=None):
     # Create base elasticsearch config directory
     os.makedirs("elasticsearch/config", exist_ok=True)
     
-    # Generate elasticsearch.yml content
-    es_config = generate_elasticsearch_config()
-    
     # Create config directory and files for each node
-    for i in range(1, node_count + 1):
-        node_config_dir = f"elasticsearch/config/es{i}"
+    for node in nodes:
+        node_config_dir = f"elasticsearch/config/{node.name}"
         os.makedirs(node_config_dir, exist_ok=True)
         
+        # Generate elasticsearch.yml content for the node's tier
+        es_config = generate_elasticsearch_config((plans or {}).get(node.tier),
+                                                  backfill if node in data_nodes(nodes) else None)
+        
         # Write elasticsearch.yml only
         with open(f"{node_config_dir}/elasticsearch.yml", "w") as f:
             f.write(es_config)
 
-def setup_rabbitmq_cluster_config(instance_count):
-    """Setup RabbitMQ cluster configuration files"""
-    if instance_count == 1:
-        print("Single RabbitMQ instance, using standard configuration.")
-        return
-    
-    # Create cluster configuration
-    cluster_config = """# rabbitmq-cluster.conf
-# Memory and resource management
-vm_memory_high_watermark.relative = 0.4
-vm_memory_high_watermark_paging_ratio = 0.5
-disk_free_limit.relative = 1.0
+RABBITMQ_WATERMARK_FRACTION = 0.6
+
+@dataclass
+class RabbitMQPlan:
+    """Per-broker memory and flow-control settings computed by plan_rabbitmq."""
+    memory: int
+    schedulers: int
+    watermark: int
+    acceptors: int
+    channel_max: int
+    connection_max: int
+    max_message_size: int
+    credit: int
+
+def plan_rabbitmq(memory, cpus):
+    """
+    Memory and flow-control settings for a broker with the given container
+    limits. A relative watermark is taken against memory the broker may
+    not be able to use, so the watermark is an absolute share of the
+    container limit. Channel and connection caps keep their memory inside
+    that share, and the per-process credit grows with memory so publishers
+    ride out replay bursts instead of blocking on flow control.
+    """
+    limit = parse_size(memory)
+    gib = limit / 1024 ** 3
+    schedulers = max(math.ceil(float(cpus)), 1)
+    watermark = int(limit * RABBITMQ_WATERMARK_FRACTION)
+    return RabbitMQPlan(
+        memory=limit,
+        schedulers=schedulers,
+        watermark=watermark,
+        acceptors=max(schedulers * 2, 2),
+        channel_max=min(max(int(gib * 256), 128), 2047),
+        # Roughly 256 KiB per connection with its channels, within a tenth of the limit
+        connection_max=max(int(limit * 0.1) // (256 * 1024), 256),
+        max_message_size=min(watermark // 8, 128 * 1024 ** 2),
+        credit=min(400 * max(int(gib // 2), 1), 2000),
+    )
+
+def rabbitmq_env_config(plan):
+    """
+    rabbitmq-env.conf with Erlang VM flags for the container's CPU limit:
+    one scheduler per allowed CPU instead of one per host core, unbound
+    schedulers (without a cpuset every broker would bind to the same
+    first cores) and no busy waiting that burns the CPU quota.
+    """
+    credit = f"{{{plan.credit},{plan.credit // 2}}}"
+    return f"""# rabbitmq-env.conf
+USE_LONGNAME=false
+SERVER_ADDITIONAL_ERL_ARGS="+S {plan.schedulers}:{plan.schedulers} +stbt u +sbwt none +sbwtdcpu none +sbwtdio none -rabbit credit_flow_default_credit {credit}"
+"""
 
+def setup_rabbitmq_cluster_config(instance_count, memory="2g", cpus="1"):
+    """Setup RabbitMQ configuration files, sized for each broker's container limits"""
+    plan = plan_rabbitmq(memory, cpus)
+    os.makedirs("rabbitmq/Deployment", exist_ok=True)
+    with open("rabbitmq/Deployment/rabbitmq-env.conf", "w") as f:
+        f.write(rabbitmq_env_config(plan))
+
+    clustered = instance_count > 1
+    name = "rabbitmq-cluster.conf" if clustered else "rabbitmq.conf"
+    config = f"""# {name}
+# Memory and resource management, sized for a {format_size(plan.memory)} container
+total_memory_available_override_value = {plan.memory}
+vm_memory_high_watermark.absolute = {plan.watermark}
+disk_free_limit.absolute = {plan.memory}
+"""
+
+    if clustered:
+        config += """
 # Cluster settings
 cluster_formation.peer_discovery_backend = rabbit_peer_discovery_classic_config
 """
-    
-    # Add cluster nodes configuration
-    for i in range(1, instance_count + 1):
-        cluster_config += f"cluster_formation.classic_config.nodes.{i} = rabbit@rabbitmq-{i}\n"
-    
-    cluster_config += """
-# Queue performance tuning for cluster
+        # Add cluster nodes configuration
+        for i in range(1, instance_count + 1):
+            config += f"cluster_formation.classic_config.nodes.{i} = rabbit@rabbitmq-{i}\n"
+
+    config += f"""
+# Queue performance tuning
 queue_index_embed_msgs_below = 4096
-num_acceptors.tcp = 8
+num_acceptors.tcp = {plan.acceptors}
 num_acceptors.ssl = 0
 
 # Message handling
-channel_max = 2000
-max_message_size = 134217728
+channel_max = {plan.channel_max}
+max_message_size = {plan.max_message_size}
 
-# Persistence and sync for cluster
-queue_master_locator = client-local
-mirroring_sync_batch_size = 4096
+# New queue leaders go to the broker hosting the fewest leaders
+queue_leader_locator = balanced
+"""
 
+    if clustered:
+        config += """
 # Cluster-specific settings
 cluster_partition_handling = autoheal
 cluster_keepalive_interval = 10000
+"""
 
+    config += f"""
 # Resource allocation
 reverse_dns_lookups = false
 
@@ -105,27 +778,34 @@ management.sample_retention_policies.detailed.10 = 5
 # Logging
 log.file.level = warning
 
-# TCP tuning for cluster
-tcp_listen_options.backlog = 256
+# Prometheus: per-node totals on /metrics; per-queue series are scraped
+# from /metrics/detailed for the Hyperion vhost only
+prometheus.return_per_object_metrics = false
+
+# TCP tuning
+tcp_listen_options.backlog = {max(plan.acceptors * 64, 128)}
 tcp_listen_options.nodelay = true
 tcp_listen_options.keepalive = true
 
+# Connection limits
+connection_max = {plan.connection_max}
+"""
+
+    if clustered:
+        config += """
 # Network partition handling
 net_ticktime = 60
 heartbeat = 60
+"""
 
-# Performance tuning for high-throughput
-vm_memory_high_watermark_paging_ratio = 0.5
-queue_master_locator = min-masters
+    with open(f"rabbitmq/Deployment/{name}", "w") as f:
+        f.write(config)
+    print(f"RabbitMQ sizing: {format_size(plan.watermark)} memory watermark, {plan.schedulers} schedulers, "
+          f"{plan.acceptors} acceptors, credit {plan.credit} per broker.")
+
+    if not clustered:
+        return
 
-# Connection limits for cluster
-connection_max = 10000
-"""
-    
-    # Write cluster configuration
-    with open("rabbitmq/Deployment/rabbitmq-cluster.conf", "w") as f:
-        f.write(cluster_config)
-    
     # Create dynamic nginx configuration for load balancer
     nginx_config = """events {
     worker_connections 1024;
@@ -203,9 +883,107 @@ http {
     
     print(f"Created RabbitMQ cluster configuration for {instance_count} instances.")
 
-def setup_rabbitmq_haproxy_config(instance_count, user, password):
-    """Generate HAProxy configuration for RabbitMQ cluster"""
-    import os
+def rabbitmq_password_hash(password):
+    """
+    RabbitMQ's rabbit_password_hashing_sha256 format: base64 of a random
+    4-byte salt followed by sha256(salt + password), so definitions.json
+    never holds the password itself.
+    """
+    salt = os.urandom(4)
+    return base64.b64encode(salt + hashlib.sha256(salt + password.encode()).digest()).decode()
+
+def rabbitmq_definitions(config):
+    """
+    Definitions every broker imports at boot when RABBITMQ_QUEUE_TYPE is
+    quorum. Hyperion declares its queues without a type, so the vhost's
+    default queue type makes the reader, deserializer and indexer queues
+    quorum queues. The policy places each new leader on the broker with
+    the fewest leaders, and lifts the delivery limit so messages Hyperion
+    requeues while Elasticsearch rejects bulks are never dropped.
+    """
+    chain = chain_settings(config).get("chain", "wax")
+    definitions = {
+        "users": [{
+            "name": config.rabbitmq_user,
+            "password_hash": rabbitmq_password_hash(config.rabbitmq_pass),
+            "hashing_algorithm": "rabbit_password_hashing_sha256",
+            "tags": ["administrator"],
+        }],
+        "vhosts": [{
+            "name": config.rabbitmq_vhost,
+            "default_queue_type": config.rabbitmq_queue_type,
+            "metadata": {"description": "Hyperion indexer pipeline", "default_queue_type": config.rabbitmq_queue_type},
+        }],
+        "permissions": [{
+            "user": config.rabbitmq_user,
+            "vhost": config.rabbitmq_vhost,
+            "configure": ".*",
+            "write": ".*",
+            "read": ".*",
+        }],
+        "policies": [{
+            "vhost": config.rabbitmq_vhost,
+            "name": "hyperion-pipeline",
+            "pattern": f"^{chain}:",
+            "apply-to": "quorum_queues",
+            "priority": 10,
+            "definition": {"queue-leader-locator": "balanced", "delivery-limit": -1},
+        }],
+        "exchanges": [],
+    }
+    sharded = config.rabbitmq_sharded
+    if sharded:
+        # The sharding plugin keeps shards-per-node queues behind each
+        # exchange on every broker, and hands a consumer of the exchange's
+        # name the local shard with the fewest consumers
+        definitions["exchanges"] = [{
+            "name": name,
+            "vhost": config.rabbitmq_vhost,
+            "type": "x-modulus-hash",
+            "durable": True,
+            "auto_delete": False,
+            "internal": False,
+            "arguments": {},
+        } for name in sharded]
+        definitions["policies"].append({
+            "vhost": config.rabbitmq_vhost,
+            "name": "hyperion-sharding",
+            "pattern": "^(" + "|".join(re.escape(name) for name in sharded) + ")$",
+            "apply-to": "exchanges",
+            "priority": 10,
+            "definition": {"shards-per-node": config.rabbitmq_shards_per_node, "routing-key": ""},
+        })
+    return definitions
+
+def setup_rabbitmq_definitions(config):
+    """Write the definitions file and the conf.d snippet that imports it at boot."""
+    if not config.rabbitmq_definitions_enabled:
+        return
+    os.makedirs("rabbitmq/Deployment", exist_ok=True)
+    with open("rabbitmq/Deployment/definitions.json", "w") as f:
+        json.dump(rabbitmq_definitions(config), f, indent=2)
+        f.write("\n")
+    with open("rabbitmq/Deployment/definitions.conf", "w") as f:
+        f.write("""# definitions.conf
+# Users, the Hyperion vhost and queue policies come from definitions.json
+definitions.import_backend = local_filesystem
+definitions.local.path = /etc/rabbitmq/definitions.json
+definitions.skip_if_unchanged = true
+""")
+    sharded = f", sharded exchanges {', '.join(config.rabbitmq_sharded)}" if config.rabbitmq_sharded else ""
+    print(f"Created RabbitMQ definitions: {config.rabbitmq_queue_type} queues in vhost {config.rabbitmq_vhost}{sharded}.")
+
+def setup_rabbitmq_haproxy_config(instance_count, user, password, check_inter="2s", check_rise=2, check_fall=3,
+                                  local_frontends=False):
+    """
+    Generate HAProxy configuration for RabbitMQ cluster. With
+    local_frontends, port 5680+i also leads to rabbitmq-i, falling back to
+    the other brokers only while it is down, so consumers of a sharded
+    exchange can pick the broker whose shards they read.
+    """
+    # Health check timing bounds failover: a dead node is ejected after
+    # roughly check_inter * check_fall
+    check = f"check inter {check_inter} rise {check_rise} fall {check_fall}"
     
     # Create rabbitmq/Deployment directory if it doesn't exist
     os.makedirs("rabbitmq/Deployment", exist_ok=True)
@@ -213,20 +991,36 @@ def setup_rabbitmq_haproxy_config(instance_count, user, password):
     # Generate server entries for all RabbitMQ instances
     server_entries = ""
     for i in range(1, instance_count + 1):
-        server_entries += f"    server rabbitmq-{i} rabbitmq-{i}:5672 check inter 2s rise 2 fall 3\n"
+        server_entries += f"    server rabbitmq-{i} rabbitmq-{i}:5672 {check}\n"
     
     # Generate HTTP server entries for management API
     http_server_entries = ""
     for i in range(1, instance_count + 1):
-        http_server_entries += f"    server rabbitmq-{i} rabbitmq-{i}:15672 check inter 2s rise 2 fall 3\n"
+        http_server_entries += f"    server rabbitmq-{i} rabbitmq-{i}:15672 {check}\n"
     
     # Generate Prometheus server entries
     prometheus_server_entries = ""
     for i in range(1, instance_count + 1):
-        prometheus_server_entries += f"    server rabbitmq-{i} rabbitmq-{i}:15692 check inter 2s rise 2 fall 3\n"
+        prometheus_server_entries += f"    server rabbitmq-{i} rabbitmq-{i}:15692 {check}\n"
     
+    local_entries = ""
+    if local_frontends:
+        for i in range(1, instance_count + 1):
+            local_entries += f"""
+frontend amqp_local_{i}_frontend
+    bind *:{5680 + i}
+    mode tcp
+    default_backend amqp_local_{i}_backend
+
+backend amqp_local_{i}_backend
+    mode tcp
+    option tcp-check
+    tcp-check connect port 5672
+"""
+            for j in range(1, instance_count + 1):
+                local_entries += f"    server rabbitmq-{j} rabbitmq-{j}:5672 {check}{'' if j == i else ' backup'}\n"
+
     # Create base64 encoded credentials for HTTP health check
-    import base64
     credentials = f"{user}:{password}"
     encoded_credentials = base64.b64encode(credentials.encode()).decode()
     
@@ -258,7 +1052,7 @@ backend amqp_backend
     balance roundrobin
     option tcp-check
     tcp-check connect port 5672
-{server_entries}
+{server_entries}{local_entries}
 # HTTP Management Load Balancer
 frontend http_frontend
     bind *:15672
@@ -291,764 +1085,915 @@ backend prometheus_backend
     
     print(f"Generated RabbitMQ HAProxy configuration for {instance_count} instances")
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Add these new environment variables
-es_heap_dump_path = os.getenv("ES_HEAP_DUMP_PATH", "/var/log/elasticsearch")
-es_gc_log_path = os.getenv("ES_GC_LOG_PATH", "/var/log/elasticsearch")
-es_java_opts = os.getenv("ES_JAVA_OPTS", "-XX:+HeapDumpOnOutOfMemoryError")
-monitoring_enabled = os.getenv("MONITORING_ENABLED", "true").lower() == "true"
-proxy_enabled = os.getenv("PROXY_ENABLED", "false").lower() == "true"
-haproxy_http_port = os.getenv("HAPROXY_HTTP_PORT", "80")
-haproxy_https_port = os.getenv("HAPROXY_HTTPS_PORT", "443")
-haproxy_memory = os.getenv("HAPROXY_MEMORY", "1g")
-haproxy_cpus = os.getenv("HAPROXY_CPUS", "1")
-certbot_enabled = os.getenv("CERTBOT_ENABLED", "false").lower() == "true"
-certbot_email = os.getenv("CERTBOT_EMAIL", "")
-certbot_staging = os.getenv("CERTBOT_STAGING", "true").lower() == "true"
-
-# Certificate request flags
-request_kibana_cert = os.getenv("REQUEST_KIBANA_CERT", "true").lower() == "true"
-request_grafana_cert = os.getenv("REQUEST_GRAFANA_CERT", "true").lower() == "true"
-request_hyperion_cert = os.getenv("REQUEST_HYPERION_CERT", "true").lower() == "true"
-
-# Load the number of nodes and other configurations from the environment
-amount_of_nodes = int(os.getenv("AMOUNT_OF_NODE_INSTANCES", 1))
-# Add RabbitMQ clustering configuration
-amount_of_rabbitmq_instances = int(os.getenv("AMOUNT_OF_RABBITMQ_INSTANCES", 1))
-rabbitmq_cluster_name = os.getenv("RABBITMQ_CLUSTER_NAME", "hyperion-cluster")
-rabbitmq_erlang_cookie = os.getenv("RABBITMQ_ERLANG_COOKIE", "SWQOKODSQALRPCLNMEQG")
-elasticsearch_version = os.getenv("ELASTICSEARCH_VERSION", "8.17.0")
-elastic_min_mem = os.getenv("ELASTIC_MIN_MEM", "15g")
-elastic_max_mem = os.getenv("ELASTIC_MAX_MEM", "15g")
-kibana_version = os.getenv("KIBANA_VERSION", "8.17.0")
-rabbitmq_user = os.getenv("RABBITMQ_DEFAULT_USER", "rabbitmquser")
-rabbitmq_pass = os.getenv("RABBITMQ_DEFAULT_PASS", "rabbitmqpass")
-rabbitmq_vhost = os.getenv("RABBITMQ_DEFAULT_VHOST", "hyperion")
-hyperion_environment = os.getenv("HYPERION_ENVIRONMENT", "testnet")
-hyperion_launch_on_startup = os.getenv("HYPERION_LAUNCH_ON_STARTUP", "false")
-hyperion_version = os.getenv("HYPERION_VERSION", "v3.3.10-1")
-leap_file = os.getenv("LEAP_FILE","https://apt.eossweden.org/wax/pool/stable/w/wax-leap-404wax01/wax-leap-404wax01_4.0.4wax01-ubuntu-18.04_amd64.deb")
-leap_deb_file=os.getenv("LEAP_DEB_FILE","wax-leap-404wax01_4.0.4wax01-ubuntu-18.04_amd64.deb")
-gf_username=os.getenv("GF_USERNAME","admin")
-gf_password=os.getenv("GF_PASSWORD","admin123")
-
-# Resource constraints
-redis_memory = os.getenv("REDIS_MEMORY", "2g")
-redis_cpus = os.getenv("REDIS_CPUS", "1")
-rabbitmq_memory = os.getenv("RABBITMQ_MEMORY", "2g")
-rabbitmq_cpus = os.getenv("RABBITMQ_CPUS", "1")
-hyperion_memory = os.getenv("HYPERION_MEMORY", "8g")
-hyperion_cpus = os.getenv("HYPERION_CPUS", "2")
-node_memory = os.getenv("NODE_MEMORY", "16g")
-node_cpus = os.getenv("NODE_CPUS", "4")
-kibana_memory = os.getenv("KIBANA_MEMORY", "2g")
-kibana_cpus = os.getenv("KIBANA_CPUS", "1")
-prometheus_memory = os.getenv("PROMETHEUS_MEMORY", "2g")
-prometheus_cpus = os.getenv("PROMETHEUS_CPUS", "1")
-grafana_memory = os.getenv("GRAFANA_MEMORY", "1g")
-grafana_cpus = os.getenv("GRAFANA_CPUS", "1")
-
-# Replace the existing production_alias variable with these
-production_alias_kibana = os.getenv("PRODUCTION_ALIAS_KIBANA", "")
-production_alias_grafana = os.getenv("PRODUCTION_ALIAS_GRAFANA", "")
-production_alias_hyperion = os.getenv("PRODUCTION_ALIAS_HYPERION", "")
-
-# Before the base_compose definition, add this helper function
-def generate_es_uri(node_count):
-    uris = [f'http://es{i}:9200' for i in range(1, node_count + 1)]
-    return ','.join(uris)
-
-def generate_es_exporters(node_count):
-    if not monitoring_enabled:
-        return ""
-        
-    exporters = ""
-    for i in range(1, node_count + 1):
-        exporter = f"""
-  elasticsearch-exporter-{i}:
-    image: quay.io/prometheuscommunity/elasticsearch-exporter:latest
-    container_name: elasticsearch-exporter-{i}
-    command:
-      - '--es.uri=http://es{i}:9200'
-    ports:
-      - "{9114 + i - 1}:9114"
-    depends_on:
-      - es{i}
-    networks:
-      - esnet
-"""
-        exporters += exporter
-    return exporters
-
-def generate_rabbitmq_cluster_services(instance_count, cluster_name, erlang_cookie, user, password, vhost, memory, cpus):
-    """Generate RabbitMQ cluster services configuration"""
-    if instance_count == 1:
-        # Single instance - no clustering needed
-        return f"""
-  rabbitmq:
-    build:
-      context: ./rabbitmq/Deployment
-      dockerfile: Dockerfile.rabbitmq  
-    container_name: rabbitmq
-    environment:
-      - RABBITMQ_DEFAULT_USER={user}
-      - RABBITMQ_DEFAULT_PASS={password}
-      - RABBITMQ_DEFAULT_VHOST={vhost}
-      - RABBITMQ_ERLANG_COOKIE={erlang_cookie}
-    command:
-      - sh
-      - -c
-      - |
-        rabbitmq-plugins disable --all &&
-        rabbitmq-plugins enable rabbitmq_management rabbitmq_prometheus &&
-        rabbitmq-server  
-    ports:
-      - "127.0.0.1:5672:5672"
-      - "127.0.0.1:15672:15672"
-      - "127.0.0.1:15692:15692"
-    networks:
-      - esnet
-    deploy:
-      resources:
-        limits:
-          memory: {memory}
-          cpus: "{cpus}"
-    volumes:
-      - rabbitmqdata:/var/lib/rabbitmq
-      - ./rabbitmq/Deployment/rabbitmq.conf:/etc/rabbitmq/rabbitmq.conf
-      - ./rabbitmq/Deployment/rabbitmq-env.conf:/etc/rabbitmq/rabbitmq-env.conf   
-    healthcheck:
-      test: ["CMD", "rabbitmqctl", "status"]
-      interval: 30s
-      timeout: 10s
-      retries: 5
-"""
-    
-    # Multi-instance cluster
-    cluster_services = ""
-    for i in range(1, instance_count + 1):
-        node_name = f"rabbitmq-{i}"
-        is_first_node = i == 1
-        
-        # Generate cluster join command for non-first nodes
-        cluster_join_cmd = ""
-        if not is_first_node:
-            cluster_join_cmd = f"""
-        # Join cluster with first node
-        sleep 30 &&
-        rabbitmqctl stop_app &&
-        rabbitmqctl reset &&
-        rabbitmqctl join_cluster rabbit@rabbitmq-1 &&
-        rabbitmqctl start_app &&"""
-        
-        service = f"""
-  {node_name}:
-    build:
-      context: ./rabbitmq/Deployment
-      dockerfile: Dockerfile.rabbitmq  
-    container_name: {node_name}
-    hostname: {node_name}
-    environment:
-      - RABBITMQ_DEFAULT_USER={user}
-      - RABBITMQ_DEFAULT_PASS={password}
-      - RABBITMQ_DEFAULT_VHOST={vhost}
-      - RABBITMQ_ERLANG_COOKIE={erlang_cookie}
-      - RABBITMQ_NODENAME=rabbit@{node_name}
-      - RABBITMQ_USE_LONGNAME=false
-    command:
-      - sh
-      - -c
-      - |
-        rabbitmq-plugins disable --all &&
-        rabbitmq-plugins enable rabbitmq_management rabbitmq_prometheus &&
-        rabbitmq-server &
-        sleep 10 &&{cluster_join_cmd}
-        wait
-    ports:
-      - "127.0.0.1:{5671 + i}:5672"
-      - "127.0.0.1:{15671 + i}:15672"
-      - "127.0.0.1:{15691 + i}:15692"
-    networks:
-      - esnet
-    deploy:
-      resources:
-        limits:
-          memory: {memory}
-          cpus: "{cpus}"
-    volumes:
-      - rabbitmqdata{i}:/var/lib/rabbitmq
-      - ./rabbitmq/Deployment/rabbitmq-cluster.conf:/etc/rabbitmq/rabbitmq.conf
-      - ./rabbitmq/Deployment/rabbitmq-env.conf:/etc/rabbitmq/rabbitmq-env.conf   
-    healthcheck:
-      test: ["CMD", "rabbitmqctl", "status"]
-      interval: 30s
-      timeout: 10s
-      retries: 5"""
-        
-        # Only add depends_on for non-first nodes
-        if not is_first_node:
-            service += f"""
-    depends_on:
-      - rabbitmq-1"""
-        
-        service += "\n"
-        cluster_services += service
-    
-    # Add RabbitMQ load balancer for management interface
-    # Generate depends_on list for all RabbitMQ instances
-    depends_on_list = ""
-    for i in range(1, instance_count + 1):
-        depends_on_list += f"      - rabbitmq-{i}\n"
-    
-    cluster_services += f"""
-  rabbitmq-loadbalancer:
-    image: haproxy:2.8-alpine
-    container_name: rabbitmq-loadbalancer
-    ports:
-      - "0.0.0.0:5675:5672"
-      - "0.0.0.0:15675:15672"
-      - "0.0.0.0:15695:15692"
-    volumes:
-      - ./rabbitmq/Deployment/haproxy.cfg:/usr/local/etc/haproxy/haproxy.cfg:ro
-    networks:
-      - esnet
-    depends_on:
-{depends_on_list.rstrip()}
-    healthcheck:
-      test: ["CMD", "haproxy", "-c", "-f", "/usr/local/etc/haproxy/haproxy.cfg"]
-      interval: 30s
-      timeout: 10s
-      retries: 3
-"""
-    
-    return cluster_services
 
-def generate_rabbitmq_volumes(instance_count):
-    """Generate RabbitMQ volumes for cluster"""
-    if instance_count == 1:
-        return "  rabbitmqdata:"
-    
-    volumes = ""
-    for i in range(1, instance_count + 1):
-        volumes += f"\n  rabbitmqdata{i}:"
-    return volumes
-
-# Define monitoring services separately
-monitoring_services = f"""
-  prometheus:
-    image: prom/prometheus:latest
-    container_name: prometheus
-    ports:
-      - "9090:9090"
-    volumes:
-      - ./prometheus/hyperion/prometheus.yml:/etc/prometheus/prometheus.yml
-    command:
-      - "--config.file=/etc/prometheus/prometheus.yml"
-    networks:
-      - esnet
-    deploy:
-      resources:
-        limits:
-          memory: {prometheus_memory}
-          cpus: "{prometheus_cpus}"
-
-  grafana:
-    image: grafana/grafana:latest
-    container_name: grafana
-    ports:
-      - "3030:3000"
-    environment:
-      - GF_SECURITY_ADMIN_USER={gf_username}
-      - GF_SECURITY_ADMIN_PASSWORD={gf_password}
-    volumes:
-      - ./grafana/provisioning/hyperion:/etc/grafana/provisioning
-      - grafana-data:/var/lib/grafana
-    networks:
-      - esnet
-    deploy:
-      resources:
-        limits:
-          memory: {grafana_memory}
-          cpus: "{grafana_cpus}"
-
-  nodeos-custom-exporter:
-    build:
-      context: ./custom-nodeos-exporter
-      dockerfile: Dockerfile
-    container_name: nodeos-custom-exporter
-    ports:
-      - "8000:8000"
-    depends_on:
-      - node
-    networks:
-      - esnet
-
-  redis-exporter:
-    image: oliver006/redis_exporter:latest
-    container_name: redis-exporter
-    environment:
-      - REDIS_ADDR=redis:6379
-    ports:
-      - "9121:9121"
-    networks:
-      - esnet
-    depends_on:
-      - redis      
-"""
-
-def generate_rabbitmq_exporters(instance_count):
-    """Generate RabbitMQ exporters for cluster monitoring"""
-    if not monitoring_enabled:
-        return ""
-    
-    if instance_count == 1:
-        return """
-  rabbitmq-exporter:
-    image: kbudde/rabbitmq-exporter:latest
-    container_name: rabbitmq-exporter
-    environment:
-      - RABBIT_URL=http://rabbitmq:15672
-      - RABBIT_USER=rabbitmquser
-      - RABBIT_PASSWORD=rabbitmqpass
-    ports:
-      - "9419:9419"
-    networks:
-      - esnet
-    depends_on:
-      - rabbitmq
-"""
-    
-    exporters = ""
-    for i in range(1, instance_count + 1):
-        exporter = f"""
-  rabbitmq-exporter-{i}:
-    image: kbudde/rabbitmq-exporter:latest
-    container_name: rabbitmq-exporter-{i}
-    environment:
-      - RABBIT_URL=http://rabbitmq-{i}:15672
-      - RABBIT_USER={rabbitmq_user}
-      - RABBIT_PASSWORD={rabbitmq_pass}
-    ports:
-      - "{9419 + i - 1}:9419"
-    networks:
-      - esnet
-    depends_on:
-      - rabbitmq-{i}
-"""
-        exporters += exporter
-    return exporters
-
-# Base fixed Docker Compose services
-base_compose = f"""
-version: '3'
-services:
-  kibana:
-    image: docker.elastic.co/kibana/kibana:{kibana_version}
-    container_name: kibana
-    environment:
-      - "ELASTICSEARCH_URL=http://es1:9200"
-      - "ELASTICSEARCH_HOSTS=http://es1:9200"
-    ports:
-      - "5601:5601"
-    depends_on:
-      - es1
-    networks:
-      - esnet
-    deploy:
-      resources:
-        limits:
-          memory: {kibana_memory}
-          cpus: "{kibana_cpus}"
-    healthcheck:
-      test: ["CMD-SHELL", "curl --silent --fail http://localhost:5601/api/status || exit 1"]
-      interval: 30s
-      timeout: 10s
-      retries: 5
-
-  redis:
-    image: "redis:latest"
-    container_name: redis
-    ports:
-      - "127.0.0.1:6379:6379"
-    networks:
-      - esnet
-    volumes:
-      - redisdata:/data
-    deploy:
-      resources:
-        limits:
-          memory: {redis_memory}
-          cpus: "{redis_cpus}"
-    command: >
-      redis-server 
-      --appendonly yes 
-      --appendfsync everysec
-      --maxmemory 6gb
-      --maxmemory-policy allkeys-lru
-      --save 900 1
-      --save 300 10
-      --tcp-keepalive 60
-      --io-threads 2
-      --io-threads-do-reads yes
-      --activedefrag yes
-      --active-defrag-threshold-lower 10
-      --active-defrag-threshold-upper 100
-      --active-defrag-cycle-min 25
-      --active-defrag-cycle-max 75
-      --lazyfree-lazy-eviction yes
-      --lazyfree-lazy-expire yes
-      --lazyfree-lazy-server-del yes
-    healthcheck:
-      test: ["CMD", "redis-cli", "ping"]
-      interval: 10s
-      timeout: 5s
-      retries: 3
-
-  hyperion:
-    container_name: hyperion
-    tty: true
-    build:
-      context: ./hyperion/Deployment
-      dockerfile: Dockerfile.hyperion
-      args:
-        - HYPERION_ENVIRONMENT={hyperion_environment}
-        - HYPERION_LAUNCH_ON_STARTUP={hyperion_launch_on_startup}
-        - HYPERION_VERSION={hyperion_version}
-        - RABBITMQ_DEFAULT_USER={rabbitmq_user}
-        - RABBITMQ_DEFAULT_PASS={rabbitmq_pass}
-    ports:
-      - "7000:7000"
-      - "1234:1234"
-    networks:
-      - esnet
-    deploy:
-      resources:
-        limits:
-          memory: {hyperion_memory}
-          cpus: "{hyperion_cpus}"
-    volumes:
-      - hyperiondata:/app/hyperiondata
-    depends_on:
-      - redis
-      - {"rabbitmq-1" if amount_of_rabbitmq_instances > 1 else "rabbitmq"}
-      - es1
-
-  node:
-    container_name: node
-    tty: true
-    build:
-      context: ./hyperion/Deployment
-      dockerfile: Dockerfile.node
-      args:
-        - HYPERION_ENVIRONMENT={hyperion_environment}
-        - HYPERION_LAUNCH_ON_STARTUP={hyperion_launch_on_startup}
-        - LEAP_FILE={leap_file}
-        - LEAP_DEB_FILE={leap_deb_file}
-    ports:
-      - "127.0.0.1:9876:9876"
-      - "127.0.0.1:8888:8888"
-    networks:
-      - esnet
-    deploy:
-      resources:
-        limits:
-          memory: {node_memory}
-          cpus: "{node_cpus}"
-    volumes:
-      - node:/app/node/data
-"""
-
-# Template for Elasticsearch nodes
-node_template = """
-  es{index}:
-    image: docker.elastic.co/elasticsearch/elasticsearch:{version}
-    container_name: es{index}
-    environment:
-      - "node.name=es{index}"
-      - "cluster.name=es-docker-cluster"
-      - "cluster.initial_master_nodes={initial_master_nodes}"
-      - "discovery.seed_hosts={seed_hosts}"
-      - "network.host=0.0.0.0"
-      - "network.publish_host=es{index}"
-      - "transport.host=0.0.0.0"
-      - "node.roles=[master, data, ingest, remote_cluster_client]"
-      - "ES_JAVA_OPTS=-Xms{min_mem} -Xmx{max_mem} {es_java_opts}"
-      - "ES_HEAP_DUMP_PATH={es_heap_dump_path}"
-      - "ES_GC_LOG_PATH={es_gc_log_path}"
-      - "bootstrap.memory_lock=true"
-      - "xpack.security.enabled=false"
-      - "xpack.monitoring.collection.enabled=true"
-    ports:
-      - "127.0.0.1:{http_port}:9200"
-      - "127.0.0.1:{transport_port}:9300"
-    ulimits:
-      memlock:
-        soft: -1
-        hard: -1
-      nofile:
-        soft: 65535
-        hard: 65535
-    volumes:
-      - esdata{index}:/usr/share/elasticsearch/data
-      - ./elasticsearch/config/es{index}/elasticsearch.yml:/usr/share/elasticsearch/config/elasticsearch.yml
-    networks:
-      - esnet
-    healthcheck:
-      test: ["CMD-SHELL", "curl -s http://localhost:9200/_cluster/health | grep -vq \\\"status\\\":\\\"red\\\""]
-      interval: 30s
-      timeout: 30s
-      retries: 5
-      start_period: 60s
-"""
-
-# Base for volumes and networks
-volumes_and_networks = f"""
-volumes:
-  grafana-data:
-  redisdata:
-{generate_rabbitmq_volumes(amount_of_rabbitmq_instances)}
-  hyperiondata:
-  node:
-  certbot-etc:
-  certbot-var:
-  certbot-www:
-{{volumes}}
-
-networks:
-  esnet:
-"""
+# Compose builder: every function below returns plain dicts, in the order
+# they should appear in the generated file.
+
+def resource_limits(memory, cpus):
+    return {"resources": {"limits": {"memory": memory, "cpus": str(cpus)}}}
+
+def base_services(config):
+    redis_args = [
+        "--appendonly yes", "--appendfsync everysec",
+        "--maxmemory 6gb", "--maxmemory-policy allkeys-lru",
+        "--save 900 1", "--save 300 10",
+        "--tcp-keepalive 60",
+        "--io-threads 2", "--io-threads-do-reads yes",
+        "--activedefrag yes",
+        "--active-defrag-threshold-lower 10", "--active-defrag-threshold-upper 100",
+        "--active-defrag-cycle-min 25", "--active-defrag-cycle-max 75",
+        "--lazyfree-lazy-eviction yes", "--lazyfree-lazy-expire yes", "--lazyfree-lazy-server-del yes",
+    ]
+    nodes = elasticsearch_nodes(config)
+    clients = [f"http://{node.name}:9200" for node in client_nodes(nodes)]
+    entry = client_nodes(nodes)[0].name
+    return {
+        "kibana": {
+            "image": f"docker.elastic.co/kibana/kibana:{config.kibana_version}",
+            "container_name": "kibana",
+            "environment": [
+                f"ELASTICSEARCH_URL={clients[0]}",
+                "ELASTICSEARCH_HOSTS=" + (clients[0] if len(clients) == 1 else "[" + ",".join(f'"{url}"' for url in clients) + "]"),
+            ],
+            "ports": ["5601:5601"],
+            "depends_on": [entry],
+            "networks": ["esnet"],
+            "deploy": resource_limits(config.kibana_memory, config.kibana_cpus),
+            "healthcheck": {
+                "test": ["CMD-SHELL", "curl --silent --fail http://localhost:5601/api/status || exit 1"],
+                "interval": "30s",
+                "timeout": "10s",
+                "retries": 5,
+            },
+        },
+        "redis": {
+            "image": "redis:latest",
+            "container_name": "redis",
+            "ports": ["127.0.0.1:6379:6379"],
+            "networks": ["esnet"],
+            "volumes": ["redisdata:/data"],
+            "deploy": resource_limits(config.redis_memory, config.redis_cpus),
+            "command": " ".join(["redis-server"] + redis_args),
+            "healthcheck": {
+                "test": ["CMD", "redis-cli", "ping"],
+                "interval": "10s",
+                "timeout": "5s",
+                "retries": 3,
+            },
+        },
+        "hyperion": {
+            "container_name": "hyperion",
+            "tty": True,
+            "build": {
+                "context": "./hyperion/Deployment",
+                "dockerfile": "Dockerfile.hyperion",
+                "args": [
+                    f"HYPERION_ENVIRONMENT={config.hyperion_environment}",
+                    f"HYPERION_LAUNCH_ON_STARTUP={config.hyperion_launch_on_startup}",
+                    f"HYPERION_VERSION={config.hyperion_version}",
+                    f"RABBITMQ_DEFAULT_USER={config.rabbitmq_user}",
+                    f"RABBITMQ_DEFAULT_PASS={config.rabbitmq_pass}",
+                    # API queries go to the client tier, bulk indexing straight to the data nodes
+                    f"ES_HOST={entry}:9200",
+                    "ES_INGEST_NODES=" + ",".join(f"{node.name}:9200" for node in data_nodes(nodes)),
+                ],
+            },
+            # Endpoints the readiness gate waits for before launching the indexer
+            "environment": [
+                f"READY_TIMEOUT={config.hyperion_ready_timeout}",
+                "READY_ES_NODES=" + ",".join(f"{node.name}:9200" for node in nodes),
+                f"READY_RABBITMQ_API={config.rabbitmq_nodes[0]}:15672",
+                f"READY_RABBITMQ_NODES={config.amount_of_rabbitmq_instances}",
+                f"RABBITMQ_DEFAULT_USER={config.rabbitmq_user}",
+                f"RABBITMQ_DEFAULT_PASS={config.rabbitmq_pass}",
+                "READY_REDIS=redis:6379",
+                "READY_NODEOS_URL=http://node:8888",
+                "READY_SHIP=node:9876",
+                f"READY_NODEOS_MAX_LAG={config.hyperion_ready_nodeos_max_lag}",
+            ],
+            "ports": ["7000:7000", "1234:1234"],
+            "networks": ["esnet"],
+            "deploy": resource_limits(config.hyperion_memory, config.hyperion_cpus),
+            "volumes": ["hyperiondata:/app/hyperiondata"],
+            "depends_on": ["redis", "node"] + config.rabbitmq_nodes + [node.name for node in nodes],
+        },
+        "node": {
+            "container_name": "node",
+            "tty": True,
+            "build": {
+                "context": "./hyperion/Deployment",
+                "dockerfile": "Dockerfile.node",
+                "args": [
+                    f"HYPERION_ENVIRONMENT={config.hyperion_environment}",
+                    f"HYPERION_LAUNCH_ON_STARTUP={config.hyperion_launch_on_startup}",
+                    f"LEAP_FILE={config.leap_file}",
+                    f"LEAP_DEB_FILE={config.leap_deb_file}",
+                ],
+            },
+            "ports": ["127.0.0.1:9876:9876", "127.0.0.1:8888:8888"],
+            "networks": ["esnet"],
+            "deploy": resource_limits(config.node_memory, config.node_cpus),
+            "volumes": ["node:/app/node/data"],
+        },
+    }
 
-# Generate Elasticsearch services
-services = ""
-initial_master_nodes = ",".join([f"es{i}" for i in range(1, amount_of_nodes + 1)])
-seed_hosts = initial_master_nodes
-
-for i in range(1, amount_of_nodes + 1):
-    node_config = node_template.format(
-        index=i,
-        version=elasticsearch_version,
-        initial_master_nodes=initial_master_nodes if amount_of_nodes > 1 else "es1",
-        seed_hosts=seed_hosts if amount_of_nodes > 1 else "es1",
-        min_mem=elastic_min_mem,
-        max_mem=elastic_max_mem,
-        es_java_opts=es_java_opts,
-        es_heap_dump_path=es_heap_dump_path,
-        es_gc_log_path=es_gc_log_path,
-        http_port=9200 + i - 1,
-        transport_port=9300 + i - 1
-    )
-    services += node_config
-
-# Generate volumes for Elasticsearch
-volumes = "\n".join([f"  esdata{i}:" for i in range(1, amount_of_nodes + 1)])
-
-# Define certbot service separately
-certbot_service = f"""
-  certbot:
-    container_name: certbot
-    build:
-      context: ./certbot
-      dockerfile: Dockerfile.certbot
-    volumes:
-      - certbot-etc:/etc/letsencrypt
-      - certbot-var:/var/lib/letsencrypt
-      - ./haproxy/certs:/etc/haproxy/certs
-      - certbot-www:/var/www/certbot
-      - /var/run/docker.sock:/var/run/docker.sock:ro
-    networks:
-      - esnet
-    environment:
-      - CERTBOT_EMAIL={certbot_email}
-      - CERTBOT_STAGING={str(certbot_staging).lower()}
-      - PRODUCTION_ALIAS_KIBANA={production_alias_kibana}
-      - PRODUCTION_ALIAS_GRAFANA={production_alias_grafana}
-      - PRODUCTION_ALIAS_HYPERION={production_alias_hyperion}
-      - REQUEST_KIBANA_CERT={str(request_kibana_cert).lower()}
-      - REQUEST_GRAFANA_CERT={str(request_grafana_cert).lower()}
-      - REQUEST_HYPERION_CERT={str(request_hyperion_cert).lower()}
-      - FORCE_RENEWAL=true
-    depends_on:
-      - haproxy
-"""
+def rabbitmq_services(config):
+    """RabbitMQ broker(s), plus the HAProxy load balancer when clustered."""
+    plugins = [
+        "rabbitmq-plugins disable --all &&",
+        f"rabbitmq-plugins enable {' '.join(config.rabbitmq_plugins)} &&",
+    ]
+    environment = [
+        f"RABBITMQ_DEFAULT_USER={config.rabbitmq_user}",
+        f"RABBITMQ_DEFAULT_PASS={config.rabbitmq_pass}",
+        f"RABBITMQ_DEFAULT_VHOST={config.rabbitmq_vhost}",
+        f"RABBITMQ_ERLANG_COOKIE={config.rabbitmq_erlang_cookie}",
+    ]
+    definitions = []
+    if config.rabbitmq_definitions_enabled:
+        definitions = [
+            "./rabbitmq/Deployment/definitions.conf:/etc/rabbitmq/conf.d/20-definitions.conf:ro",
+            "./rabbitmq/Deployment/definitions.json:/etc/rabbitmq/definitions.json:ro",
+        ]
+    healthcheck = {
+        "test": ["CMD", "rabbitmqctl", "status"],
+        "interval": "30s",
+        "timeout": "10s",
+        "retries": 5,
+    }
 
-# Update haproxy service with certbot integration
-haproxy_service = f"""
-  haproxy:
-    image: haproxy:2.8-alpine
-    container_name: haproxy
-    ports:
-      - "{haproxy_http_port}:80"
-      - "{haproxy_https_port}:443"
-    volumes:
-      - ./haproxy/haproxy.cfg:/usr/local/etc/haproxy/haproxy.cfg:ro
-      - ./haproxy/certs:/etc/haproxy/certs:ro
-      - certbot-www:/var/www/certbot:ro
-    depends_on:
-      - hyperion
-      - kibana
-      - grafana
-    networks:
-      - esnet
-    deploy:
-      resources:
-        limits:
-          memory: {haproxy_memory}
-          cpus: "{haproxy_cpus}"
-    healthcheck:
-      test: ["CMD", "haproxy", "-c", "-f", "/usr/local/etc/haproxy/haproxy.cfg"]
-      interval: 30s
-      timeout: 10s
-      retries: 3
-"""
+    if not config.rabbitmq_clustered:
+        return {
+            "rabbitmq": {
+                "build": {"context": "./rabbitmq/Deployment", "dockerfile": "Dockerfile.rabbitmq"},
+                "container_name": "rabbitmq",
+                "environment": environment,
+                "command": ["sh", "-c", "\n".join(plugins + ["rabbitmq-server"]) + "\n"],
+                "ports": ["127.0.0.1:5672:5672", "127.0.0.1:15672:15672", "127.0.0.1:15692:15692"],
+                "networks": ["esnet"],
+                "deploy": resource_limits(config.rabbitmq_memory, config.rabbitmq_cpus),
+                "volumes": [
+                    "rabbitmqdata:/var/lib/rabbitmq",
+                    "./rabbitmq/Deployment/rabbitmq.conf:/etc/rabbitmq/rabbitmq.conf",
+                    "./rabbitmq/Deployment/rabbitmq-env.conf:/etc/rabbitmq/rabbitmq-env.conf",
+                ] + definitions,
+                "healthcheck": healthcheck,
+            }
+        }
 
-# Combine everything
-all_services = base_compose + generate_rabbitmq_cluster_services(amount_of_rabbitmq_instances, rabbitmq_cluster_name, rabbitmq_erlang_cookie, rabbitmq_user, rabbitmq_pass, rabbitmq_vhost, rabbitmq_memory, rabbitmq_cpus) + services
-if monitoring_enabled:
-    all_services += monitoring_services + generate_es_exporters(amount_of_nodes) + generate_rabbitmq_exporters(amount_of_rabbitmq_instances)
-if proxy_enabled:
-    all_services += haproxy_service
-    if certbot_enabled:
-        all_services += certbot_service
+    services = {}
+    for i, node_name in enumerate(config.rabbitmq_nodes, start=1):
+        script = plugins + ["rabbitmq-server &", "sleep 10 &&"]
+        if i > 1:
+            script += [
+                "# Join cluster with first node",
+                "sleep 30 &&",
+                "rabbitmqctl stop_app &&",
+                "rabbitmqctl reset &&",
+                "rabbitmqctl join_cluster rabbit@rabbitmq-1 &&",
+                "rabbitmqctl start_app &&",
+            ]
+        script.append("wait")
+
+        service = {
+            "build": {"context": "./rabbitmq/Deployment", "dockerfile": "Dockerfile.rabbitmq"},
+            "container_name": node_name,
+            "hostname": node_name,
+            "environment": environment + [
+                f"RABBITMQ_NODENAME=rabbit@{node_name}",
+                "RABBITMQ_USE_LONGNAME=false",
+            ],
+            "command": ["sh", "-c", "\n".join(script) + "\n"],
+            "ports": [
+                f"127.0.0.1:{5671 + i}:5672",
+                f"127.0.0.1:{15671 + i}:15672",
+                f"127.0.0.1:{15691 + i}:15692",
+            ],
+            "networks": ["esnet"],
+            "deploy": resource_limits(config.rabbitmq_memory, config.rabbitmq_cpus),
+            "volumes": [
+                f"rabbitmqdata{i}:/var/lib/rabbitmq",
+                "./rabbitmq/Deployment/rabbitmq-cluster.conf:/etc/rabbitmq/rabbitmq.conf",
+                "./rabbitmq/Deployment/rabbitmq-env.conf:/etc/rabbitmq/rabbitmq-env.conf",
+            ] + definitions,
+            "healthcheck": healthcheck,
+        }
+        if i > 1:
+            service["depends_on"] = ["rabbitmq-1"]
+        services[node_name] = service
+
+    services["rabbitmq-loadbalancer"] = {
+        "image": "haproxy:2.8-alpine",
+        "container_name": "rabbitmq-loadbalancer",
+        "ports": ["0.0.0.0:5675:5672", "0.0.0.0:15675:15672", "0.0.0.0:15695:15692"] + [
+            f"0.0.0.0:{5680 + i}:{5680 + i}" for i in range(1, len(config.rabbitmq_nodes) + 1) if config.rabbitmq_sharded
+        ],
+        "volumes": ["./rabbitmq/Deployment/haproxy.cfg:/usr/local/etc/haproxy/haproxy.cfg:ro"],
+        "networks": ["esnet"],
+        "depends_on": list(config.rabbitmq_nodes),
+        "healthcheck": {
+            "test": ["CMD", "haproxy", "-c", "-f", "/usr/local/etc/haproxy/haproxy.cfg"],
+            "interval": "30s",
+            "timeout": "10s",
+            "retries": 3,
+        },
+    }
+    return services
+
+def elasticsearch_services(config, plans=None):
+    nodes = elasticsearch_nodes(config)
+    masters = ",".join(node.name for node in master_eligible_nodes(nodes))
+    services = {}
+    for i, node in enumerate(nodes, start=1):
+        name = node.name
+        plan = (plans or {}).get(node.tier)
+        min_mem, max_mem = (plan.java_heap, plan.java_heap) if plan else (config.elastic_min_mem, config.elastic_max_mem)
+        services[name] = {
+            "image": f"docker.elastic.co/elasticsearch/elasticsearch:{config.elasticsearch_version}",
+            "container_name": name,
+            "environment": [
+                f"node.name={name}",
+                "cluster.name=es-docker-cluster",
+                f"cluster.initial_master_nodes={masters}",
+                f"discovery.seed_hosts={masters}",
+                "network.host=0.0.0.0",
+                f"network.publish_host={name}",
+                "transport.host=0.0.0.0",
+                f"node.roles={node.roles}",
+                f"ES_JAVA_OPTS=-Xms{min_mem} -Xmx{max_mem} {config.es_java_opts}",
+                f"ES_HEAP_DUMP_PATH={config.es_heap_dump_path}",
+                f"ES_GC_LOG_PATH={config.es_gc_log_path}",
+                "bootstrap.memory_lock=true",
+                "xpack.security.enabled=false",
+                "xpack.monitoring.collection.enabled=true",
+            ] + ([f"path.repo={ES_SNAPSHOT_LOCATION}"] if config.es_snapshots else []),
+            "ports": [f"127.0.0.1:{9200 + i - 1}:9200", f"127.0.0.1:{9300 + i - 1}:9300"],
+            "ulimits": {
+                "memlock": {"soft": -1, "hard": -1},
+                "nofile": {"soft": 65535, "hard": 65535},
+            },
+            "volumes": [
+                f"{node.volume}:/usr/share/elasticsearch/data",
+                f"./elasticsearch/config/{name}/elasticsearch.yml:/usr/share/elasticsearch/config/elasticsearch.yml",
+            ] + ([f"{config.es_snapshot_volume}:{ES_SNAPSHOT_LOCATION}"] if config.es_snapshots else [])
+              + ([f"{name}-logs:{ES_LOG_DIR}"] if config.monitoring_enabled and config.es_gc_exporter else []),
+            "networks": ["esnet"],
+            "healthcheck": {
+                "test": ["CMD-SHELL", 'curl -s http://localhost:9200/_cluster/health | grep -vq "status":"red"'],
+                "interval": "30s",
+                "timeout": "30s",
+                "retries": 5,
+                "start_period": "60s",
+            },
+        }
+        if plan:
+            services[name]["deploy"] = resource_limits(plan.memory_limit, plan.cpu_limit)
+        if config.es_snapshots:
+            # The repository mount must be chowned before Elasticsearch starts
+            services[name]["depends_on"] = {"es-snapshots-init": {"condition": "service_completed_successfully"}}
+    return services
+
+def elasticsearch_manager_services(config):
+    """
+    es-manager installs the hot/warm ILM policy and moves sealed Hyperion
+    partitions to the warm tier, installs the planned shard layout and the
+    snapshot schedule, and holds the indices in the backfill profile until
+    the indexer catches up with nodeos.
+    """
+    entry = client_nodes(elasticsearch_nodes(config))[0].name
+    environment = [f"ES_URL=http://{entry}:9200"]
+    depends_on = [entry]
+    serving_replicas = config.es_serving_replicas
+    if config.es_shard_layout == "auto":
+        layouts = plan_index_layout(config)
+        environment.append("INDEX_LAYOUT=" + ",".join(f"{layout.pattern}={layout.shards}/{layout.replicas}"
+                                                      for layout in layouts))
+        serving_replicas = layouts[0].replicas
+    if config.es_lifecycle_enabled:
+        environment += [
+            "LIFECYCLE_ENABLED=true",
+            f"LIFECYCLE_INDICES={config.es_lifecycle_indices}",
+            f"WARM_MIN_AGE={config.es_warm_min_age}",
+            f"WARM_REPLICAS={config.es_warm_replicas}",
+            f"WARM_SHRINK_SHARDS={config.es_warm_shrink_shards}",
+        ]
+    if config.es_backfill:
+        environment += [
+            "BACKFILL_ENABLED=true",
+            "NODEOS_URL=http://node:8888",
+            f"BACKFILL_INDICES={config.es_backfill_indices}",
+            f"BACKFILL_PROGRESS_INDEX={config.es_backfill_progress_index}",
+            f"BACKFILL_CATCHUP_BLOCKS={config.es_backfill_catchup_blocks}",
+            f"SERVING_REFRESH_INTERVAL={config.es_serving_refresh_interval}",
+            f"SERVING_REPLICAS={serving_replicas}",
+        ]
+        depends_on.append("node")
+    if config.es_snapshots:
+        environment += [
+            "SNAPSHOT_ENABLED=true",
+            f"SNAPSHOT_LOCATION={ES_SNAPSHOT_LOCATION}",
+            f"SNAPSHOT_SCHEDULE={config.es_snapshot_schedule}",
+            f"SNAPSHOT_INDICES={config.es_snapshot_indices}",
+            f"SNAPSHOT_RETENTION={config.es_snapshot_retention}",
+            f"RESTORE_PARALLELISM={config.es_restore_parallelism}",
+            f"RESTORE_TIMEOUT={config.es_restore_timeout}",
+            f"RESTORE_STALL_TIMEOUT={config.es_restore_stall_timeout}",
+        ]
+    services = {
+        "es-manager": {
+            "build": {"context": "./es-manager", "dockerfile": "Dockerfile"},
+            "container_name": "es-manager",
+            "environment": environment,
+            "depends_on": depends_on,
+            "networks": ["esnet"],
+            "restart": "unless-stopped",
+        },
+    }
+    if config.es_snapshots:
+        # A fresh mount point is owned by root; Elasticsearch runs as uid 1000
+        services["es-snapshots-init"] = {
+            "image": "busybox:latest",
+            "container_name": "es-snapshots-init",
+            "command": ["sh", "-c", f"chown 1000:0 {ES_SNAPSHOT_LOCATION} && chmod 2775 {ES_SNAPSHOT_LOCATION}"],
+            "volumes": [f"{config.es_snapshot_volume}:{ES_SNAPSHOT_LOCATION}"],
+        }
+    return services
+
+def backpressure_services(config):
+    """
+    hyperion-backpressure pauses the reader and deserializers by raising
+    the RabbitMQ memory alarm while pipeline queues are deep or
+    Elasticsearch rejects bulk writes, so the indexers can drain the queues
+    before they page to disk.
+    """
+    scaling = chain_config(config).get("scaling", {})
+    chain = chain_settings(config).get("chain", "wax")
+    # Below Hyperion's own reader pause at max_queue_limit
+    pause_depth = config.hyperion_backpressure_pause_depth or scaling.get("max_queue_limit", 100000) // 2
+    resume_depth = config.hyperion_backpressure_resume_depth or scaling.get("resume_trigger", 5000)
+    plan = plan_rabbitmq(config.rabbitmq_memory, config.rabbitmq_cpus)
+    return {
+        "hyperion-backpressure": {
+            "build": {"context": "./hyperion-backpressure", "dockerfile": "Dockerfile"},
+            "container_name": "hyperion-backpressure",
+            "environment": [
+                "PROMETHEUS_URL=http://prometheus:9090",
+                f"RABBITMQ_CONTAINERS={','.join(config.rabbitmq_nodes)}",
+                f"RABBITMQ_WATERMARK={plan.watermark}",
+                f"RABBITMQ_VHOST={config.rabbitmq_vhost}",
+                f"QUEUE_PATTERN={chain}:.*",
+                # Per-queue depth from the kbudde exporters or the brokers' /metrics/detailed
+                "DEPTH_METRIC=" + ("rabbitmq_detailed_queue_messages" if config.rabbitmq_exporter_mode == "native"
+                                   else "rabbitmq_queue_messages"),
+                f"PAUSE_DEPTH={pause_depth}",
+                f"RESUME_DEPTH={resume_depth}",
+                f"MAX_REJECTION_RATE={config.hyperion_backpressure_max_rejections}",
+            ],
+            "volumes": ["/var/run/docker.sock:/var/run/docker.sock:ro"],
+            "depends_on": ["prometheus"] + config.rabbitmq_nodes,
+            "networks": ["esnet"],
+            "restart": "unless-stopped",
+        },
+    }
 
-# Combine services with volumes and networks
-volumes_section = volumes_and_networks.format(volumes=volumes)
+def monitoring_services(config):
+    return {
+        "prometheus": {
+            "image": "prom/prometheus:latest",
+            "container_name": "prometheus",
+            "ports": ["9090:9090"],
+            "volumes": ["./prometheus/hyperion/prometheus.yml:/etc/prometheus/prometheus.yml"],
+            "command": ["--config.file=/etc/prometheus/prometheus.yml"],
+            "networks": ["esnet"],
+            "deploy": resource_limits(config.prometheus_memory, config.prometheus_cpus),
+        },
+        "grafana": {
+            "image": "grafana/grafana:latest",
+            "container_name": "grafana",
+            "ports": ["3030:3000"],
+            "environment": [
+                f"GF_SECURITY_ADMIN_USER={config.gf_username}",
+                f"GF_SECURITY_ADMIN_PASSWORD={config.gf_password}",
+            ],
+            "volumes": [
+                "./grafana/provisioning/hyperion:/etc/grafana/provisioning",
+                "grafana-data:/var/lib/grafana",
+            ],
+            "networks": ["esnet"],
+            "deploy": resource_limits(config.grafana_memory, config.grafana_cpus),
+        },
+        "nodeos-custom-exporter": {
+            "build": {"context": "./custom-nodeos-exporter", "dockerfile": "Dockerfile"},
+            "container_name": "nodeos-custom-exporter",
+            "environment": [
+                f"EXPORTER_MODE={config.nodeos_exporter_mode}",
+                f"NODEOS_ENDPOINTS={config.nodeos_exporter_endpoints}",
+                f"NODEOS_SHIP_URL={config.nodeos_exporter_ship_urls}",
+                f"NODEOS_PROBES={config.nodeos_exporter_probes}",
+            ],
+            "ports": ["8000:8000"],
+            "depends_on": ["node"],
+            "networks": ["esnet"],
+        },
+        "redis-exporter": {
+            "image": "oliver006/redis_exporter:latest",
+            "container_name": "redis-exporter",
+            "environment": ["REDIS_ADDR=redis:6379"],
+            "ports": ["9121:9121"],
+            "networks": ["esnet"],
+            "depends_on": ["redis"],
+        },
+    }
 
-final_compose = all_services + volumes_section
+def elasticsearch_exporter_services(config):
+    if config.es_exporter_mode == "cluster":
+        return elasticsearch_cluster_exporter_services(config)
+    services = {}
+    for i, node in enumerate(elasticsearch_nodes(config), start=1):
+        service = {
+            "image": "quay.io/prometheuscommunity/elasticsearch-exporter:latest",
+            "container_name": f"elasticsearch-exporter-{i}",
+            "command": [f"--es.uri=http://{node.name}:9200"],
+            "ports": [f"{9114 + i - 1}:9114"],
+            "depends_on": [node.name],
+            "networks": ["esnet"],
+        }
+        # Tiered layouts have too many exporters for the 9114+ host port
+        # range; Prometheus scrapes them over esnet
+        if node.tier != "mixed":
+            del service["ports"]
+        services[f"elasticsearch-exporter-{i}"] = service
+    return services
+
+def elasticsearch_cluster_exporter_services(config):
+    """
+    One exporter for the whole cluster: --es.all reads every node's stats
+    through a single _nodes/stats call on the client tier, instead of one
+    exporter container polling each node. Per-index and per-shard stats
+    come from a second exporter, so the slow job is the only one paying
+    for the _stats and _cat/shards calls.
+    """
+    entry = client_nodes(elasticsearch_nodes(config))[0].name
+    services = {
+        "elasticsearch-exporter": {
+            "image": "quay.io/prometheuscommunity/elasticsearch-exporter:latest",
+            "container_name": "elasticsearch-exporter",
+            "command": [f"--es.uri=http://{entry}:9200", "--es.all", "--es.cluster_settings", "--es.timeout=10s"],
+            "ports": ["9114:9114"],
+            "depends_on": [entry],
+            "networks": ["esnet"],
+        }
+    }
+    if config.es_exporter_indices:
+        services["elasticsearch-exporter-indices"] = {
+            "image": "quay.io/prometheuscommunity/elasticsearch-exporter:latest",
+            "container_name": "elasticsearch-exporter-indices",
+            "command": [f"--es.uri=http://{entry}:9200", "--es.indices", "--es.shards", "--es.timeout=30s"],
+            "depends_on": [entry],
+            "networks": ["esnet"],
+        }
+    return services
+
+def elasticsearch_gc_exporter_services(config):
+    """A sidecar per ES node tailing its gc.log from the shared logs volume."""
+    services = {}
+    for node in elasticsearch_nodes(config):
+        name = f"{node.name}-gc-exporter"
+        services[name] = {
+            "build": {"context": "./es-gc-exporter", "dockerfile": "Dockerfile"},
+            "container_name": name,
+            "environment": [f"NODE_NAME={node.name}", "GC_LOG=/logs/gc.log"],
+            "volumes": [f"{node.name}-logs:/logs:ro"],
+            "depends_on": [node.name],
+            "networks": ["esnet"],
+        }
+    return services
+
+def rabbitmq_exporter_services(config):
+    services = {}
+    for i, node in enumerate(config.rabbitmq_nodes, start=1):
+        name = f"rabbitmq-exporter-{i}" if config.rabbitmq_clustered else "rabbitmq-exporter"
+        services[name] = {
+            "image": "kbudde/rabbitmq-exporter:latest",
+            "container_name": name,
+            "environment": [
+                f"RABBIT_URL=http://{node}:15672",
+                f"RABBIT_USER={config.rabbitmq_user}",
+                f"RABBIT_PASSWORD={config.rabbitmq_pass}",
+            ],
+            "ports": [f"{9419 + i - 1}:9419"],
+            "networks": ["esnet"],
+            "depends_on": [node],
+        }
+    return services
+
+def proxy_services(config):
+    services = {
+        "haproxy": {
+            "image": "haproxy:2.8-alpine",
+            "container_name": "haproxy",
+            "ports": [f"{config.haproxy_http_port}:80", f"{config.haproxy_https_port}:443"],
+            "volumes": [
+                "./haproxy/haproxy.cfg:/usr/local/etc/haproxy/haproxy.cfg:ro",
+                "./haproxy/certs:/etc/haproxy/certs:ro",
+                "certbot-www:/var/www/certbot:ro",
+            ],
+            "depends_on": ["hyperion", "kibana", "grafana"],
+            "networks": ["esnet"],
+            "deploy": resource_limits(config.haproxy_memory, config.haproxy_cpus),
+            "healthcheck": {
+                "test": ["CMD", "haproxy", "-c", "-f", "/usr/local/etc/haproxy/haproxy.cfg"],
+                "interval": "30s",
+                "timeout": "10s",
+                "retries": 3,
+            },
+        }
+    }
+    if config.certbot_enabled:
+        services["certbot"] = {
+            "container_name": "certbot",
+            "build": {"context": "./certbot", "dockerfile": "Dockerfile.certbot"},
+            "volumes": [
+                "certbot-etc:/etc/letsencrypt",
+                "certbot-var:/var/lib/letsencrypt",
+                "./haproxy/certs:/etc/haproxy/certs",
+                "certbot-www:/var/www/certbot",
+                "/var/run/docker.sock:/var/run/docker.sock:ro",
+            ],
+            "networks": ["esnet"],
+            "environment": [
+                f"CERTBOT_EMAIL={config.certbot_email}",
+                f"CERTBOT_STAGING={str(config.certbot_staging).lower()}",
+                f"PRODUCTION_ALIAS_KIBANA={config.production_alias_kibana}",
+                f"PRODUCTION_ALIAS_GRAFANA={config.production_alias_grafana}",
+                f"PRODUCTION_ALIAS_HYPERION={config.production_alias_hyperion}",
+                f"REQUEST_KIBANA_CERT={str(config.request_kibana_cert).lower()}",
+                f"REQUEST_GRAFANA_CERT={str(config.request_grafana_cert).lower()}",
+                f"REQUEST_HYPERION_CERT={str(config.request_hyperion_cert).lower()}",
+                "FORCE_RENEWAL=true",
+            ],
+            "depends_on": ["haproxy"],
+        }
+    return services
+
+def build_services(config, plans=None):
+    services = {}
+    services.update(base_services(config))
+    services.update(rabbitmq_services(config))
+    services.update(elasticsearch_services(config, plans))
+    if config.es_manager_enabled:
+        services.update(elasticsearch_manager_services(config))
+    if config.monitoring_enabled:
+        services.update(monitoring_services(config))
+        services.update(elasticsearch_exporter_services(config))
+        if config.es_gc_exporter:
+            services.update(elasticsearch_gc_exporter_services(config))
+        if config.rabbitmq_exporter_mode == "exporter":
+            services.update(rabbitmq_exporter_services(config))
+        if config.hyperion_backpressure:
+            services.update(backpressure_services(config))
+    if config.proxy_enabled:
+        services.update(proxy_services(config))
+    return services
+
+def build_volumes(config):
+    names = ["grafana-data", "redisdata"]
+    if config.rabbitmq_clustered:
+        names += [f"rabbitmqdata{i}" for i in range(1, config.amount_of_rabbitmq_instances + 1)]
+    else:
+        names.append("rabbitmqdata")
+    names += ["hyperiondata", "node", "certbot-etc", "certbot-var", "certbot-www"]
+    names += [node.volume for node in elasticsearch_nodes(config) if not node.volume.startswith((".", "/"))]
+    if config.es_snapshots and not config.es_snapshot_path:
+        names.append(config.es_snapshot_volume)
+    if config.monitoring_enabled and config.es_gc_exporter:
+        names += [f"{node.name}-logs" for node in elasticsearch_nodes(config)]
+    return {name: None for name in names}
+
+def build_compose(config, plans=None):
+    """Return the complete compose document as a dict."""
+    return {
+        "version": "3",
+        "services": build_services(config, plans),
+        "volumes": build_volumes(config),
+        "networks": {"esnet": None},
+    }
 
-# Write to docker-compose.yml
-with open("docker-compose-generated-hyperion.yml", "w") as f:
-    f.write(final_compose)
+def host_port(mapping):
+    """Split a "[ip:]host:container" port mapping into (ip, host port)."""
+    parts = str(mapping).split(":")
+    if len(parts) == 3:
+        return parts[0], parts[1]
+    if len(parts) == 2:
+        return "0.0.0.0", parts[0]
+    return None
+
+def validate_compose(compose):
+    """
+    Check cross-references in a compose document. Returns a list of
+    problems; an empty list means the document is consistent.
+    """
+    problems = []
+    services = compose.get("services") or {}
+    volumes = compose.get("volumes") or {}
+    networks = compose.get("networks") or {}
+    container_names = {}
+    bound_ports = {}
+
+    for name, service in services.items():
+        for dependency in service.get("depends_on", []):
+            if dependency not in services:
+                problems.append(f"{name}: depends_on unknown service {dependency}")
+
+        for network in service.get("networks", []):
+            if network not in networks:
+                problems.append(f"{name}: network {network} is not declared")
+
+        for volume in service.get("volumes", []):
+            source = volume.split(":", 1)[0]
+            if not source.startswith((".", "/")) and source not in volumes:
+                problems.append(f"{name}: named volume {source} is not declared")
+
+        container_name = service.get("container_name")
+        if container_name in container_names:
+            problems.append(f"{name}: container_name {container_name} already used by {container_names[container_name]}")
+        container_names[container_name] = name
+
+        for mapping in service.get("ports", []):
+            binding = host_port(mapping)
+            if binding is None:
+                continue
+            ip, port = binding
+            for (other_ip, other_port), other in bound_ports.items():
+                # A wildcard bind conflicts with every address on the same port
+                if port == other_port and (ip == other_ip or "0.0.0.0" in (ip, other_ip)):
+                    problems.append(f"{name}: host port {ip}:{port} conflicts with {other} ({other_ip}:{other_port})")
+            bound_ports[(ip, port)] = name
+
+    return problems
+
+class ComposeDumper(yaml.SafeDumper):
+    """SafeDumper that indents block sequences the way compose files usually are."""
+
+    def increase_indent(self, flow=False, indentless=False):
+        return super().increase_indent(flow, False)
+
+    def ignore_aliases(self, data):
+        return True
+
+def represent_str(dumper, data):
+    # Multi-line shell scripts read better as literal blocks
+    style = "|" if "\n" in data else None
+    return dumper.represent_scalar("tag:yaml.org,2002:str", data, style=style)
+
+def represent_none(dumper, data):
+    return dumper.represent_scalar("tag:yaml.org,2002:null", "")
+
+ComposeDumper.add_representer(str, represent_str)
+ComposeDumper.add_representer(type(None), represent_none)
+
+def to_yaml(data):
+    return yaml.dump(data, Dumper=ComposeDumper, sort_keys=False, default_flow_style=False, width=4096)
+
+def dump_compose(compose):
+    """Serialize a compose document with a blank line between services and sections."""
+    sections = []
+    for key, value in compose.items():
+        if key == "services":
+            services = [textwrap.indent(to_yaml({name: service}), "  ") for name, service in value.items()]
+            sections.append("services:\n" + "\n".join(services))
+        else:
+            sections.append(to_yaml({key: value}))
+    return f"# Generated by generate_hyperion_compose.py from .env - edit .env and regenerate instead.\n" + "\n".join(sections)
+
+def service_references(service):
+    """Names of the services a compose service points at through depends_on or links."""
+    # depends_on is either a list or a mapping of service name to condition
+    references = set(service.get("depends_on") or [])
+    references.update(link.split(":", 1)[0] for link in service.get("links") or [])
+    return references
+
+def merge_services(existing, compose, patterns):
+    """
+    Regenerate only the services matching `patterns` (fnmatch globs) in an
+    existing compose document. Services that match but are no longer part
+    of the generated topology are removed. Kept services that depend on a
+    replaced or removed service are regenerated too, since a topology
+    change (e.g. one broker to three) renames what they point at;
+    everything else is kept as is. Returns the merged document and the
+    names of the services touched.
+    """
+    generated = compose["services"]
+    current = existing.get("services") or {}
+    selected = {name for name in set(generated) | set(current)
+                if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)}
+    dependents = selected
+    while dependents:
+        dependents = {name for name in set(current) & set(generated) - selected
+                      if service_references(current[name]) & selected}
+        selected |= dependents
+
+    services = {}
+    for name in generated:
+        if name in selected:
+            services[name] = generated[name]
+        elif name in current:
+            services[name] = current[name]
+    for name in current:
+        if name not in generated and name not in selected:
+            services[name] = current[name]
+
+    volumes = dict(existing.get("volumes") or {})
+    volumes.update(compose["volumes"])
+    networks = dict(existing.get("networks") or {})
+    networks.update(compose["networks"])
+    merged = {"version": existing.get("version", compose["version"]), "services": services,
+              "volumes": volumes, "networks": networks}
+    return merged, sorted(selected)
+
+def compose_differences(existing, compose):
+    """Names of services (or top-level sections) that differ between two documents."""
+    differences = []
+    current = existing.get("services") or {}
+    for name in sorted(set(current) | set(compose["services"])):
+        if current.get(name) != compose["services"].get(name):
+            differences.append(f"services.{name}")
+    for key in ("version", "volumes", "networks"):
+        if existing.get(key) != compose.get(key):
+            differences.append(key)
+    return differences
+
+def cluster_exporter_jobs(scrape_interval, indices_interval=None):
+    """
+    Prometheus jobs for the cluster exporters. Per-index series (the ones
+    with an "index" label) are much more numerous and change slowly, so
+    they are scraped from elasticsearch-exporter-indices on
+    indices_interval. That exporter also reports cluster health and its
+    entry node, which the main job already has, so only the per-index
+    series are kept.
+    """
+    jobs = {"elasticsearch_exporter": f"""  - job_name: elasticsearch_exporter
+    scrape_interval: {scrape_interval}
+    scrape_timeout: {min_duration(scrape_interval, "30s")}
+    static_configs:
+      - targets: ['elasticsearch-exporter:9114']\n""", "elasticsearch_exporter_indices": None}
+    if indices_interval:
+        jobs["elasticsearch_exporter_indices"] = f"""  - job_name: elasticsearch_exporter_indices
+    scrape_interval: {indices_interval}
+    scrape_timeout: {min_duration(indices_interval, "30s")}
+    static_configs:
+      - targets: ['elasticsearch-exporter-indices:9114']
+    metric_relabel_configs:
+      - source_labels: [index]
+        regex: .+
+        action: keep
+"""
+    return jobs
 
-print(f"Generated docker-compose-generated-hyperion.yml with {amount_of_nodes} Elasticsearch nodes and {amount_of_rabbitmq_instances} RabbitMQ instances.")
+def min_duration(*durations):
+    """The shortest of several Prometheus durations such as "15s" or "1m"."""
+    seconds = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    def to_seconds(duration):
+        unit = duration.lstrip("0123456789.")
+        return float(duration[:-len(unit)]) * seconds[unit]
+    return min(durations, key=to_seconds)
 
-def update_prometheus_config(node_count):
-    if not monitoring_enabled:
-        print("Monitoring disabled, skipping prometheus config update.")
-        return
-        
+def update_prometheus_config(nodes, exporter_mode="node", scrape_interval="15s", indices_interval=None):
     # Read the existing prometheus.yml
     with open("prometheus/hyperion/prometheus.yml", "r") as f:
         config = f.readlines()
 
-    # Generate new elasticsearch_exporter job configuration
-    new_es_job = f"""  - job_name: elasticsearch_exporter
+    if exporter_mode == "cluster":
+        jobs = cluster_exporter_jobs(scrape_interval, indices_interval)
+    else:
+        # Generate new elasticsearch_exporter job configuration; with dedicated
+        # tiers each gets its own target group labelled es_tier
+        targets_by_tier = {}
+        for i, node in enumerate(nodes, start=1):
+            targets_by_tier.setdefault(node.tier, []).append(f'elasticsearch-exporter-{i}:9114')
+        new_es_job = """  - job_name: elasticsearch_exporter
     scrape_interval: 1s
-    static_configs:
-      - targets: {[f'elasticsearch-exporter-{i}:9114' for i in range(1, node_count + 1)]}\n"""
-
-    # Remove any existing elasticsearch_exporter job
-    new_config = []
-    skip_section = False
-    for line in config:
-        if 'job_name: elasticsearch_exporter' in line:
-            skip_section = True
-            continue
-        if skip_section:
-            if line.strip().startswith('- job_name:'):
-                skip_section = False
-            else:
-                continue
-        if not skip_section:
-            new_config.append(line)
-
-    # Find the position to insert the new job (before the last job)
-    insert_position = None
-    for i, line in enumerate(new_config):
-        if 'job_name: nodeos_custom_exporter' in line:
-            insert_position = i
-            break
+    static_configs:\n"""
+        for tier, targets in targets_by_tier.items():
+            new_es_job += f"      - targets: {targets}\n"
+            if tier != "mixed":
+                new_es_job += f"        labels:\n          es_tier: {tier}\n"
+        jobs = {"elasticsearch_exporter": new_es_job, "elasticsearch_exporter_indices": None}
 
-    if insert_position is not None:
-        # Insert the new elasticsearch_exporter job configuration
-        new_config.insert(insert_position, new_es_job)
-    else:
-        # If we didn't find the position, append to the end of scrape_configs
-        new_config.append(new_es_job)
+    config = replace_prometheus_job(config, "elasticsearch_exporter", jobs["elasticsearch_exporter"])
+    config = replace_prometheus_job(config, "elasticsearch_exporter_indices", jobs["elasticsearch_exporter_indices"],
+                                    after="elasticsearch_exporter")
 
     # Write the updated configuration back to the file
     with open("prometheus/hyperion/prometheus.yml", "w") as f:
-        f.writelines(new_config)
+        f.writelines(config)
+
+def prometheus_job_end(lines, start):
+    """Index just past the scrape job whose `- job_name:` line is lines[start]."""
+    end = start + 1
+    # A job ends at the next list item or top-level comment
+    while end < len(lines) and not (lines[end].startswith("  -") or lines[end].startswith("  #")):
+        end += 1
+    return end
+
+def replace_prometheus_job(lines, job_name, new_job, after=None):
+    """
+    Replace the scrape job `job_name` in the prometheus.yml `lines` in
+    place, or remove it when `new_job` is None. A missing job is inserted
+    after the `after` job when there is one, otherwise before
+    nodeos_custom_exporter, otherwise at the end.
+    """
+    new_config = list(lines)
+    position = None
+    for i, line in enumerate(new_config):
+        if line.strip() == f"- job_name: {job_name}":
+            position = i
+            del new_config[i:prometheus_job_end(new_config, i)]
+            break
 
-def update_prometheus_rabbitmq_config(rabbitmq_count):
-    """Update Prometheus configuration to include RabbitMQ cluster monitoring"""
-    if not monitoring_enabled:
-        return
-        
+    if new_job is None:
+        return new_config
+    if position is None:
+        anchor = next((i for i, line in enumerate(new_config) if line.strip() == f"- job_name: {after}"), None)
+        if anchor is not None:
+            position = prometheus_job_end(new_config, anchor)
+        else:
+            position = next((i for i, line in enumerate(new_config) if 'job_name: nodeos_custom_exporter' in line),
+                            len(new_config))
+    # prometheus.yml is hand-edited and may not end with a newline
+    if position > 0 and not new_config[position - 1].endswith("\n"):
+        new_config[position - 1] += "\n"
+    # One entry per line, so later calls can find and anchor on this job
+    new_config[position:position] = new_job.splitlines(keepends=True)
+    return new_config
+
+def update_prometheus_rabbitmq_config(rabbitmq_count, mode="exporter", vhost="hyperion", scrape_interval="15s"):
+    """
+    Update Prometheus configuration to include RabbitMQ cluster monitoring.
+    In "exporter" mode the kbudde exporters are scraped; in "native" mode
+    the rabbitmq job scrapes every broker's aggregated /metrics, and
+    rabbitmq_queues adds per-queue series for `vhost` from /metrics/detailed.
+    """
     # Read the existing prometheus.yml
     with open("prometheus/hyperion/prometheus.yml", "r") as f:
         config = f.readlines()
 
-    # Generate RabbitMQ exporter job configuration
     if rabbitmq_count == 1:
-        new_rabbitmq_job = """  - job_name: rabbitmq_exporter
-    scrape_interval: 15s
+        nodes = ["rabbitmq"]
+    else:
+        nodes = [f"rabbitmq-{i}" for i in range(1, rabbitmq_count + 1)]
+
+    if mode == "native":
+        targets = [f"{node}:15692" for node in nodes]
+        config = replace_prometheus_job(config, "rabbitmq_exporter", None)
+        config = replace_prometheus_job(config, "rabbitmq", f"""  - job_name: rabbitmq
+    scrape_interval: {scrape_interval}
+    static_configs:
+      - targets: {targets}\n""")
+        config = replace_prometheus_job(config, "rabbitmq_queues", f"""  - job_name: rabbitmq_queues
+    scrape_interval: {scrape_interval}
+    metrics_path: /metrics/detailed
+    params:
+      vhost: ['{vhost}']
+      family: ['queue_coarse_metrics', 'queue_consumer_count']
     static_configs:
-      - targets: ['rabbitmq-exporter:9419']\n"""
+      - targets: {targets}\n""")
     else:
-        targets = [f'rabbitmq-exporter-{i}:9419' for i in range(1, rabbitmq_count + 1)]
-        new_rabbitmq_job = f"""  - job_name: rabbitmq_exporter
-    scrape_interval: 15s
+        if rabbitmq_count == 1:
+            targets = ['rabbitmq-exporter:9419']
+        else:
+            targets = [f'rabbitmq-exporter-{i}:9419' for i in range(1, rabbitmq_count + 1)]
+        config = replace_prometheus_job(config, "rabbitmq_queues", None)
+        config = replace_prometheus_job(config, "rabbitmq_exporter", f"""  - job_name: rabbitmq_exporter
+    scrape_interval: {scrape_interval}
     static_configs:
-      - targets: {targets}\n"""
+      - targets: {targets}\n""")
 
-    # Remove any existing rabbitmq_exporter job
-    new_config = []
-    skip_section = False
-    for line in config:
-        if 'job_name: rabbitmq_exporter' in line:
-            skip_section = True
-            continue
-        if skip_section:
-            if line.strip().startswith('- job_name:'):
-                skip_section = False
-            else:
-                continue
-        if not skip_section:
-            new_config.append(line)
+    # Write the updated configuration back to the file
+    with open("prometheus/hyperion/prometheus.yml", "w") as f:
+        f.writelines(config)
 
-    # Find the position to insert the new job (before the last job)
-    insert_position = None
-    for i, line in enumerate(new_config):
-        if 'job_name: nodeos_custom_exporter' in line:
-            insert_position = i
-            break
+def update_prometheus_gc_config(nodes):
+    """Write the es_gc_exporter job for the GC sidecars, or remove it when `nodes` is empty."""
+    # Read the existing prometheus.yml
+    with open("prometheus/hyperion/prometheus.yml", "r") as f:
+        config = f.readlines()
 
-    if insert_position is not None:
-        # Insert the new rabbitmq_exporter job configuration
-        new_config.insert(insert_position, new_rabbitmq_job)
-    else:
-        # If we didn't find the position, append to the end of scrape_configs
-        new_config.append(new_rabbitmq_job)
+    targets = [f'{node.name}-gc-exporter:9500' for node in nodes]
+    new_gc_job = f"""  - job_name: es_gc_exporter
+    scrape_interval: 5s
+    static_configs:
+      - targets: {targets}\n"""
+
+    # Keep it next to the other Elasticsearch exporter jobs
+    config = replace_prometheus_job(config, "es_gc_exporter", new_gc_job if targets else None,
+                                    after="elasticsearch_exporter")
 
     # Write the updated configuration back to the file
     with open("prometheus/hyperion/prometheus.yml", "w") as f:
-        f.writelines(new_config)
-
-# Add this line at the end of the script, after writing the docker-compose file
-update_prometheus_config(amount_of_nodes)
-update_prometheus_rabbitmq_config(amount_of_rabbitmq_instances)
-if monitoring_enabled:
-    print(f"Updated prometheus.yml with {amount_of_nodes} elasticsearch-exporter targets and {amount_of_rabbitmq_instances} rabbitmq-exporter targets.")
-else:
-    print("Monitoring disabled, prometheus.yml not updated.")
-
-# Call the setup function at the end of your script
-setup_elasticsearch_config(amount_of_nodes)
-setup_rabbitmq_cluster_config(amount_of_rabbitmq_instances)
-setup_rabbitmq_haproxy_config(amount_of_rabbitmq_instances, rabbitmq_user, rabbitmq_pass)
-if proxy_enabled:
-    setup_haproxy_config()
-    if certbot_enabled:
-        # Create certbot directory structure
-        os.makedirs("certbot", exist_ok=True)
-        print("Certbot configuration created. Certificates will be automatically generated on startup.")
-    else:
-        print("HAProxy configuration created. Please add your SSL certificates to haproxy/certs/server.pem")
+        f.writelines(config)
 
-def setup_haproxy_config():
-    import os
+def setup_haproxy_config(config):
     from urllib.parse import urlparse
     
     # Create haproxy directories
@@ -1060,20 +2005,20 @@ def setup_haproxy_config():
     grafana_hostname = ""
     hyperion_hostname = ""
     
-    if production_alias_kibana:
-        parsed_url = urlparse(production_alias_kibana)
+    if config.production_alias_kibana:
+        parsed_url = urlparse(config.production_alias_kibana)
         kibana_hostname = parsed_url.netloc or "autobuilds-kibana.oiac.io"
     else:
         kibana_hostname = "autobuilds-kibana.oiac.io"
     
-    if production_alias_grafana:
-        parsed_url = urlparse(production_alias_grafana)
+    if config.production_alias_grafana:
+        parsed_url = urlparse(config.production_alias_grafana)
         grafana_hostname = parsed_url.netloc or "autobuilds-grafana.oiac.io"
     else:
         grafana_hostname = "autobuilds-grafana.oiac.io"
     
-    if production_alias_hyperion:
-        parsed_url = urlparse(production_alias_hyperion)
+    if config.production_alias_hyperion:
+        parsed_url = urlparse(config.production_alias_hyperion)
         hyperion_hostname = parsed_url.netloc or "autobuilds-hyperion.oiac.io"
     else:
         hyperion_hostname = "autobuilds-hyperion.oiac.io"
@@ -1174,4 +2119,138 @@ resolvers docker
     
     # Write the haproxy.cfg file
     with open("haproxy/haproxy.cfg", "w") as f:
-        f.write(haproxy_cfg)
\ No newline at end of file
+        f.write(haproxy_cfg)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the Hyperion docker compose stack from .env")
+    parser.add_argument("--output", default=COMPOSE_FILE, help="Compose file to write, or - for stdout")
+    parser.add_argument("--service", action="append", metavar="PATTERN",
+                        help="Only regenerate services matching PATTERN (glob, repeatable), keeping the rest of the existing file. "
+                             "Supporting config files are left untouched.")
+    parser.add_argument("--check", action="store_true",
+                        help="Validate and compare against the existing compose file without writing anything; exit 1 on differences")
+    return parser.parse_args(argv)
+
+def load_existing(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+def write_supporting_config(config, plans=None):
+    """Write the per-service config files the compose file mounts."""
+    nodes = elasticsearch_nodes(config)
+    if config.monitoring_enabled:
+        update_prometheus_config(nodes, config.es_exporter_mode, config.es_exporter_scrape_interval,
+                                 config.es_exporter_indices_interval if config.es_exporter_indices else None)
+        update_prometheus_rabbitmq_config(config.amount_of_rabbitmq_instances, config.rabbitmq_exporter_mode,
+                                          config.rabbitmq_vhost, config.rabbitmq_scrape_interval)
+        update_prometheus_gc_config(nodes if config.es_gc_exporter else [])
+        es_targets = 1 + config.es_exporter_indices if config.es_exporter_mode == "cluster" else len(nodes)
+        rabbitmq_source = "native rabbitmq" if config.rabbitmq_exporter_mode == "native" else "rabbitmq-exporter"
+        print(f"Updated prometheus.yml with {es_targets} elasticsearch-exporter targets and "
+              f"{config.amount_of_rabbitmq_instances} {rabbitmq_source} targets.")
+    else:
+        print("Monitoring disabled, prometheus.yml not updated.")
+
+    backfill = (config.es_backfill_index_buffer, config.es_backfill_write_queue_size) if config.es_backfill else None
+    setup_elasticsearch_config(nodes, plans, backfill)
+    setup_rabbitmq_cluster_config(config.amount_of_rabbitmq_instances, config.rabbitmq_memory, config.rabbitmq_cpus)
+    setup_rabbitmq_definitions(config)
+    setup_rabbitmq_haproxy_config(config.amount_of_rabbitmq_instances, config.rabbitmq_user, config.rabbitmq_pass,
+                                  config.rabbitmq_haproxy_check_inter, config.rabbitmq_haproxy_check_rise,
+                                  config.rabbitmq_haproxy_check_fall, bool(config.rabbitmq_sharded))
+    if config.proxy_enabled:
+        setup_haproxy_config(config)
+        if config.certbot_enabled:
+            # Create certbot directory structure
+            os.makedirs("certbot", exist_ok=True)
+            print("Certbot configuration created. Certificates will be automatically generated on startup.")
+        else:
+            print("HAProxy configuration created. Please add your SSL certificates to haproxy/certs/server.pem")
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Load environment variables from .env file
+    load_dotenv()
+    try:
+        config = HyperionConfig.from_env()
+        plans = elasticsearch_plans(config)
+        layouts = plan_index_layout(config) if config.es_shard_layout == "auto" else []
+    except ValueError as e:
+        print(f"Invalid configuration: {e}")
+        return 1
+
+    tiers = config.es_tier_counts()
+    if tiers and tiers["masters"] % 2 == 0:
+        print(f"Warning: {tiers['masters']} master nodes tolerate as many failures as {tiers['masters'] - 1}; use an odd number")
+    if config.rabbitmq_clustered and config.rabbitmq_definitions_enabled:
+        # Hyperion partitions each stage into this many queues itself; fewer
+        # queues than brokers leaves brokers without a leader to serve
+        scaling = chain_config(config).get("scaling", {})
+        short = [f"{key}={scaling.get(key, 1)}" for key in ("ds_queues", "indexing_queues", "ad_idx_queues")
+                 if scaling.get(key, 1) < config.amount_of_rabbitmq_instances]
+        if short:
+            print(f"Warning: scaling {', '.join(short)} in the chain config spreads those stages over fewer "
+                  f"than the {config.amount_of_rabbitmq_instances} RabbitMQ brokers")
+
+    compose = build_compose(config, plans)
+    existing = load_existing(args.output) if args.output != "-" else None
+
+    if args.service:
+        if existing is None:
+            print(f"{args.output} does not exist yet; run a full generation first.")
+            return 1
+        compose, selected = merge_services(existing, compose, args.service)
+        if not selected:
+            print(f"No services match {', '.join(args.service)}")
+            return 1
+
+    problems = validate_compose(compose)
+    for problem in problems:
+        print(f"Invalid compose: {problem}")
+    if problems:
+        if args.service:
+            print("The kept services do not match the new topology; run a full generation instead of --service.")
+        return 1
+
+    if args.check:
+        if existing is None:
+            print(f"{args.output} does not exist")
+            return 1
+        differences = compose_differences(existing, compose)
+        for difference in differences:
+            print(f"Out of date: {difference}")
+        if not differences:
+            print(f"{args.output} is up to date.")
+        return 1 if differences else 0
+
+    output = dump_compose(compose)
+    if args.output == "-":
+        sys.stdout.write(output)
+        return 0
+
+    with open(args.output, "w") as f:
+        f.write(output)
+
+    if args.service:
+        print(f"Regenerated {', '.join(selected)} in {args.output}.")
+        return 0
+
+    nodes = elasticsearch_nodes(config)
+    print(f"Generated {args.output} with {len(nodes)} Elasticsearch nodes and {config.amount_of_rabbitmq_instances} RabbitMQ instances.")
+    for tier, plan in plans.items():
+        count = sum(1 for node in nodes if node.tier == tier)
+        if not count:
+            continue
+        print(f"Elasticsearch {tier} sizing: {count} node(s) with {plan.java_heap} heap, "
+              f"{plan.memory_limit} memory, {plan.cpu_limit} CPUs, {plan.write_threads} write / {plan.search_threads} search threads")
+    for layout in layouts:
+        print(f"Index layout {layout.pattern}: {layout.shards} primary shards, {layout.replicas} replicas "
+              f"(~{layout.partition_size / 1024 ** 3:.0f}g per partition)")
+    write_supporting_config(config, plans)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import os
+import signal
+import sys
+import time
+import docker
+import requests
+
+# Controller configuration, set by generate_hyperion_compose.py
+prometheus_url = os.getenv("PROMETHEUS_URL", "http://prometheus:9090").rstrip("/")
+poll_interval = float(os.getenv("POLL_INTERVAL", "5"))
+# Broker containers whose memory watermark gates publishing
+rabbitmq_containers = [name.strip() for name in os.getenv("RABBITMQ_CONTAINERS", "rabbitmq").split(",") if name.strip()]
+# Absolute watermark (bytes) restored when intake resumes
+rabbitmq_watermark = os.getenv("RABBITMQ_WATERMARK", "")
+vhost = os.getenv("RABBITMQ_VHOST", "hyperion")
+queue_pattern = os.getenv("QUEUE_PATTERN", "wax:.*")
+# rabbitmq_queue_messages from the kbudde exporters, or
+# rabbitmq_detailed_queue_messages from the brokers' /metrics/detailed
+depth_metric = os.getenv("DEPTH_METRIC", "rabbitmq_queue_messages")
+# Pause at PAUSE_DEPTH messages on any pipeline queue or more than
+# MAX_REJECTION_RATE Elasticsearch write rejections per second; resume
+# once every queue is back under RESUME_DEPTH without rejections
+pause_depth = int(os.getenv("PAUSE_DEPTH", "50000"))
+resume_depth = int(os.getenv("RESUME_DEPTH", "5000"))
+max_rejection_rate = float(os.getenv("MAX_REJECTION_RATE", "1"))
+min_pause = float(os.getenv("MIN_PAUSE", "15"))
+
+DEPTH_QUERY = 'max by (queue) ({metric}{{vhost="{vhost}",queue=~"{pattern}"}})'
+REJECTION_QUERY = 'sum(rate(elasticsearch_thread_pool_rejected_count{type="write"}[1m]))'
+
+def query(expr):
+    response = requests.get(f"{prometheus_url}/api/v1/query", params={"query": expr}, timeout=10)
+    response.raise_for_status()
+    return response.json()["data"]["result"]
+
+def queue_depths():
+    """Ready plus unacked messages per pipeline queue."""
+    return {result["metric"].get("queue", ""): float(result["value"][1])
+            for result in query(DEPTH_QUERY.format(metric=depth_metric, vhost=vhost, pattern=queue_pattern))}
+
+def rejection_rate():
+    """Elasticsearch write thread pool rejections per second across the cluster."""
+    results = query(REJECTION_QUERY)
+    return float(results[0]["value"][1]) if results else 0.0
+
+def should_pause(depths, rejections, paused, paused_for):
+    """Hysteresis between PAUSE_DEPTH and RESUME_DEPTH, holding a pause for at least MIN_PAUSE."""
+    deepest = max(depths.values(), default=0)
+    if not paused:
+        return deepest >= pause_depth or rejections > max_rejection_rate
+    if paused_for < min_pause:
+        return True
+    return deepest > resume_depth or rejections > max_rejection_rate
+
+class Intake:
+    """
+    Pauses the pipeline by setting every broker's memory watermark to 0,
+    which raises the memory alarm and blocks publishing connections: the
+    Hyperion reader and deserializers stop publishing while the indexers
+    keep draining their queues into Elasticsearch. Resuming restores the
+    generated absolute watermark.
+    """
+
+    def __init__(self):
+        self.client = docker.from_env()
+        self.paused = None
+        self.paused_at = None
+
+    def set(self, paused):
+        if paused:
+            command = ["rabbitmqctl", "set_vm_memory_high_watermark", "0"]
+        elif rabbitmq_watermark:
+            command = ["rabbitmqctl", "set_vm_memory_high_watermark", "absolute", rabbitmq_watermark]
+        else:
+            command = ["rabbitmqctl", "set_vm_memory_high_watermark", "0.4"]
+        applied = True
+        for name in rabbitmq_containers:
+            try:
+                exit_code, output = self.client.containers.get(name).exec_run(command)
+            except docker.errors.DockerException as e:
+                print(f"Could not reach {name}: {e}")
+                applied = False
+                continue
+            if exit_code != 0:
+                print(f"{' '.join(command)} failed on {name}: {output.decode(errors='replace').strip()}")
+                applied = False
+        # A failed broker is retried on the next check
+        if applied:
+            if paused and not self.paused:
+                self.paused_at = time.monotonic()
+            self.paused = paused
+        return applied
+
+    @property
+    def paused_for(self):
+        return time.monotonic() - self.paused_at if self.paused and self.paused_at else 0
+
+def run():
+    intake = Intake()
+
+    def shutdown(signum, frame):
+        # Never leave publishers blocked behind a stopped controller
+        intake.set(False)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # Clear a pause left by a previous run
+    intake.set(False)
+    print(f"Watching {queue_pattern} in {vhost} on {', '.join(rabbitmq_containers)}: pause at {pause_depth} messages "
+          f"or {max_rejection_rate:g} rejections/s, resume under {resume_depth}")
+    while True:
+        try:
+            depths = queue_depths()
+            rejections = rejection_rate()
+        except (requests.RequestException, KeyError, ValueError) as e:
+            print(f"Metrics unavailable ({e}), leaving intake open")
+            if intake.paused is not False:
+                intake.set(False)
+            time.sleep(poll_interval)
+            continue
+
+        deepest_queue = max(depths, key=depths.get, default=None)
+        deepest = depths.get(deepest_queue, 0)
+        pause = should_pause(depths, rejections, intake.paused, intake.paused_for)
+        if pause and not intake.paused:
+            if intake.set(True):
+                print(f"Paused intake: {deepest_queue} at {deepest:.0f} messages, {rejections:.1f} ES write rejections/s")
+        elif not pause and intake.paused is not False:
+            paused_for = intake.paused_for
+            if intake.set(False):
+                print(f"Resumed intake after {paused_for:.0f}s: deepest queue {deepest:.0f} messages, {rejections:.1f} rejections/s")
+
+        time.sleep(poll_interval)
+
+if __name__ == "__main__":
+    run()
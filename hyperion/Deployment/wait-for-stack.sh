@@ -0,0 +1,94 @@
+#!/bin/bash
+# Readiness gate run by entrypoint.sh before the indexer starts. Every
+# dependency is checked in parallel, each retrying with exponential backoff,
+# and the gate fails once READY_TIMEOUT seconds have passed. The endpoints
+# come from the compose file written by generate_hyperion_compose.py.
+
+READY_TIMEOUT="${READY_TIMEOUT:-600}"
+READY_ES_NODES="${READY_ES_NODES:-es1:9200}"
+READY_RABBITMQ_API="${READY_RABBITMQ_API:-rabbitmq:15672}"
+READY_RABBITMQ_NODES="${READY_RABBITMQ_NODES:-1}"
+READY_REDIS="${READY_REDIS:-redis:6379}"
+READY_NODEOS_URL="${READY_NODEOS_URL:-http://node:8888}"
+READY_SHIP="${READY_SHIP:-node:9876}"
+# Maximum head block age in seconds for nodeos to count as synced; 0 only
+# requires get_info to answer
+READY_NODEOS_MAX_LAG="${READY_NODEOS_MAX_LAG:-30}"
+
+DEADLINE=$(( $(date +%s) + READY_TIMEOUT ))
+IFS=',' read -r -a ES_NODES <<< "$READY_ES_NODES"
+
+# Evaluate a JavaScript expression over the JSON document on stdin (as d)
+json_eval() {
+    node -e '
+        let s = "";
+        process.stdin.on("data", c => s += c).on("end", () => {
+            try { const d = JSON.parse(s); console.log(eval(process.argv[1])); } catch (e) { process.exit(1); }
+        });' "$1"
+}
+
+retry() {
+    name="$1"
+    shift
+    delay=1
+    while true; do
+        if "$@"; then
+            echo "${name} is ready."
+            return 0
+        fi
+        if (( $(date +%s) + delay > DEADLINE )); then
+            echo "${name} not ready after ${READY_TIMEOUT}s."
+            return 1
+        fi
+        echo "Waiting for ${name} (retrying in ${delay}s)..."
+        sleep "$delay"
+        delay=$(( delay * 2 > 30 ? 30 : delay * 2 ))
+    done
+}
+
+tcp_ready() {
+    timeout 1 bash -c "cat < /dev/null > /dev/tcp/${1%:*}/${1#*:}" 2>/dev/null
+}
+
+# The node answers and sees every configured node in a yellow or green cluster
+es_ready() {
+    curl -sf --max-time 10 "http://$1/_cluster/health?wait_for_status=yellow&timeout=5s" \
+        | json_eval "!d.timed_out && d.number_of_nodes >= ${#ES_NODES[@]}" | grep -qx true
+}
+
+# Every broker has joined and is running
+rabbitmq_ready() {
+    curl -sf --max-time 10 -u "${RABBITMQ_DEFAULT_USER}:${RABBITMQ_DEFAULT_PASS}" "http://${READY_RABBITMQ_API}/api/nodes" \
+        | json_eval "d.filter(n => n.running).length >= ${READY_RABBITMQ_NODES}" | grep -qx true
+}
+
+redis_ready() {
+    timeout 3 bash -c 'exec 3<>"/dev/tcp/$0/$1" && printf "PING\r\n" >&3 && read -r reply <&3 && [[ "$reply" == "+PONG"* ]]' \
+        "${READY_REDIS%:*}" "${READY_REDIS#*:}" 2>/dev/null
+}
+
+nodeos_ready() {
+    curl -sf --max-time 10 "${READY_NODEOS_URL}/v1/chain/get_info" \
+        | json_eval "${READY_NODEOS_MAX_LAG} <= 0 || (Date.now() - Date.parse(d.head_block_time + 'Z')) / 1000 <= ${READY_NODEOS_MAX_LAG}" \
+        | grep -qx true
+}
+
+pids=()
+for es_node in "${ES_NODES[@]}"; do
+    retry "Elasticsearch ${es_node}" es_ready "$es_node" &
+    pids+=($!)
+done
+retry "RabbitMQ cluster (${READY_RABBITMQ_NODES} nodes)" rabbitmq_ready &
+pids+=($!)
+retry "Redis ${READY_REDIS}" redis_ready &
+pids+=($!)
+retry "nodeos ${READY_NODEOS_URL}" nodeos_ready &
+pids+=($!)
+retry "state history ${READY_SHIP}" tcp_ready "$READY_SHIP" &
+pids+=($!)
+
+failed=0
+for pid in "${pids[@]}"; do
+    wait "$pid" || failed=1
+done
+exit "$failed"
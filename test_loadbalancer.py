@@ -1,72 +1,493 @@
 #!/usr/bin/env python3
+import argparse
+import base64
+import json
 import pika
+import struct
+import subprocess
 import sys
+import threading
 import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter
+from bench_utils import latency_summary, write_json
 
-def test_loadbalancer():
+# Every benchmark message starts with its send time (time.perf_counter())
+TIMESTAMP_HEADER = struct.Struct("<d")
+
+# Failover messages carry the publisher id and sequence number
+SEQUENCE_HEADER = struct.Struct("<II")
+
+def connection_parameters(args, connection_name=None, heartbeat=None):
+    return pika.ConnectionParameters(
+        host=args.host,
+        port=args.port,
+        credentials=pika.PlainCredentials(args.user, args.password),
+        virtual_host=args.vhost,
+        client_properties={"connection_name": connection_name} if connection_name else None,
+        heartbeat=heartbeat,
+        connection_attempts=1,
+        socket_timeout=2,
+    )
+
+def test_loadbalancer(args):
     print("Testing HAProxy Load Balancer for RabbitMQ...")
     print("=" * 50)
-    
+
     try:
         # Connect to RabbitMQ through HAProxy load balancer
-        print("Connecting to RabbitMQ via HAProxy (localhost:5675)...")
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(
-                host='localhost', 
-                port=5675, 
-                credentials=pika.PlainCredentials('rabbitmquser', 'rabbitmqpass'),
-                virtual_host='hyperion'
-            )
-        )
-        
+        print(f"Connecting to RabbitMQ via HAProxy ({args.host}:{args.port})...")
+        connection = pika.BlockingConnection(connection_parameters(args))
+
         print("✓ Successfully connected to RabbitMQ through HAProxy!")
-        
+
         channel = connection.channel()
-        
+
         # Declare a test queue
         queue_name = 'test_lb_queue'
         print(f"\nDeclaring queue: {queue_name}")
         result = channel.queue_declare(queue=queue_name, durable=True)
         print(f"✓ Queue declared successfully")
-        
+
         # Publish a test message
         message = f"Test message from HAProxy load balancer at {time.strftime('%H:%M:%S')}"
         print(f"\nPublishing message: {message}")
         channel.basic_publish(
-            exchange='', 
-            routing_key=queue_name, 
+            exchange='',
+            routing_key=queue_name,
             body=message,
             properties=pika.BasicProperties(delivery_mode=2)  # make message persistent
         )
         print("✓ Message published successfully")
-        
+
         # Consume the message
         print(f"\nConsuming message from queue: {queue_name}")
         method_frame, header_frame, body = channel.basic_get(queue_name)
-        
+
         if method_frame:
             print(f"✓ Message received: {body.decode()}")
             channel.basic_ack(method_frame.delivery_tag)
             print("✓ Message acknowledged")
         else:
             print("✗ No message received")
-        
+
         # Clean up
         print(f"\nCleaning up test queue: {queue_name}")
         channel.queue_delete(queue=queue_name)
         print("✓ Test queue deleted")
-        
+
         connection.close()
         print("\n✓ Connection closed successfully")
         print("\n🎉 HAProxy Load Balancer Test: SUCCESS!")
-        
+
     except pika.exceptions.AMQPConnectionError as e:
         print(f"✗ Connection failed: {e}")
-        print("Make sure HAProxy is running and listening on port 5675")
+        print(f"Make sure HAProxy is running and listening on port {args.port}")
         sys.exit(1)
     except Exception as e:
         print(f"✗ Test failed: {e}")
         sys.exit(1)
 
+def declare_benchmark_queue(channel, args):
+    arguments = {"x-queue-type": args.queue_type}
+    channel.queue_declare(queue=args.queue, durable=True, arguments=arguments)
+
+def run_publisher(args, stop, stats):
+    """Publish until `stop` is set, recording publish-confirm latency per message."""
+    try:
+        connection = pika.BlockingConnection(connection_parameters(args))
+        channel = connection.channel()
+        if args.confirms:
+            channel.confirm_delivery()
+
+        properties = pika.BasicProperties(delivery_mode=2 if args.persistent else 1)
+        padding = b"x" * max(0, args.message_size - TIMESTAMP_HEADER.size)
+        interval = 1.0 / args.rate if args.rate else 0
+        next_send = time.perf_counter()
+
+        while not stop.is_set():
+            if interval:
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send += interval
+
+            sent = time.perf_counter()
+            # With confirms enabled basic_publish blocks until the broker confirms
+            channel.basic_publish(exchange="", routing_key=args.queue, body=TIMESTAMP_HEADER.pack(sent) + padding, properties=properties)
+            stats["published"] += 1
+            if args.confirms:
+                stats["confirm_latency"].append(time.perf_counter() - sent)
+
+        connection.close()
+    except Exception as e:
+        stats["errors"].append(f"publisher: {e!r}")
+
+def run_consumer(args, stop, stats):
+    """Consume and ack until `stop` is set, recording end-to-end latency per message."""
+    try:
+        connection = pika.BlockingConnection(connection_parameters(args))
+        channel = connection.channel()
+        channel.basic_qos(prefetch_count=args.prefetch)
+
+        def on_message(ch, method, properties, body):
+            stats["e2e_latency"].append(time.perf_counter() - TIMESTAMP_HEADER.unpack_from(body)[0])
+            stats["consumed"] += 1
+            ch.basic_ack(method.delivery_tag)
+
+        channel.basic_consume(queue=args.queue, on_message_callback=on_message)
+        while not stop.is_set():
+            connection.process_data_events(time_limit=0.2)
+        connection.close()
+    except Exception as e:
+        stats["errors"].append(f"consumer: {e!r}")
+
+def new_stats():
+    return {"published": 0, "consumed": 0, "confirm_latency": [], "e2e_latency": [], "errors": []}
+
+def run_benchmark(args):
+    """
+    Drive concurrent publishers and consumers through the load balancer for
+    a fixed duration and report throughput and latency percentiles.
+    """
+    connection = pika.BlockingConnection(connection_parameters(args))
+    channel = connection.channel()
+    declare_benchmark_queue(channel, args)
+    channel.queue_purge(queue=args.queue)
+
+    publish_stop = threading.Event()
+    consume_stop = threading.Event()
+    publisher_stats = [new_stats() for _ in range(args.publishers)]
+    consumer_stats = [new_stats() for _ in range(args.consumers)]
+    consumers = [threading.Thread(target=run_consumer, args=(args, consume_stop, stats), daemon=True) for stats in consumer_stats]
+    publishers = [threading.Thread(target=run_publisher, args=(args, publish_stop, stats), daemon=True) for stats in publisher_stats]
+
+    print(f"Benchmarking {args.host}:{args.port} for {args.duration}s: "
+          f"{args.publishers} publisher(s), {args.consumers} consumer(s), {args.message_size}B "
+          f"{'persistent' if args.persistent else 'transient'} messages, {args.queue_type} queue, "
+          f"confirms {'on' if args.confirms else 'off'}, prefetch {args.prefetch}")
+
+    for thread in consumers + publishers:
+        thread.start()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    publish_stop.set()
+    for thread in publishers:
+        thread.join()
+    publish_elapsed = time.perf_counter() - started
+
+    # Let consumers drain what was published before stopping them
+    published = sum(stats["published"] for stats in publisher_stats)
+    drain_deadline = time.perf_counter() + args.drain_timeout
+    while sum(stats["consumed"] for stats in consumer_stats) < published and time.perf_counter() < drain_deadline:
+        time.sleep(0.1)
+    consume_stop.set()
+    for thread in consumers:
+        thread.join()
+    consume_elapsed = time.perf_counter() - started
+
+    consumed = sum(stats["consumed"] for stats in consumer_stats)
+    if not args.keep_queue:
+        channel.queue_delete(queue=args.queue)
+    connection.close()
+
+    return {
+        "config": {
+            "host": args.host,
+            "port": args.port,
+            "publishers": args.publishers,
+            "consumers": args.consumers,
+            "duration": args.duration,
+            "message_size": args.message_size,
+            "persistent": args.persistent,
+            "confirms": args.confirms,
+            "prefetch": args.prefetch,
+            "queue_type": args.queue_type,
+            "rate_per_publisher": args.rate,
+        },
+        "published": published,
+        "consumed": consumed,
+        "publish_rate": round(published / publish_elapsed, 1),
+        "consume_rate": round(consumed / consume_elapsed, 1),
+        "publish_confirm_latency_ms": latency_summary([s for stats in publisher_stats for s in stats["confirm_latency"]]),
+        "end_to_end_latency_ms": latency_summary([s for stats in consumer_stats for s in stats["e2e_latency"]]),
+        "errors": [e for stats in publisher_stats + consumer_stats for e in stats["errors"]],
+    }
+
+def print_benchmark_results(results):
+    print("=" * 50)
+    print(f"Published: {results['published']} ({results['publish_rate']} msgs/sec)")
+    print(f"Consumed:  {results['consumed']} ({results['consume_rate']} msgs/sec)")
+    for key, label in (("publish_confirm_latency_ms", "Publish-confirm latency"), ("end_to_end_latency_ms", "End-to-end latency")):
+        summary = results[key]
+        if summary:
+            print(f"{label} (ms): p50={summary['p50']} p99={summary['p99']} p999={summary['p999']} max={summary['max']}")
+    for error in results["errors"]:
+        print(f"✗ {error}")
+
+def management_get(args, path):
+    """GET a management API path (through the HAProxy management frontend by default)."""
+    request = urllib.request.Request(args.management_url.rstrip("/") + path)
+    token = base64.b64encode(f"{args.user}:{args.password}".encode()).decode()
+    request.add_header("Authorization", f"Basic {token}")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+def connection_nodes(args, names, timeout=15):
+    """
+    Map connection names to the RabbitMQ node serving them, polling the
+    management API until every name is listed or the timeout expires.
+    """
+    vhost = urllib.parse.quote(args.vhost, safe="")
+    deadline = time.monotonic() + timeout
+    nodes = {}
+    while True:
+        for connection in management_get(args, f"/api/vhosts/{vhost}/connections?columns=node,client_properties"):
+            name = (connection.get("client_properties") or {}).get("connection_name")
+            if name in names:
+                nodes[name] = connection["node"]
+        if len(nodes) == len(names) or time.monotonic() > deadline:
+            return nodes
+        time.sleep(0.5)
+
+def run_distribution(args):
+    """
+    Open many connections through the load balancer and report which
+    backend node each one landed on.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    names = [f"lbtest-{run_id}-{i}" for i in range(args.connections)]
+    connections = [pika.BlockingConnection(connection_parameters(args, name)) for name in names]
+    try:
+        nodes = connection_nodes(args, set(names))
+    finally:
+        for connection in connections:
+            connection.close()
+
+    counts = Counter(nodes.values())
+    expected = args.connections / len(counts) if counts else 0
+    return {
+        "connections": args.connections,
+        "located": len(nodes),
+        "per_node": dict(sorted(counts.items())),
+        "max_deviation_pct": round(max(abs(c - expected) for c in counts.values()) / expected * 100, 1) if counts else None,
+    }
+
+def docker_container(node):
+    """rabbit@rabbitmq-2 -> rabbitmq-2 (compose container names match host names)."""
+    return node.split("@", 1)[-1]
+
+def failover_publisher(args, index, run_id, stop, stats):
+    """
+    Publish sequenced messages with confirms, reconnecting after any
+    connection failure and timing how long each reconnect takes.
+    """
+    sequence = 0
+    connection = None
+    lost_at = None
+    interval = 1.0 / args.rate if args.rate else 0
+    while not stop.is_set():
+        try:
+            connection = pika.BlockingConnection(connection_parameters(args, f"lbfail-{run_id}-pub-{index}", heartbeat=5))
+            channel = connection.channel()
+            channel.confirm_delivery()
+            if lost_at is not None:
+                stats["reconnect_times"].append(time.perf_counter() - lost_at)
+                lost_at = None
+
+            while not stop.is_set():
+                sequence += 1
+                body = SEQUENCE_HEADER.pack(index, sequence)
+                stats["published"] += 1
+                channel.basic_publish(exchange="", routing_key=args.queue, body=body, properties=pika.BasicProperties(delivery_mode=2))
+                stats["confirmed"].add((index, sequence))
+                if interval:
+                    time.sleep(interval)
+            connection.close()
+        except pika.exceptions.AMQPError:
+            if lost_at is None:
+                lost_at = time.perf_counter()
+                stats["disconnects"] += 1
+            time.sleep(0.05)
+
+def failover_consumer(args, index, run_id, stop, stats):
+    """Consume sequenced messages, recording every delivery to find losses and duplicates."""
+    lost_at = None
+    while not stop.is_set():
+        try:
+            connection = pika.BlockingConnection(connection_parameters(args, f"lbfail-{run_id}-con-{index}", heartbeat=5))
+            channel = connection.channel()
+            channel.basic_qos(prefetch_count=100)
+            if lost_at is not None:
+                stats["reconnect_times"].append(time.perf_counter() - lost_at)
+                lost_at = None
+
+            def on_message(ch, method, properties, body):
+                stats["deliveries"][SEQUENCE_HEADER.unpack_from(body)] += 1
+                ch.basic_ack(method.delivery_tag)
+
+            channel.basic_consume(queue=args.queue, on_message_callback=on_message)
+            while not stop.is_set():
+                connection.process_data_events(time_limit=0.2)
+            connection.close()
+        except pika.exceptions.AMQPError:
+            if lost_at is None:
+                lost_at = time.perf_counter()
+                stats["disconnects"] += 1
+            time.sleep(0.05)
+
+def run_failover(args):
+    """
+    Run sequenced publishers and consumers through the load balancer, kill
+    one backend node mid-run and report reconnect times and message loss or
+    duplication. The cluster must be a local compose stack reachable with
+    the docker CLI.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    connection = pika.BlockingConnection(connection_parameters(args))
+    channel = connection.channel()
+    channel.queue_declare(queue=args.queue, durable=True, arguments={"x-queue-type": "quorum"})
+    channel.queue_purge(queue=args.queue)
+    connection.close()
+
+    publish_stop = threading.Event()
+    consume_stop = threading.Event()
+    publisher_stats = [{"published": 0, "confirmed": set(), "disconnects": 0, "reconnect_times": []} for _ in range(args.publishers)]
+    consumer_stats = [{"deliveries": Counter(), "disconnects": 0, "reconnect_times": []} for _ in range(args.consumers)]
+    threads = [threading.Thread(target=failover_consumer, args=(args, i, run_id, consume_stop, stats), daemon=True) for i, stats in enumerate(consumer_stats)]
+    threads += [threading.Thread(target=failover_publisher, args=(args, i, run_id, publish_stop, stats), daemon=True) for i, stats in enumerate(publisher_stats)]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(args.kill_after)
+    names = {f"lbfail-{run_id}-pub-{i}" for i in range(args.publishers)} | {f"lbfail-{run_id}-con-{i}" for i in range(args.consumers)}
+    before = connection_nodes(args, names, timeout=5)
+    target = args.kill
+    if target == "auto":
+        # Kill the node serving the most test clients to maximise the impact
+        target = docker_container(Counter(before.values()).most_common(1)[0][0])
+
+    print(f"Killing {target} ({args.kill_mode}) after {args.kill_after}s...")
+    subprocess.run(["docker", args.kill_mode, target], check=True, capture_output=True)
+    killed_at = time.perf_counter()
+    restarted = False
+
+    while time.perf_counter() - killed_at < args.observe:
+        if args.down_time and not restarted and time.perf_counter() - killed_at >= args.down_time:
+            print(f"Restarting {target}...")
+            subprocess.run(["docker", "start", target], check=True, capture_output=True)
+            restarted = True
+        time.sleep(0.2)
+
+    publish_stop.set()
+    confirmed = set().union(*(stats["confirmed"] for stats in publisher_stats))
+    deliveries = Counter()
+    drain_deadline = time.perf_counter() + args.drain_timeout
+    while time.perf_counter() < drain_deadline:
+        deliveries = sum((stats["deliveries"] for stats in consumer_stats), Counter())
+        if confirmed <= deliveries.keys():
+            break
+        time.sleep(0.2)
+    consume_stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    if args.down_time and not restarted:
+        subprocess.run(["docker", "start", target], check=True, capture_output=True)
+
+    return {
+        "killed": target,
+        "kill_mode": args.kill_mode,
+        "nodes_before_kill": dict(sorted(Counter(before.values()).items())),
+        "published": sum(stats["published"] for stats in publisher_stats),
+        "confirmed": len(confirmed),
+        "delivered_unique": len(deliveries),
+        "lost_confirmed": len(confirmed - deliveries.keys()),
+        "duplicated": sum(count - 1 for count in deliveries.values() if count > 1),
+        "publisher_disconnects": sum(stats["disconnects"] for stats in publisher_stats),
+        "consumer_disconnects": sum(stats["disconnects"] for stats in consumer_stats),
+        "reconnect_time_ms": latency_summary([t for stats in publisher_stats + consumer_stats for t in stats["reconnect_times"]]),
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Smoke test, benchmark and failover test the RabbitMQ HAProxy load balancer")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5675, help="HAProxy AMQP frontend port")
+    parser.add_argument("--user", default="rabbitmquser")
+    parser.add_argument("--password", default="rabbitmqpass")
+    parser.add_argument("--vhost", default="hyperion")
+    parser.add_argument("--management-url", default="http://localhost:15675", help="Management API, used to locate connections")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("smoke", help="Publish and consume one message (default)")
+
+    bench = subparsers.add_parser("bench", help="Throughput and latency benchmark")
+    bench.add_argument("--publishers", type=int, default=4)
+    bench.add_argument("--consumers", type=int, default=4)
+    bench.add_argument("--duration", type=float, default=30, help="Publishing time in seconds")
+    bench.add_argument("--drain-timeout", type=float, default=30, help="Seconds to wait for consumers to drain after publishing stops")
+    bench.add_argument("--message-size", type=int, default=1024, help="Message body size in bytes")
+    bench.add_argument("--rate", type=float, default=0, help="Messages/sec per publisher, 0 for unlimited")
+    bench.add_argument("--prefetch", type=int, default=100)
+    bench.add_argument("--confirms", action=argparse.BooleanOptionalAction, default=True, help="Wait for a publisher confirm after every message")
+    bench.add_argument("--persistent", action=argparse.BooleanOptionalAction, default=True, help="Persistent (delivery_mode 2) or transient messages")
+    bench.add_argument("--queue-type", choices=("classic", "quorum"), default="quorum")
+    bench.add_argument("--queue", help="Queue name (default: bench_lb_<queue type>)")
+    bench.add_argument("--keep-queue", action="store_true", help="Do not delete the benchmark queue afterwards")
+    bench.add_argument("--json", metavar="PATH", help="Write results as JSON to PATH, or - for stdout")
+
+    distribution = subparsers.add_parser("distribution", help="Report how connections spread across backend nodes")
+    distribution.add_argument("--connections", type=int, default=30)
+    distribution.add_argument("--json", metavar="PATH", help="Write results as JSON to PATH, or - for stdout")
+
+    failover = subparsers.add_parser("failover", help="Kill a backend node under load and measure reconnects and message loss")
+    failover.add_argument("--publishers", type=int, default=6)
+    failover.add_argument("--consumers", type=int, default=3)
+    failover.add_argument("--rate", type=float, default=50, help="Messages/sec per publisher, 0 for unlimited")
+    failover.add_argument("--kill", default="auto", help="Container to kill, or 'auto' for the node serving the most test clients")
+    failover.add_argument("--kill-mode", choices=("kill", "stop"), default="kill", help="docker kill (abrupt) or docker stop (graceful)")
+    failover.add_argument("--kill-after", type=float, default=10, help="Seconds of steady load before the kill")
+    failover.add_argument("--observe", type=float, default=30, help="Seconds to keep running after the kill")
+    failover.add_argument("--down-time", type=float, default=20, help="Seconds before restarting the killed node, 0 to leave it down")
+    failover.add_argument("--drain-timeout", type=float, default=30)
+    failover.add_argument("--queue", default="failover_lb_queue")
+    failover.add_argument("--json", metavar="PATH", help="Write results as JSON to PATH, or - for stdout")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args.command = "smoke"
+    if args.command == "bench" and not args.queue:
+        # Separate names per type: redeclaring a queue with another type fails
+        args.queue = f"bench_lb_{args.queue_type}"
+    return args
+
 if __name__ == "__main__":
-    test_loadbalancer() 
\ No newline at end of file
+    args = parse_args()
+    if args.command == "smoke":
+        test_loadbalancer(args)
+    elif args.command == "bench":
+        try:
+            results = run_benchmark(args)
+        except pika.exceptions.AMQPConnectionError as e:
+            print(f"✗ Connection failed: {e}")
+            sys.exit(1)
+        print_benchmark_results(results)
+        write_json(results, args.json)
+    elif args.command == "distribution":
+        results = run_distribution(args)
+        print(f"Located {results['located']}/{results['connections']} connections:")
+        for node, count in results["per_node"].items():
+            print(f"  {node}: {count}")
+        print(f"Max deviation from an even spread: {results['max_deviation_pct']}%")
+        write_json(results, args.json)
+    elif args.command == "failover":
+        results = run_failover(args)
+        print(f"Killed {results['killed']}: {results['publisher_disconnects']} publisher and {results['consumer_disconnects']} consumer disconnects")
+        summary = results["reconnect_time_ms"]
+        if summary:
+            print(f"Reconnect time (ms): p50={summary['p50']} p99={summary['p99']} max={summary['max']}")
+        print(f"Confirmed {results['confirmed']}, delivered {results['delivered_unique']}, "
+              f"lost {results['lost_confirmed']}, duplicated {results['duplicated']}")
+        write_json(results, args.json)
@@ -0,0 +1,28 @@
+import generate_hyperion_compose as generator
+
+def build(**settings):
+    config = generator.HyperionConfig(**settings)
+    return generator.build_compose(config, generator.elasticsearch_plans(config))
+
+def test_partial_regeneration_after_broker_count_change():
+    existing = build(amount_of_rabbitmq_instances=1)
+    compose = build(amount_of_rabbitmq_instances=3)
+
+    merged, selected = generator.merge_services(existing, compose, ["rabbit*"])
+
+    assert generator.validate_compose(merged) == []
+    assert "rabbitmq" not in merged["services"]
+    # hyperion depended on the removed single broker, so it is regenerated as well
+    assert "hyperion" in selected
+    assert merged["services"]["hyperion"] == compose["services"]["hyperion"]
+
+def test_partial_regeneration_keeps_unrelated_services():
+    existing = build(amount_of_rabbitmq_instances=3)
+    existing["services"]["kibana"]["labels"] = ["edited-by-hand"]
+    compose = build(amount_of_rabbitmq_instances=3, rabbitmq_memory="4g")
+
+    merged, selected = generator.merge_services(existing, compose, ["rabbitmq-[0-9]"])
+
+    assert generator.validate_compose(merged) == []
+    assert merged["services"]["kibana"]["labels"] == ["edited-by-hand"]
+    assert "hyperion" in selected
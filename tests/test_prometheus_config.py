@@ -0,0 +1,58 @@
+import os
+import shutil
+import yaml
+import generate_hyperion_compose as generator
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def prometheus_workdir(tmp_path, monkeypatch):
+    """Run the prometheus.yml updates against a copy of the checked-in file."""
+    os.makedirs(tmp_path / "prometheus" / "hyperion")
+    shutil.copy(os.path.join(REPO, "prometheus", "hyperion", "prometheus.yml"),
+                tmp_path / "prometheus" / "hyperion" / "prometheus.yml")
+    monkeypatch.chdir(tmp_path)
+
+def load_jobs():
+    with open("prometheus/hyperion/prometheus.yml") as f:
+        config = yaml.safe_load(f)
+    return [job["job_name"] for job in config["scrape_configs"]]
+
+def test_gc_exporter_job_with_native_rabbitmq(tmp_path, monkeypatch):
+    prometheus_workdir(tmp_path, monkeypatch)
+    nodes = generator.elasticsearch_nodes(generator.HyperionConfig(amount_of_nodes=2))
+
+    generator.update_prometheus_config(nodes)
+    generator.update_prometheus_rabbitmq_config(3, mode="native")
+    generator.update_prometheus_gc_config(nodes)
+
+    jobs = load_jobs()
+    assert "rabbitmq_exporter" not in jobs
+    assert jobs.index("es_gc_exporter") == jobs.index("elasticsearch_exporter") + 1
+
+def test_gc_exporter_job_appended_without_trailing_newline(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "prometheus" / "hyperion")
+    (tmp_path / "prometheus" / "hyperion" / "prometheus.yml").write_text(
+        "scrape_configs:\n  - job_name: prometheus\n    static_configs:\n      - targets: [\"prometheus:9090\"]")
+    monkeypatch.chdir(tmp_path)
+    nodes = generator.elasticsearch_nodes(generator.HyperionConfig(amount_of_nodes=1))
+
+    generator.update_prometheus_gc_config(nodes)
+    assert load_jobs() == ["prometheus", "es_gc_exporter"]
+
+    generator.update_prometheus_gc_config([])
+    assert load_jobs() == ["prometheus"]
+
+def test_exporter_mode_switch_rewrites_elasticsearch_jobs(tmp_path, monkeypatch):
+    prometheus_workdir(tmp_path, monkeypatch)
+    nodes = generator.elasticsearch_nodes(generator.HyperionConfig(amount_of_nodes=3))
+
+    generator.update_prometheus_config(nodes, exporter_mode="cluster", indices_interval="5m")
+    jobs = load_jobs()
+    assert jobs.index("elasticsearch_exporter_indices") == jobs.index("elasticsearch_exporter") + 1
+    assert jobs.count("elasticsearch_exporter") == 1
+
+    generator.update_prometheus_config(nodes)
+    jobs = load_jobs()
+    assert "elasticsearch_exporter_indices" not in jobs
+    assert jobs.count("elasticsearch_exporter") == 1
+    assert jobs[-1] == "nodeos_custom_exporter"